@@ -10,24 +10,32 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiohttp import web
 import json
+import hashlib
 import aiohttp_cors
-from collections import defaultdict
+from email.utils import format_datetime
 
 from config import (
     BOT_TOKEN, ADMIN_IDS, LOG_LEVEL, LOG_LEVEL_HANDLERS, LOG_LEVEL_DATABASE,
-    LOG_LEVEL_AIOGRAM, LOG_DIR, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, SHOP_CATEGORIES,
+    LOG_LEVEL_AIOGRAM, LOG_DIR, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT,
     WEBAPP_URL, DATABASE_URL
 )
 from handlers import main_router
 from handlers import errors # Обработчик ошибок подключаем отдельно
-from database.pool import get_pool, close_pool
+from database.pool import get_pool, close_pool, get_pool_stats
 from database.db_setup import init_db
+from database.listener import start_listener, stop_listener
 from database.db import (
     ensure_data_files_exist,
-    get_all_products,
-    get_all_promocodes
+    load_blocked_users,
+    load_prices,
+    get_price_table
 )
 from utils.bot_instance import bot_instance
+from utils.promocodes import validate_promocode
+from utils.broadcast import resume_broadcast_jobs, stop_broadcast_jobs, RESUME_INTERVAL_MINUTES
+from utils.charts import shutdown_chart_executor
+from utils.json_files import shutdown_json_executor
+from utils.catalog import get_catalog, get_category_page, parse_fields, search_products
 from utils.constants import (CAR_SIZES, POLISHING_TYPES, CERAMICS_TYPES,
                              WRAPPING_TYPES, INTERIOR_TYPES, DIRT_LEVELS)
 from middlewares.block_middleware import BlockMiddleware
@@ -79,79 +87,144 @@ def _create_api_response(
         return web.Response(status=status)
     return web.json_response(data, status=status)
 
+def _is_not_modified(request: web.Request, etags: list[str], last_modified: datetime) -> bool:
+    """Проверяет условные заголовки запроса (If-None-Match имеет приоритет над If-Modified-Since)."""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or any(etag in tags for etag in etags)
+    if_modified_since = request.if_modified_since
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def _select_encoding(request: web.Request, available: dict[str, bytes]) -> str:
+    """Выбирает лучшую из доступных кодировок по заголовку Accept-Encoding (br > gzip > identity)."""
+    accepted = {}
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+
+    for encoding in ('br', 'gzip'):
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return 'identity'
+
+
+def _variant_etag(etag: str, encoding: str) -> str:
+    """Строит ETag для конкретной кодировки: у разных представлений сильные ETag должны отличаться."""
+    return etag if encoding == 'identity' else f'{etag[:-1]}-{encoding}"'
+
+
+def _precompressed_response(
+    request: web.Request, variants: dict[str, bytes], etag: str, last_modified: datetime
+) -> web.Response:
+    """Отдает заранее сериализованный и сжатый JSON с поддержкой условных запросов (304)."""
+    encoding = _select_encoding(request, variants)
+    headers = {
+        'ETag': _variant_etag(etag, encoding),
+        'Last-Modified': format_datetime(last_modified, usegmt=True),
+        # Клиент может хранить ответ, но обязан перепроверять его через ETag
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding',
+    }
+
+    all_etags = [_variant_etag(etag, variant) for variant in variants]
+    if _is_not_modified(request, all_etags, last_modified):
+        return web.Response(status=304, headers=headers)
+
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return web.Response(body=variants[encoding], content_type='application/json', charset='utf-8', headers=headers)
+
+
 async def products_api_handler(request: web.Request) -> web.Response:
     """
-    Отдает каталог товаров в формате JSON для WebApp, динамически группируя по категориям и подкатегориям
-    на основе данных из products.json.
-    Ожидается, что у каждого товара в `products.json` есть поле "category".
-    Опционально может быть поле "subcategory".
+    Отдает каталог товаров в формате JSON для WebApp, сгруппированный по категориям и подкатегориям.
+    Каталог собирается и сжимается (gzip, brotli) один раз на версию товаров и отдается из кэша.
+    Повторные запросы с If-None-Match / If-Modified-Since получают 304.
     """
-    logger = logging.getLogger(__name__)
+    catalog = await get_catalog()
+    return _precompressed_response(request, catalog['variants'], catalog['etag'], catalog['last_modified'])
 
-    # Логируем origin входящего запроса для отладки CORS
-    origin = request.headers.get('Origin')
-    logger.info(f"API request for products from origin: {origin}, method: {request.method}")
-
-    logger.info("Processing GET request for products.")
-    all_products = await get_all_products()
-    logger.info(f"Loaded {len(all_products)} products from the database.")
-    if not all_products:
-        logger.warning("Products table is empty or could not be read. Returning empty catalog.")
-
-
-    # Динамическое построение категорий из данных в products.json
-    # Используем defaultdict для более простого и чистого кода
-    categories = defaultdict(lambda: defaultdict(list))
-
-    for product in all_products:
-        category_name = (product.get("category") or "Без категории").strip() or "Без категории"
-        subcategory_name = (product.get("subcategory") or "Основное").strip() or "Основное"
-        categories[category_name][subcategory_name].append(product)
-
-    # Добавляем пустые категории из конфига, если их еще нет в каталоге
-    for category_name in SHOP_CATEGORIES:
-        if category_name not in categories:
-            categories[category_name] = defaultdict(list)
-            
-    # Преобразование в формат ответа, который ожидает фронтенд
-    # [ { "name": "ИмяКатегории", "subcategories": [ { "name": "ИмяПодкатегории", "products": [...] } ] } ]
-    
-    def _transform_product_for_frontend(product: dict) -> dict:
-        """
-        Преобразует ключи объекта продукта в формат,
-        более удобный для JavaScript (camelCase и короткие имена),
-        а также заменяет HTML-теги переноса на символы новой строки.
-        """
-        new_product = product.copy()
-        if 'image_url' in new_product:
-            new_product['imageUrl'] = new_product.pop('image_url') # Стандартный camelCase для JS
-        if 'detail_images' in new_product:
-            new_product['detailImages'] = new_product.pop('detail_images')
-        
-        if 'description' in new_product and isinstance(new_product['description'], str):
-            # Заменяем HTML-сущность <br> и сам тег на символ переноса строки \n,
-            # который с большей вероятностью будет правильно обработан CSS на фронтенде.
-            new_product['description'] = new_product['description'].replace('&lt;br&gt;', '\n').replace('<br>', '\n')
-
-        return new_product
-
-    response_data = []
-    for cat_name, subcategories in sorted(categories.items()): # Сортируем для стабильного порядка
-        subcategories_list = [
-            # Применяем трансформацию к каждому продукту
-            {"name": sub_name, "products": [_transform_product_for_frontend(p) for p in products] if products else []}
-            for sub_name, products in sorted(subcategories.items())
-        ]
-
-        response_data.append({"name": cat_name, "subcategories": subcategories_list})
-
-    # Логируем итоговый результат перед отправкой
-    num_categories = len(response_data)
-    num_subcategories = sum(len(cat["subcategories"]) for cat in response_data)
-    logger.info(f"Sending catalog data to frontend. "
-                f"Total categories: {num_categories}, total subcategories: {num_subcategories}.")
-
-    return _create_api_response(response_data)
+
+async def catalog_categories_handler(request: web.Request) -> web.Response:
+    """Отдает структуру категорий и подкатегорий с количеством товаров - для первой отрисовки меню."""
+    catalog = await get_catalog()
+    skeleton = catalog['skeleton']
+    return _precompressed_response(request, skeleton['variants'], skeleton['etag'], catalog['last_modified'])
+
+
+async def catalog_products_handler(request: web.Request) -> web.Response:
+    """
+    Отдает страницу товаров одной категории.
+    Параметры: category (обязательный), subcategory, cursor, limit, fields (через запятую).
+    По умолчанию описание и детальные фото не включаются.
+    """
+    category = request.query.get('category')
+    if not category:
+        return _create_api_response({"error": "category is required"}, status=400)
+    try:
+        limit = int(request.query.get('limit', 20))
+    except ValueError:
+        return _create_api_response({"error": "limit must be an integer"}, status=400)
+
+    catalog = await get_catalog()
+    # Страница однозначно определяется версией каталога и параметрами запроса
+    query_key = "&".join(f"{key}={value}" for key, value in sorted(request.query.items()))
+    page_hash = hashlib.sha1(f"{catalog['etag']}?{query_key}".encode('utf-8')).hexdigest()
+    etag = f'"{page_hash}"'
+    if _is_not_modified(request, [etag], catalog['last_modified']):
+        return web.Response(status=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+    try:
+        page = get_category_page(
+            catalog, category,
+            cursor=request.query.get('cursor'),
+            limit=limit,
+            fields=parse_fields(request.query.get('fields')),
+            subcategory=request.query.get('subcategory'),
+        )
+    except KeyError:
+        return _create_api_response({"error": "category not found"}, status=404)
+    except ValueError:
+        return _create_api_response({"error": "invalid cursor"}, status=400)
+
+    response = web.json_response(page, dumps=lambda data: json.dumps(data, ensure_ascii=False))
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+async def products_search_handler(request: web.Request) -> web.Response:
+    """
+    Полнотекстовый поиск товаров по названию и описанию с учетом префиксов и опечаток.
+    Параметры: q (строка запроса), limit, fields (через запятую).
+    """
+    query = request.query.get('q', '').strip()
+    try:
+        limit = int(request.query.get('limit', 20))
+    except ValueError:
+        return _create_api_response({"error": "limit must be an integer"}, status=400)
+
+    catalog = await get_catalog()
+    items = search_products(catalog, query, limit=limit, fields=parse_fields(request.query.get('fields'))) if query else []
+    return web.json_response({"items": items}, dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+
+async def catalog_product_handler(request: web.Request) -> web.Response:
+    """Отдает полную карточку одного товара (с описанием и детальными фото)."""
+    catalog = await get_catalog()
+    product = catalog['products_by_id'].get(request.match_info['product_id'])
+    if product is None:
+        return _create_api_response({"error": "product not found"}, status=404)
+    return web.json_response(product, dumps=lambda data: json.dumps(data, ensure_ascii=False))
 
 
 async def validate_promocode_handler(request: web.Request) -> web.Response:
@@ -161,37 +234,49 @@ async def validate_promocode_handler(request: web.Request) -> web.Response:
     origin = request.headers.get('Origin')
     logger.debug(f"API request to validate promocode '{promocode}' from origin: {origin}, method: {request.method}")
 
+    promo_data, reason = await validate_promocode(promocode)
+
     # Guard Clause: Промокод не предоставлен или не существует
-    if not promocode or promocode not in (promocodes_db := await get_all_promocodes()):
+    if reason == "not_found":
         logger.debug(f"Promocode '{promocode}' is invalid or not found.")
         return _create_api_response({"valid": False})
 
-    promo_data = promocodes_db[promocode]
-    today = datetime.now().date()
+    # Guard Clause: Истек срок действия, исчерпан лимит или неверный формат данных
+    if reason:
+        logger.debug(f"Promocode {promocode} is not valid: {reason}.")
+        return _create_api_response({"valid": False, "reason": reason})
 
-    try:
-        start_date = datetime.strptime(promo_data.get("start_date"), "%Y-%m-%d").date()
-        end_date = datetime.strptime(promo_data.get("end_date"), "%Y-%m-%d").date()
+    # Успешный случай
+    discount = promo_data.get("discount")
+    logger.debug(f"Promocode {promocode} is valid, discount: {discount}%")
+    return _create_api_response({"valid": True, "discount": discount})
+
+async def health_handler(request: web.Request) -> web.Response:
+    """Проверка работоспособности. Эндпоинт публичный, поэтому внутреннее состояние не раскрывается."""
+    return web.json_response({"status": "ok"})
 
-        # Guard Clause: Срок действия промокода истек
-        if not (start_date <= today <= end_date):
-            logger.debug(f"Promocode {promocode} is expired.")
-            return _create_api_response({"valid": False, "reason": "expired"})
+# Состояние пула соединений пишется в лог, а не отдается через публичный /api/health
+POOL_STATS_LOG_INTERVAL_MINUTES = 15
 
-        # Guard Clause: Проверка лимита использований
-        if (usage_limit := promo_data.get("usage_limit")) is not None:
-            if promo_data.get("times_used", 0) >= usage_limit:
-                logger.debug(f"Promocode {promocode} has reached its usage limit.")
-                return _create_api_response({"valid": False, "reason": "limit_reached"})
+def log_pool_stats() -> None:
+    """Пишет в лог текущее состояние пула соединений с БД."""
+    logging.info(f"Состояние пула соединений с БД: {get_pool_stats()}")
 
-        # Успешный случай
-        discount = promo_data.get("discount")
-        logger.debug(f"Promocode {promocode} is valid, discount: {discount}%")
-        return _create_api_response({"valid": True, "discount": discount})
+async def notify_admins_about_price_gaps(bot: Bot) -> None:
+    """Отправляет администраторам список сочетаний услуг, для которых в прайс-листе нет цены."""
+    price_table = await get_price_table()
+    if not price_table.missing:
+        return
+    text = (
+        f"⚠️ В прайс-листе нет цен для {len(price_table.missing)} вариантов услуг "
+        f"(клиенты увидят стоимость 0):\n" + "\n".join(f"• {item}" for item in price_table.missing[:50])
+    )
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(admin_id, text)
+        except Exception as e:
+            logging.error(f"Не удалось отправить администратору {admin_id} отчет о прайс-листе: {e}")
 
-    except (ValueError, KeyError, TypeError):
-        logger.warning(f"Promocode {promocode} has invalid data format: {promo_data}")
-        return _create_api_response({"valid": False, "reason": "invalid_format"})
 
 async def main() -> None:
     # Тестовый комментарий для проверки отображения diff
@@ -228,6 +313,13 @@ async def main() -> None:
     # Инициализируем таблицы в базе данных
     await init_db()
 
+    # Загружаем заблокированных пользователей в память и подписываемся на изменения
+    # от других реплик бота (LISTEN/NOTIFY)
+    await load_blocked_users()
+    await start_listener()
+    # Прайс-лист услуг держим в памяти, чтобы расчет стоимости не читал файл
+    await load_prices()
+
     # Наполняем БД начальными данными (товары) и создаем JSON-файлы.
     # Эту строку нужно выполнять только при самой первой настройке.
     # ВНИМАНИЕ: Следующая строка выполняет принудительную синхронизацию товаров из JSON-файла.
@@ -261,7 +353,12 @@ async def main() -> None:
 
     # Добавляем API-ручки
     app.router.add_get("/api/products", products_api_handler)
+    app.router.add_get("/api/products/search", products_search_handler)
+    app.router.add_get("/api/catalog/categories", catalog_categories_handler)
+    app.router.add_get("/api/catalog/products", catalog_products_handler)
+    app.router.add_get("/api/catalog/products/{product_id}", catalog_product_handler)
     app.router.add_get("/api/validate_promocode", validate_promocode_handler)
+    app.router.add_get("/api/health", health_handler)
 
     # Настраиваем CORS централизованно и более надежно
     if WEBAPP_URL:
@@ -296,6 +393,19 @@ async def main() -> None:
         await schedule_existing_reminders()
         schedule_reports()
         scheduler.start()
+        # Продолжаем рассылки, прерванные перезапуском
+        await resume_broadcast_jobs(bot)
+        # Периодически подхватываем рассылки, брошенные упавшим экземпляром или остановленные ошибкой
+        scheduler.add_job(
+            resume_broadcast_jobs, 'interval', minutes=RESUME_INTERVAL_MINUTES, args=[bot],
+            id="resume_broadcast_jobs", replace_existing=True
+        )
+        scheduler.add_job(
+            log_pool_stats, 'interval', minutes=POOL_STATS_LOG_INTERVAL_MINUTES,
+            id="log_pool_stats", replace_existing=True
+        )
+        # Сообщаем администраторам о вариантах услуг без цены, пока их не увидели клиенты
+        await notify_admins_about_price_gaps(bot)
 
         # --- Переключаемся на вебхуки для продакшена ---
         # Render предоставляет публичный URL в переменной окружения RENDER_EXTERNAL_URL
@@ -327,8 +437,15 @@ async def main() -> None:
             await dp.start_polling(bot)
     finally:
         logging.info("Остановка бота и веб-сервера...")
+        # Планировщик останавливаем первым: иначе его задачи (возобновление рассылок, пересчет
+        # статистики) могли бы запуститься во время остановки и снова открыть закрытый пул
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        await stop_broadcast_jobs() # Сохраняем прогресс рассылок, пока пул еще открыт
+        shutdown_chart_executor()
+        shutdown_json_executor()
+        await stop_listener()
         await close_pool() # Закрываем пул соединений
-        scheduler.shutdown()
         await runner.cleanup()
         await bot.session.close()
 
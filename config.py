@@ -59,6 +59,15 @@ DAILY_REPORT_TIME = _get_env_var("DAILY_REPORT_TIME", "21:00")
 WEEKLY_REPORT_DAY_OF_WEEK = _get_env_var("WEEKLY_REPORT_DAY_OF_WEEK", "sun")
 WEEKLY_REPORT_TIME = _get_env_var("WEEKLY_REPORT_TIME", "22:00")
 MAX_PARALLEL_BOOKINGS = _get_env_var("MAX_PARALLEL_BOOKINGS", 12, int)
+# Время жизни кэша промокодов в секундах
+PROMOCODE_CACHE_TTL = _get_env_var("PROMOCODE_CACHE_TTL", 30, int)
+# Время жизни кэшей занятости слотов и доступности дней в секундах: страховка на случай потерянного уведомления
+BOOKING_CACHE_TTL = _get_env_var("BOOKING_CACHE_TTL", 300, int)
+# Рассылки: лимит сообщений в секунду (глобальный лимит Telegram ~30/сек) и число параллельных отправителей
+BROADCAST_RATE_LIMIT = _get_env_var("BROADCAST_RATE_LIMIT", 25, int)
+BROADCAST_CONCURRENCY = _get_env_var("BROADCAST_CONCURRENCY", 8, int)
+# Аренда задания рассылки: если обработчик не продлевает ее дольше этого времени, задание может подхватить другой экземпляр
+BROADCAST_JOB_LEASE_SECONDS = _get_env_var("BROADCAST_JOB_LEASE_SECONDS", 60, int)
 # Таймаут для внешних API запросов в секундах
 API_REQUEST_TIMEOUT = _get_env_var("API_REQUEST_TIMEOUT", 10, int)
 
@@ -70,3 +79,12 @@ SHOP_CATEGORIES = [
 
 # --- Database Configuration ---
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Пул соединений asyncpg: минимальное и максимальное число соединений
+DB_POOL_MIN_SIZE = _get_env_var("DB_POOL_MIN_SIZE", 2, int)
+DB_POOL_MAX_SIZE = _get_env_var("DB_POOL_MAX_SIZE", 10, int)
+# Через сколько секунд простоя закрывать лишние соединения (сверх минимума); 0 - не закрывать
+DB_POOL_MAX_INACTIVE_LIFETIME = _get_env_var("DB_POOL_MAX_INACTIVE_LIFETIME", 300, float)
+# Размер кэша подготовленных запросов на соединение. 0 - для PgBouncer в режиме transaction
+DB_STATEMENT_CACHE_SIZE = _get_env_var("DB_STATEMENT_CACHE_SIZE", 100, int)
+# Таймаут выполнения одного запроса в секундах (долгие выгрузки задают свой таймаут)
+DB_COMMAND_TIMEOUT = _get_env_var("DB_COMMAND_TIMEOUT", 30, float)
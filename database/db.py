@@ -1,17 +1,31 @@
 import asyncio
-import json
 import logging
 import os
-from datetime import datetime
-import tempfile
-from typing import Any
+import re
+import socket
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, date, timedelta
+import time
+from types import MappingProxyType
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Mapping
+from config import MAX_PARALLEL_BOOKINGS, PROMOCODE_CACHE_TTL, BOOKING_CACHE_TTL, BROADCAST_JOB_LEASE_SECONDS
+from utils.constants import WORKING_HOURS
+from utils.prices import compile_price_index
+from utils.json_files import read_json, write_json
 from .pool import get_pool
+from .listener import register_channel, notify
 
 class SlotAlreadyBookedError(Exception):
     """Исключение для случаев, когда временной слот уже полностью забронирован."""
     pass
 
 
+class PromocodeRedemptionError(Exception):
+    """Исключение для случаев, когда промокод заказа больше нельзя погасить (срок, лимит)."""
+    pass
+
+
 logger = logging.getLogger(__name__)
 
 DATA_DIR = "data"
@@ -28,7 +42,7 @@ _DEFAULT_EMPTY_VALUES = {
 }
 
 async def _read_data(file_path: str) -> Any:
-    """Асинхронно читает данные из JSON файла с использованием блокировки."""
+    """Асинхронно читает данные из JSON файла (в пуле потоков) с использованием блокировки."""
     lock = file_locks.get(file_path)
     if not lock:
         raise ValueError(f"No lock found for file: {file_path}")
@@ -36,35 +50,28 @@ async def _read_data(file_path: str) -> Any:
     default_value = _DEFAULT_EMPTY_VALUES.get(file_path, [])
 
     async with lock:
-        if not os.path.exists(file_path):
-            return default_value
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Обработка случая, когда файл пуст, но существует
-                return data if data else default_value
-        except json.JSONDecodeError:
+            data = await read_json(file_path)
+        except FileNotFoundError:
+            return default_value
+        except ValueError:
             logger.error(f"Ошибка декодирования JSON в файле: {file_path}. Возвращен пустой объект.")
             return default_value
+        # Обработка случая, когда файл пуст, но существует
+        return data if data else default_value
 
 
 async def _write_data(file_path: str, data: Any) -> None:
-    """Асинхронно записывает данные в JSON файл с использованием блокировки и атомарной записи."""
+    """Асинхронно записывает данные в JSON файл с использованием блокировки и атомарной записи (с fsync)."""
     lock = file_locks.get(file_path)
     if not lock:
         raise ValueError(f"No lock found for file: {file_path}")
 
     async with lock:
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        # Используем временный файл и атомарное переименование для безопасной записи
-        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path))
         try:
-            with os.fdopen(temp_fd, 'w', encoding='utf-8') as temp_f:
-                json.dump(data, temp_f, ensure_ascii=False, indent=4)
-            os.replace(temp_path, file_path)
+            await write_json(file_path, data)
         except Exception as e:
             logger.error(f"Ошибка при записи в файл {file_path}: {e}")
-            os.remove(temp_path) # Удаляем временный файл в случае ошибки
             raise
 
 
@@ -167,8 +174,9 @@ async def _seed_initial_products():
                         product.get('image_url'),
                         category_id,
                         product.get('subcategory'),
-                        json.dumps(product.get('detail_images')) if product.get('detail_images') else None
+                        product.get('detail_images') or None
                     )
+        await notify_products_changed(connection)
         logger.info("Начальные данные для товаров успешно загружены в базу данных.")
 
 async def add_admin(user_id: int) -> bool:
@@ -204,23 +212,44 @@ async def get_admin_list() -> list[dict]:
     return [dict(rec) for rec in records]
 
 
-async def get_user_ids_by_phone_numbers(phone_numbers: list[str]) -> dict[str, int]:
+def _normalize_phone(phone: str | None) -> str | None:
     """
-    Находит user_id для предоставленного списка номеров телефонов, игнорируя нецифровые символы.
-    Возвращает словарь { 'номер_телефона_из_бд': user_id }.
+    Приводит номер к формату 7XXXXXXXXXX: оставляет только цифры, заменяет ведущую 8 на 7
+    и добавляет 7 к десятизначным номерам. Совпадает с вычислением users.phone_normalized.
+    """
+    digits = re.sub(r'\D', '', phone or '')
+    if len(digits) == 11 and digits[0] in '78':
+        return '7' + digits[1:]
+    if len(digits) == 10 and digits[0] == '9':
+        return '7' + digits
+    return digits or None
+
+async def get_user_ids_by_phone_numbers(phone_numbers: list[str]) -> dict[str, list[int]]:
+    """
+    Находит user_id для предоставленного списка номеров телефонов.
+    Номера сравниваются в нормализованном виде, поэтому +7, 8 и формат записи не важны.
+    Возвращает словарь { 'номер_из_запроса': [user_id, ...] }.
     Номера, не найденные в БД, не включаются в результат.
     """
-    if not phone_numbers:
+    normalized = {number: _normalize_phone(number) for number in phone_numbers}
+    normalized = {number: value for number, value in normalized.items() if value}
+    if not normalized:
         return {}
 
     pool = await get_pool()
-    # Ищем по номерам, очищенным от всего, кроме цифр.
-    # Это позволяет находить совпадения вне зависимости от формата (+7, 8, скобки, тире).
-    sql = "SELECT phone_number, user_id FROM users WHERE regexp_replace(phone_number, '\\D', '', 'g') = ANY($1::text[]);"
+    # Поиск по индексу idx_users_phone_normalized, одним запросом для всего списка
+    sql = "SELECT phone_normalized, user_id FROM users WHERE phone_normalized = ANY($1::text[]);"
     async with pool.acquire() as connection:
-        records = await connection.fetch(sql, phone_numbers)
-        # Возвращаем оригинальный номер из БД и ID
-        return {rec['phone_number']: rec['user_id'] for rec in records}
+        records = await connection.fetch(sql, list(set(normalized.values())))
+
+    user_ids_by_phone = defaultdict(list)
+    for rec in records:
+        user_ids_by_phone[rec['phone_normalized']].append(rec['user_id'])
+    return {
+        number: user_ids_by_phone[value]
+        for number, value in normalized.items() if value in user_ids_by_phone
+    }
+
 # --- Функции для работы с товарами и промокодами ---
 
 async def get_all_products() -> list[dict]:
@@ -236,23 +265,123 @@ async def get_all_products() -> list[dict]:
     """
     async with pool.acquire() as connection:
         records = await connection.fetch(sql)
-        # Преобразуем asyncpg.Record в словари и парсим JSONB поля
-        products = []
-        for rec in records:
-            product_dict = dict(rec)
-            if product_dict.get('detail_images') and isinstance(product_dict['detail_images'], str):
-                product_dict['detail_images'] = json.loads(product_dict['detail_images'])
-            products.append(product_dict)
-        return products
+        # JSONB поле detail_images приходит уже разобранным (кодек в database.pool)
+        return [dict(rec) for rec in records]
+
+
+# --- Версия каталога товаров ---
+# Счетчик увеличивается при каждом изменении таблицы products (локально или по
+# уведомлению другой реплики). Кэши каталога сравнивают свою версию с текущей.
+PRODUCTS_CHANNEL = "products_changed"
+_products_version = 0
+
+
+def get_products_version() -> int:
+    """Возвращает текущую версию каталога товаров в этом процессе."""
+    return _products_version
+
+
+def _bump_products_version(payload: str = "") -> None:
+    global _products_version
+    _products_version += 1
+
+
+async def _resync_products_version() -> None:
+    _bump_products_version()
+
+
+register_channel(PRODUCTS_CHANNEL, _bump_products_version, _resync_products_version)
+
+
+async def notify_products_changed(connection) -> None:
+    """Инвалидирует кэши каталога в этом процессе и уведомляет другие реплики."""
+    _bump_products_version()
+    await notify(connection, PRODUCTS_CHANNEL, "")
+
+
+# --- Прайс-лист услуг ---
+# Цены читаются из файла один раз и хранятся в памяти неизменяемым снимком с номером версии.
+# update_prices записывает файл и подменяет снимок одним присваиванием, поэтому расчет
+# стоимости записи не обращается к диску и не ждет блокировок.
+PRICES_CHANNEL = "prices_changed"
+# Отправитель уведомления: свое уведомление этот процесс пропускает, снимок у него уже свежий
+_PRICES_SENDER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+@dataclass(frozen=True)
+class PriceTable:
+    """
+    Неизменяемый снимок прайс-листа. Вложенные словари доступны только для чтения.
+    index - плоская таблица {ключ цены: цена} (см. utils.prices.price_key),
+    missing - сочетания параметров услуг, для которых в прайс-листе нет цены.
+    """
+    version: int
+    prices: Mapping[str, Any]
+    index: Mapping[tuple, int]
+    missing: tuple[str, ...]
+
+
+_price_table: PriceTable | None = None
+
+
+def _freeze_prices(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze_prices(item) for key, item in value.items()})
+    return value
+
+
+def _set_price_table(prices_data: dict) -> PriceTable:
+    global _price_table
+    version = _price_table.version + 1 if _price_table else 1
+    index, missing = compile_price_index(prices_data)
+    if missing:
+        logger.warning(f"Prices version {version}: no price for {len(missing)} combinations: {', '.join(missing)}")
+    _price_table = PriceTable(
+        version=version, prices=_freeze_prices(prices_data),
+        index=MappingProxyType(index), missing=tuple(missing)
+    )
+    return _price_table
+
+
+async def load_prices() -> None:
+    """Загружает (или перезагружает) прайс-лист из файла в память."""
+    table = _set_price_table(await _read_data(PRICES_FILE))
+    logger.info(f"Loaded prices into memory (version {table.version}).")
 
 
-async def get_all_prices() -> dict:
-    """Читает все цены из файла."""
-    return await _read_data(PRICES_FILE)
+async def get_price_table() -> PriceTable:
+    """Возвращает текущий снимок прайс-листа (при первом обращении загружает его из файла)."""
+    if _price_table is None:
+        await load_prices()
+    return _price_table
+
+
+async def get_all_prices() -> Mapping[str, Any]:
+    """Возвращает все цены из памяти (только для чтения)."""
+    return (await get_price_table()).prices
 
 async def update_prices(new_prices_data: dict) -> None:
-    """Полностью перезаписывает файл с ценами."""
+    """Полностью перезаписывает файл с ценами и подменяет снимок в памяти."""
     await _write_data(PRICES_FILE, new_prices_data)
+    table = _set_price_table(new_prices_data)
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        await notify(connection, PRICES_CHANNEL, _PRICES_SENDER_ID)
+    logger.info(f"Prices updated (version {table.version}).")
+
+
+def _invalidate_prices(payload: str = "") -> None:
+    # Другая реплика изменила цены: перечитаем файл при следующем обращении
+    global _price_table
+    if payload != _PRICES_SENDER_ID:
+        _price_table = None
+
+
+async def _resync_prices() -> None:
+    _invalidate_prices()
+
+
+register_channel(PRICES_CHANNEL, _invalidate_prices, _resync_prices)
 
 
 async def add_blocked_date(date_str: str) -> None:
@@ -260,16 +389,22 @@ async def add_blocked_date(date_str: str) -> None:
     pool = await get_pool()
     # TO_DATE преобразует строку в тип DATE, который хранится в БД
     sql = "INSERT INTO blocked_dates (blocked_date) VALUES (TO_DATE($1, 'DD.MM.YYYY')) ON CONFLICT DO NOTHING;"
+    blocked_date = datetime.strptime(date_str, '%d.%m.%Y').date()
     async with pool.acquire() as connection:
         await connection.execute(sql, date_str)
+        _set_blocked_day(blocked_date, True)
+        await notify(connection, BLOCKED_DATES_CHANNEL, f"block:{blocked_date.isoformat()}")
     logger.info(f"Date {date_str} has been blocked by admin.")
 
 async def remove_blocked_date(date_str: str) -> None:
     """Удаляет дату из списка заблокированных в БД."""
     pool = await get_pool()
     sql = "DELETE FROM blocked_dates WHERE blocked_date = TO_DATE($1, 'DD.MM.YYYY');"
+    blocked_date = datetime.strptime(date_str, '%d.%m.%Y').date()
     async with pool.acquire() as connection:
         await connection.execute(sql, date_str)
+        _set_blocked_day(blocked_date, False)
+        await notify(connection, BLOCKED_DATES_CHANNEL, f"unblock:{blocked_date.isoformat()}")
     logger.info(f"Date {date_str} has been unblocked by admin.")
 
 async def get_blocked_dates() -> list[str]:
@@ -282,24 +417,62 @@ async def get_blocked_dates() -> list[str]:
 
 # --- Новые функции для работы с промокодами через PostgreSQL ---
 
+def _format_promocode_record(rec) -> dict:
+    """Преобразует запись промокода из БД в привычный dict."""
+    return {
+        "type": rec['promo_type'],
+        "discount": rec['discount_percent'],
+        "start_date": rec['start_date'].strftime("%Y-%m-%d"),
+        "end_date": rec['end_date'].strftime("%Y-%m-%d"),
+        "usage_limit": rec['usage_limit'],
+        "times_used": rec['times_used']
+    }
+
 async def get_all_promocodes() -> dict:
     """Читает все промокоды из базы данных и возвращает их в виде словаря."""
     pool = await get_pool()
     async with pool.acquire() as connection:
         records = await connection.fetch("SELECT * FROM promocodes ORDER BY created_at DESC")
         # Преобразуем список записей в словарь, как было раньше, для совместимости
-        promocodes_dict = {
-            rec['code']: {
-                "type": rec['promo_type'],
-                "discount": rec['discount_percent'],
-                "start_date": rec['start_date'].strftime("%Y-%m-%d"),
-                "end_date": rec['end_date'].strftime("%Y-%m-%d"),
-                "usage_limit": rec['usage_limit'],
-                "times_used": rec['times_used']
-            } for rec in records
-        }
+        promocodes_dict = {rec['code']: _format_promocode_record(rec) for rec in records}
         return promocodes_dict
 
+# Кэш поиска одного промокода: код -> (время истечения, данные или None).
+# Несуществующие коды тоже кэшируются - WebApp проверяет код на каждое нажатие клавиши.
+# Ключи приходят из публичного API, поэтому размер кэша ограничен, а устаревшие записи удаляются.
+_promocode_cache: dict[str, tuple[float, dict | None]] = {}
+PROMOCODE_CACHE_MAX_SIZE = 1024
+
+
+def _cache_promocode(code: str, promo_data: dict | None) -> None:
+    """Сохраняет результат поиска промокода, вытесняя устаревшие и самые старые записи."""
+    now = time.monotonic()
+    # Перевставляем ключ в конец. Время жизни у всех записей одинаковое, поэтому порядок
+    # вставки совпадает с порядком истечения: устаревшие записи всегда в начале словаря
+    _promocode_cache.pop(code, None)
+    while _promocode_cache:
+        oldest_code, (expires_at, _) = next(iter(_promocode_cache.items()))
+        if expires_at > now and len(_promocode_cache) < PROMOCODE_CACHE_MAX_SIZE:
+            break
+        del _promocode_cache[oldest_code]
+    _promocode_cache[code] = (now + PROMOCODE_CACHE_TTL, promo_data)
+
+async def get_promocode(code: str) -> dict | None:
+    """Возвращает данные одного промокода (поиск по первичному ключу с коротким кэшем) или None."""
+    if not code:
+        return None
+    code = code.upper()
+    cached = _promocode_cache.get(code)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        record = await connection.fetchrow("SELECT * FROM promocodes WHERE code = $1;", code)
+    promo_data = _format_promocode_record(record) if record else None
+    _cache_promocode(code, promo_data)
+    return promo_data
+
 async def add_promocode_to_db(code: str, discount: int, start_date: str, end_date: str, usage_limit: int | None, promo_type: str) -> None:
     """Добавляет или обновляет промокод в базе данных."""
     pool = await get_pool()
@@ -316,20 +489,40 @@ async def add_promocode_to_db(code: str, discount: int, start_date: str, end_dat
     """
     async with pool.acquire() as connection:
         await connection.execute(sql, code.upper(), promo_type, discount, start_date, end_date, usage_limit)
+    _promocode_cache.pop(code.upper(), None)
     logger.info(f"Promocode {code.upper()} was added or updated in the database.")
 
-async def increment_promocode_usage(code: str) -> None:
-    """Увеличивает счетчик использования промокода на 1 в базе данных."""
+_REDEEM_PROMOCODE_SQL = """
+    UPDATE promocodes SET times_used = times_used + 1
+    WHERE code = $1
+      AND ($2::text IS NULL OR promo_type = $2)
+      AND CURRENT_DATE BETWEEN start_date AND end_date
+      AND (usage_limit IS NULL OR times_used < usage_limit)
+    RETURNING *;
+"""
+
+async def _redeem_promocode_on(connection, code: str, promo_type: str | None = None) -> dict | None:
+    """Погашает промокод через переданное соединение (с учетом его текущей транзакции)."""
+    record = await connection.fetchrow(_REDEEM_PROMOCODE_SQL, code.upper(), promo_type)
+    _promocode_cache.pop(code.upper(), None)
+    if record is None:
+        logger.warning(f"Promocode {code.upper()} could not be redeemed: not found, expired or usage limit reached.")
+        return None
+    logger.info(f"Redeemed promocode {code.upper()} ({record['times_used']}/{record['usage_limit'] or '∞'}).")
+    return _format_promocode_record(record)
+
+async def redeem_promocode(code: str, promo_type: str | None = None) -> dict | None:
+    """
+    Атомарно погашает промокод: одним условным UPDATE проверяет срок действия,
+    тип и лимит использований и увеличивает счетчик. При конкурентных погашениях
+    лимит не может быть превышен - строку блокирует сам UPDATE.
+    Возвращает данные промокода после погашения или None, если погасить нельзя.
+    """
     if not code:
-        return
+        return None
     pool = await get_pool()
-    sql = "UPDATE promocodes SET times_used = times_used + 1 WHERE code = $1;"
     async with pool.acquire() as connection:
-        result = await connection.execute(sql, code.upper())
-        if result == "UPDATE 1":
-             logger.info(f"Incremented usage count for promocode {code.upper()}.")
-        else:
-             logger.warning(f"Attempted to increment usage for non-existent promocode {code.upper()}.")
+        return await _redeem_promocode_on(connection, code, promo_type)
 
 
 async def get_product_by_id(product_id: str) -> dict | None:
@@ -357,13 +550,9 @@ async def _format_booking_record(record: dict) -> dict:
         booking['time'] = booking['booking_time'].strftime('%H:%M')
     # Распаковываем JSONB с деталями в основной словарь
     if 'details_json' in booking and booking['details_json']:
-        # booking['details_json'] может быть строкой или уже dict
-        details = json.loads(booking['details_json']) if isinstance(booking['details_json'], str) else booking['details_json']
-        booking.update(details)
-    # Добавляем медиафайлы
-    if 'media_files' in booking and isinstance(booking['media_files'], str):
-        booking['media_files'] = json.loads(booking['media_files'])
-    elif 'media_files' not in booking:
+        booking.update(booking['details_json'])
+    # Медиафайлы приходят списком из json_agg
+    if 'media_files' not in booking:
         booking['media_files'] = []
 
     return booking
@@ -388,23 +577,214 @@ async def get_all_bookings() -> list[dict]:
         records = await connection.fetch(sql)
         return [await _format_booking_record(rec) for rec in records]
 
-async def get_bookings_for_occupancy() -> list[dict]:
+# --- Поколения кэшей занятости ---
+# Счетчик ключа (даты или месяца) увеличивается при каждом его сбросе. Результат запроса
+# сохраняется в кэш, только если поколение ключа не изменилось, пока запрос выполнялся:
+# иначе сброс, пришедший во время запроса, был бы потерян, а устаревшие данные остались бы в кэше.
+_cache_generations: dict[Any, int] = {}
+_cache_epoch = 0  # Увеличивается при полной очистке кэшей
+
+
+def _cache_generation(key) -> tuple[int, int]:
+    return _cache_epoch, _cache_generations.get(key, 0)
+
+
+def _bump_cache_generation(key) -> None:
+    _cache_generations[key] = _cache_generations.get(key, 0) + 1
+
+
+def _bump_cache_epoch() -> None:
+    global _cache_epoch
+    _cache_epoch += 1
+    _cache_generations.clear()
+
+
+# --- Занятость временных слотов ---
+# Кэш: дата -> (время истечения, {время 'HH:MM': количество активных записей}).
+# Сбрасывается при добавлении записи, отмене и смене статуса, а также
+# по уведомлению из канала BOOKINGS_CHANNEL от других реплик бота.
+BOOKINGS_CHANNEL = "bookings_changed"
+_ACTIVE_BOOKING_STATUSES = ('pending_confirmation', 'confirmed')
+_slot_occupancy_cache: dict[date, tuple[float, dict[str, int]]] = {}
+
+
+async def get_slot_occupancy_for_date(booking_date: date) -> dict[str, int]:
     """
-    Загружает все записи, которые влияют на занятость слотов ('pending_confirmation', 'confirmed').
-    Возвращает только необходимые для подсчета поля для эффективности.
+    Возвращает словарь {время: количество записей} для одной даты.
+    Учитываются только записи, влияющие на занятость ('pending_confirmation', 'confirmed').
     """
+    cached = _slot_occupancy_cache.get(booking_date)
+    if cached is not None and cached[0] > time.monotonic():
+        return dict(cached[1])
+
+    generation = _cache_generation(booking_date)
     pool = await get_pool()
+    # Запрос ограничен одной датой и использует индекс idx_bookings_date_time
     sql = """
-        SELECT booking_date, booking_time
+        SELECT booking_time, COUNT(*) AS bookings_count
         FROM bookings
-        WHERE status IN ('pending_confirmation', 'confirmed');
+        WHERE booking_date = $1 AND status = ANY($2::booking_status[])
+        GROUP BY booking_time;
     """
     async with pool.acquire() as connection:
-        records = await connection.fetch(sql)
-        return [
-            {'date': rec['booking_date'].strftime('%d.%m.%Y'), 'time': rec['booking_time'].strftime('%H:%M')}
-            for rec in records
-        ]
+        records = await connection.fetch(sql, booking_date, list(_ACTIVE_BOOKING_STATUSES))
+
+    occupancy = {rec['booking_time'].strftime('%H:%M'): rec['bookings_count'] for rec in records}
+    if _cache_generation(booking_date) == generation:
+        _slot_occupancy_cache[booking_date] = (time.monotonic() + BOOKING_CACHE_TTL, occupancy)
+    return dict(occupancy)
+
+
+def _invalidate_booking_caches(booking_date: date) -> None:
+    """Сбрасывает закэшированную занятость для указанной даты."""
+    _bump_cache_generation(booking_date)
+    _slot_occupancy_cache.pop(booking_date, None)
+    # В битовой карте месяца помечаем день для пересчета, остальные дни не трогаем
+    _bump_cache_generation((booking_date.year, booking_date.month))
+    month_entry = _month_availability_cache.get((booking_date.year, booking_date.month))
+    if month_entry is not None:
+        month_entry['dirty_days'].add(booking_date.day)
+
+
+async def _clear_booking_caches() -> None:
+    """Полностью очищает кэши занятости (после переподключения к каналу уведомлений)."""
+    _bump_cache_epoch()
+    _slot_occupancy_cache.clear()
+    _month_availability_cache.clear()
+
+
+def _apply_bookings_notification(payload: str) -> None:
+    """Применяет уведомление с датой измененной записи в формате ISO (YYYY-MM-DD)."""
+    _invalidate_booking_caches(date.fromisoformat(payload))
+
+
+register_channel(BOOKINGS_CHANNEL, _apply_bookings_notification, _clear_booking_caches)
+
+
+async def _notify_booking_slots_changed(connection, booking_date: date) -> None:
+    """Сбрасывает локальный кэш занятости для даты и уведомляет другие реплики."""
+    _invalidate_booking_caches(booking_date)
+    await notify(connection, BOOKINGS_CHANNEL, booking_date.isoformat())
+
+
+# --- Доступность дней месяца для календаря ---
+# Кэш: (год, месяц) -> {'blocked': битовая маска, 'full': битовая маска, 'dirty_days': set,
+# 'expires_at': время истечения}. Бит (day - 1) установлен, если день заблокирован вручную / полностью занят.
+# При изменении записи день помечается в dirty_days и пересчитывается отдельно,
+# при изменении blocked_dates бит обновляется сразу. Оба изменения увеличивают поколение месяца,
+# поэтому месяц, изменившийся во время загрузки, не сохраняется в кэш.
+BLOCKED_DATES_CHANNEL = "blocked_dates_changed"
+_month_availability_cache: dict[tuple[int, int], dict] = {}
+
+
+def _month_bounds(year: int, month: int) -> tuple[date, date]:
+    """Возвращает первый день месяца и первый день следующего месяца."""
+    first_day = date(year, month, 1)
+    next_month = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return first_day, next_month
+
+
+async def _load_month_availability(year: int, month: int) -> dict:
+    """Вычисляет битовые карты заблокированных и полностью занятых дней месяца в SQL."""
+    first_day, next_month = _month_bounds(year, month)
+    working_times = [datetime.strptime(slot, '%H:%M').time() for slot in WORKING_HOURS]
+    full_days_sql = """
+        SELECT EXTRACT(DAY FROM booking_date)::int AS day
+        FROM (
+            SELECT booking_date, booking_time
+            FROM bookings
+            WHERE booking_date >= $1 AND booking_date < $2
+              AND status = ANY($3::booking_status[])
+              AND booking_time = ANY($4::time[])
+            GROUP BY booking_date, booking_time
+            HAVING COUNT(*) >= $5
+        ) AS full_slots
+        GROUP BY booking_date
+        HAVING COUNT(*) >= $6;
+    """
+    blocked_days_sql = """
+        SELECT EXTRACT(DAY FROM blocked_date)::int AS day
+        FROM blocked_dates
+        WHERE blocked_date >= $1 AND blocked_date < $2;
+    """
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        full_records = await connection.fetch(
+            full_days_sql, first_day, next_month, list(_ACTIVE_BOOKING_STATUSES),
+            working_times, MAX_PARALLEL_BOOKINGS, len(working_times)
+        )
+        blocked_records = await connection.fetch(blocked_days_sql, first_day, next_month)
+
+    full_bits = 0
+    for rec in full_records:
+        full_bits |= 1 << (rec['day'] - 1)
+    blocked_bits = 0
+    for rec in blocked_records:
+        blocked_bits |= 1 << (rec['day'] - 1)
+    return {
+        'blocked': blocked_bits, 'full': full_bits, 'dirty_days': set(),
+        'expires_at': time.monotonic() + BOOKING_CACHE_TTL,
+    }
+
+
+async def _is_day_fully_booked(day: date) -> bool:
+    """Проверяет, что все рабочие слоты дня заняты (через кэш занятости одного дня)."""
+    occupancy = await get_slot_occupancy_for_date(day)
+    return all(occupancy.get(slot, 0) >= MAX_PARALLEL_BOOKINGS for slot in WORKING_HOURS)
+
+
+async def get_unavailable_days_bitmap(year: int, month: int) -> int:
+    """
+    Возвращает битовую маску недоступных дней месяца (бит day - 1):
+    день заблокирован вручную или все его слоты полностью заняты.
+    """
+    key = (year, month)
+    entry = _month_availability_cache.get(key)
+    if entry is None or entry['expires_at'] <= time.monotonic():
+        generation = _cache_generation(key)
+        entry = await _load_month_availability(year, month)
+        # Если во время загрузки пришло изменение, результат мог его не увидеть - не кэшируем
+        if _cache_generation(key) == generation:
+            _month_availability_cache[key] = entry
+
+    # Пересчитываем только дни, в которых менялись записи
+    while entry['dirty_days']:
+        day_number = entry['dirty_days'].pop()
+        bit = 1 << (day_number - 1)
+        if await _is_day_fully_booked(date(year, month, day_number)):
+            entry['full'] |= bit
+        else:
+            entry['full'] &= ~bit
+
+    return entry['blocked'] | entry['full']
+
+
+def _set_blocked_day(blocked_date: date, is_blocked: bool) -> None:
+    """Обновляет бит заблокированного дня в кэше месяца, если месяц закэширован."""
+    _bump_cache_generation((blocked_date.year, blocked_date.month))
+    entry = _month_availability_cache.get((blocked_date.year, blocked_date.month))
+    if entry is None:
+        return
+    bit = 1 << (blocked_date.day - 1)
+    if is_blocked:
+        entry['blocked'] |= bit
+    else:
+        entry['blocked'] &= ~bit
+
+
+def _apply_blocked_dates_notification(payload: str) -> None:
+    """Применяет уведомление вида 'block:YYYY-MM-DD' или 'unblock:YYYY-MM-DD'."""
+    action, _, date_iso = payload.partition(":")
+    _set_blocked_day(date.fromisoformat(date_iso), action == "block")
+
+
+async def _clear_month_availability_cache() -> None:
+    _bump_cache_epoch()
+    _month_availability_cache.clear()
+
+
+register_channel(BLOCKED_DATES_CHANNEL, _apply_blocked_dates_notification, _clear_month_availability_cache)
+
 
 async def get_user_bookings(user_id: int) -> list[dict]:
     """Возвращает все активные и ожидающие подтверждения записи пользователя из БД."""
@@ -424,27 +804,48 @@ async def get_user_bookings(user_id: int) -> list[dict]:
         records = await connection.fetch(sql, user_id)
         return [await _format_booking_record(rec) for rec in records]
 
+# Пространства ключей advisory-блокировок: первый аргумент pg_advisory_xact_lock(int, int).
+# У каждого вида блокировок свое пространство, поэтому ключи разных видов не пересекаются.
+_LOCK_NAMESPACE_BOOKING_SLOT = 1
+_LOCK_NAMESPACE_DAILY_METRICS = 2
+
+def _slot_lock_key(booking_date: date, booking_time) -> int:
+    """
+    Ключ advisory-блокировки для слота (дата, время) в пространстве _LOCK_NAMESPACE_BOOKING_SLOT:
+    номер минуты от начала летоисчисления (помещается в int4). Разные слоты не блокируют друг друга.
+    """
+    return booking_date.toordinal() * 24 * 60 + booking_time.hour * 60 + booking_time.minute
+
+
 async def add_booking_to_db(user_id: int, user_full_name: str, user_username: str | None, booking_data: dict) -> dict:
     """
     Добавляет новую запись на услугу в базу данных.
-    Проверяет, что на указанное время есть свободные слоты (максимум 2 записи).
+    Проверяет, что на указанное время есть свободные слоты (не более MAX_PARALLEL_BOOKINGS записей).
+    Проверка и вставка выполняются под транзакционной advisory-блокировкой слота,
+    поэтому одновременные записи на одно время не могут превысить лимит.
     """
     pool = await get_pool()
     async with pool.acquire() as connection:
         async with connection.transaction():
-            # 1. Проверяем количество существующих записей на это же время
+            # 1. Блокируем слот и проверяем количество существующих записей на это же время
             time_obj = datetime.strptime(booking_data['time'], '%H:%M').time()
             date_str = booking_data['date']
+            date_obj = datetime.strptime(date_str, '%d.%m.%Y').date()
+
+            # Блокировка снимается автоматически при завершении транзакции
+            await connection.execute(
+                "SELECT pg_advisory_xact_lock($1, $2);", _LOCK_NAMESPACE_BOOKING_SLOT, _slot_lock_key(date_obj, time_obj)
+            )
 
             count_sql = """
                 SELECT COUNT(*) FROM bookings
-                WHERE booking_date = TO_DATE($1, 'DD.MM.YYYY')
+                WHERE booking_date = $1
                   AND booking_time = $2
                   AND status IN ('pending_confirmation', 'confirmed');
             """
-            count = await connection.fetchval(count_sql, date_str, time_obj)
+            count = await connection.fetchval(count_sql, date_obj, time_obj)
 
-            if count >= 2:
+            if count >= MAX_PARALLEL_BOOKINGS:
                 logger.warning(f"Попытка записи на уже занятый слот: {date_str} {booking_data['time']} пользователем {user_id}")
                 raise SlotAlreadyBookedError(f"Слот на {date_str} {booking_data['time']} уже полностью занят.")
 
@@ -457,7 +858,8 @@ async def add_booking_to_db(user_id: int, user_full_name: str, user_username: st
                 ON CONFLICT (user_id) DO UPDATE SET 
                     full_name = EXCLUDED.full_name, 
                     username = EXCLUDED.username,
-                    phone_number = COALESCE(EXCLUDED.phone_number, users.phone_number);
+                    phone_number = COALESCE(EXCLUDED.phone_number, users.phone_number),
+                    bot_blocked_at = NULL; -- Пользователь снова пишет боту - чат доступен
                 """,
                 user_id, user_full_name, user_username, phone_number
             )
@@ -472,7 +874,7 @@ async def add_booking_to_db(user_id: int, user_full_name: str, user_username: st
             booking_id = await connection.fetchval(
                 booking_sql, user_id, booking_data['service'], booking_data['date'], time_obj,
                 int(booking_data['price']), int(booking_data.get('discount_amount', 0)),
-                booking_data.get('promocode'), json.dumps(booking_data.get('details', {}))
+                booking_data.get('promocode'), booking_data.get('details', {})
             )
 
             # 4. Добавляем медиафайлы, если они есть
@@ -482,6 +884,9 @@ async def add_booking_to_db(user_id: int, user_full_name: str, user_username: st
                 media_data = [(booking_id, media['file_id'], media['type']) for media in media_files]
                 await connection.executemany(media_sql, media_data)
 
+        # Сбрасываем кэш занятости уже после фиксации транзакции
+        await _notify_booking_slots_changed(connection, date_obj)
+
     # Возвращаем созданную запись для дальнейшего использования (например, для уведомлений)
     new_booking = {**booking_data, 'id': booking_id, 'user_id': user_id, 'user_full_name': user_full_name, 'user_username': user_username}
     logger.info(f"User {user_id} created a new booking with ID {booking_id}")
@@ -524,6 +929,8 @@ async def update_booking_status(booking_id: int, new_status: str) -> dict | None
     sql = "UPDATE bookings SET status = $1 WHERE booking_id = $2 RETURNING *;"
     async with pool.acquire() as connection:
         updated_record = await connection.fetchrow(sql, new_status, booking_id)
+        if updated_record:
+            await _notify_booking_slots_changed(connection, updated_record['booking_date'])
 
     if updated_record:
         logger.info(f"Updated status for booking #{booking_id} to '{new_status}'")
@@ -553,8 +960,7 @@ def _format_order_record(record: dict) -> dict:
     order['id'] = order['order_id']  # для совместимости
 
     # Восстанавливаем корзину из агрегированного JSON
-    items_list = json.loads(order['items']) if isinstance(order['items'], str) else order['items']
-    order['cart'] = {item['product_id']: item['quantity'] for item in items_list}
+    order['cart'] = {item['product_id']: item['quantity'] for item in order['items']}
 
     # Для совместимости со старым кодом, который ожидает эти ключи
     order['date'] = order['created_at'].strftime("%Y-%m-%d %H:%M:%S")
@@ -612,13 +1018,22 @@ async def get_all_orders() -> list[dict]:
         return [_format_order_record(rec) for rec in records]
 
 async def add_order_to_db(user_id: int, user_full_name: str, user_username: str | None, order_details: dict) -> dict:
-    """Добавляет новый заказ и его состав в базу данных в рамках одной транзакции."""
+    """
+    Добавляет новый заказ и его состав в базу данных в рамках одной транзакции.
+    Промокод заказа (order_details['promocode']) погашается в той же транзакции: если заказ
+    не сохранится, использование не будет потрачено. Если промокод погасить уже нельзя,
+    выбрасывает PromocodeRedemptionError и ничего не сохраняет.
+    """
     pool = await get_pool()
     async with pool.acquire() as connection:
         async with connection.transaction():
+            # 0. Погашаем промокод - до вставки заказа, чтобы при отказе ничего не откатывать
+            if (promocode := order_details.get('promocode')) and not await _redeem_promocode_on(connection, promocode):
+                raise PromocodeRedemptionError(promocode)
+
             # 1. Убедимся, что пользователь существует
             await connection.execute(
-                "INSERT INTO users (user_id, full_name, username) VALUES ($1, $2, $3) ON CONFLICT (user_id) DO UPDATE SET full_name = EXCLUDED.full_name, username = EXCLUDED.username;",
+                "INSERT INTO users (user_id, full_name, username) VALUES ($1, $2, $3) ON CONFLICT (user_id) DO UPDATE SET full_name = EXCLUDED.full_name, username = EXCLUDED.username, bot_blocked_at = NULL;",
                 user_id, user_full_name, user_username
             )
 
@@ -738,6 +1153,8 @@ async def cancel_booking_in_db(booking_id: int, user_id: int | None = None) -> d
             params.append(user_id)
         
         cancelled_record = await connection.fetchrow(sql, *params)
+        if cancelled_record:
+            await _notify_booking_slots_changed(connection, cancelled_record['booking_date'])
 
     if cancelled_record:
         log_msg_user = f"user {user_id}" if user_id is not None else "admin"
@@ -784,18 +1201,32 @@ async def cancel_order_in_db(order_id: int, user_id: int | None = None) -> dict
         return None
 
 
-async def get_all_unique_user_ids() -> set[int]:
-    """Возвращает множество всех уникальных ID пользователей из заказов и записей."""
+async def iter_broadcast_audience(batch_size: int = 1000) -> AsyncIterator[int]:
+    """
+    Постранично (keyset по user_id) выдает ID пользователей для массовой рассылки:
+    всех, у кого есть записи или заказы, кроме заблокированных админом и недоступных чатов.
+    Память не зависит от размера аудитории, соединение не удерживается между страницами.
+    """
     pool = await get_pool()
-    # Запрос к БД гораздо эффективнее, чем загрузка всех данных в память
     sql = """
-        SELECT user_id FROM bookings
-        UNION
-        SELECT user_id FROM orders;
+        SELECT u.user_id FROM users u
+        WHERE u.user_id > $1
+          AND u.is_blocked IS NOT TRUE
+          AND u.bot_blocked_at IS NULL
+          AND (EXISTS (SELECT 1 FROM bookings b WHERE b.user_id = u.user_id)
+               OR EXISTS (SELECT 1 FROM orders o WHERE o.user_id = u.user_id))
+        ORDER BY u.user_id
+        LIMIT $2;
     """
-    async with pool.acquire() as connection:
-        records = await connection.fetch(sql)
-        return {rec['user_id'] for rec in records}
+    last_user_id = -(2 ** 63)
+    while True:
+        async with pool.acquire() as connection:
+            records = await connection.fetch(sql, last_user_id, batch_size)
+        for rec in records:
+            yield rec['user_id']
+        if len(records) < batch_size:
+            return
+        last_user_id = records[-1]['user_id']
 
 
 async def get_all_unique_users() -> dict[int, dict]:
@@ -878,6 +1309,42 @@ async def get_blocked_users() -> list[int]:
         return [rec['user_id'] for rec in records]
 
 
+# --- Кэш заблокированных пользователей ---
+# Множество загружается один раз при старте и поддерживается в актуальном состоянии
+# функциями block_user/unblock_user, а между репликами бота - через LISTEN/NOTIFY.
+BLOCKED_USERS_CHANNEL = "blocked_users_changed"
+_blocked_users: set[int] | None = None
+
+
+async def load_blocked_users() -> None:
+    """Загружает (или перезагружает) множество заблокированных пользователей из БД."""
+    global _blocked_users
+    _blocked_users = set(await get_blocked_users())
+    logger.info(f"Loaded {len(_blocked_users)} blocked users into memory.")
+
+
+async def is_user_blocked(user_id: int) -> bool:
+    """Проверяет, заблокирован ли пользователь, без обращения к БД."""
+    if _blocked_users is None:
+        await load_blocked_users()
+    return user_id in _blocked_users
+
+
+def _apply_blocked_users_notification(payload: str) -> None:
+    """Применяет уведомление вида 'block:<id>' или 'unblock:<id>' к локальному множеству."""
+    if _blocked_users is None:
+        return
+    action, _, user_id_str = payload.partition(":")
+    user_id = int(user_id_str)
+    if action == "block":
+        _blocked_users.add(user_id)
+    elif action == "unblock":
+        _blocked_users.discard(user_id)
+
+
+register_channel(BLOCKED_USERS_CHANNEL, _apply_blocked_users_notification, load_blocked_users)
+
+
 async def block_user(user_id: int, user_full_name: str = "N/A"):
     """Блокирует пользователя, устанавливая флаг is_blocked в TRUE."""
     pool = await get_pool()
@@ -890,7 +1357,11 @@ async def block_user(user_id: int, user_full_name: str = "N/A"):
             is_blocked = TRUE;
     """
     async with pool.acquire() as connection:
-        await connection.execute(sql, user_id, user_full_name)
+        async with connection.transaction():
+            await connection.execute(sql, user_id, user_full_name)
+            await notify(connection, BLOCKED_USERS_CHANNEL, f"block:{user_id}")
+    if _blocked_users is not None:
+        _blocked_users.add(user_id)
     logger.info(f"User {user_id} has been blocked.")
 
 
@@ -899,5 +1370,656 @@ async def unblock_user(user_id: int):
     pool = await get_pool()
     sql = "UPDATE users SET is_blocked = FALSE WHERE user_id = $1;"
     async with pool.acquire() as connection:
-        await connection.execute(sql, user_id)
-    logger.info(f"User {user_id} has been unblocked.")
\ No newline at end of file
+        async with connection.transaction():
+            await connection.execute(sql, user_id)
+            await notify(connection, BLOCKED_USERS_CHANNEL, f"unblock:{user_id}")
+    if _blocked_users is not None:
+        _blocked_users.discard(user_id)
+    logger.info(f"User {user_id} has been unblocked.")
+
+
+# --- Задания рассылок ---
+# Задание создается в статусе 'preparing' и переводится в 'running' с арендой только после записи
+# всех получателей. Аренда принадлежит этому процессу (lease_owner): продлить, снять или завершить
+# задание может только владелец, поэтому два экземпляра бота не выполняют одно задание одновременно.
+# Время аренды считается по clock_timestamp(), а не по времени начала транзакции.
+_BROADCAST_LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(4).hex()}"
+
+def _format_broadcast_job(record) -> dict:
+    job = dict(record)
+    job['content'] = job.pop('content_json')
+    return job
+
+async def _iter_batches(user_ids: Iterable[int] | AsyncIterable[int], batch_size: int) -> AsyncIterator[list[int]]:
+    batch = []
+    if isinstance(user_ids, AsyncIterable):
+        async for user_id in user_ids:
+            batch.append(user_id)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    else:
+        for user_id in user_ids:
+            batch.append(user_id)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+async def create_broadcast_job(
+    title: str, content: dict, user_ids: Iterable[int] | AsyncIterable[int],
+    admin_chat_id: int | None = None, status_message_id: int | None = None, report_footer: str | None = None
+) -> dict:
+    """
+    Создает задание рассылки и список его получателей. user_ids может быть списком
+    или асинхронным генератором (см. iter_broadcast_audience) - получатели пишутся пачками.
+    Заблокированные пользователи и недоступные чаты (bot_blocked_at) в задание не попадают.
+    """
+    pool = await get_pool()
+    stored_content = {key: content.get(key) for key in ("message_id", "from_chat_id", "button")}
+    requested = 0
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            job_id = await connection.fetchval(
+                """
+                INSERT INTO broadcast_jobs (title, content_json, admin_chat_id, status_message_id, report_footer, status)
+                VALUES ($1, $2, $3, $4, $5, 'preparing') RETURNING job_id;
+                """,
+                title, stored_content, admin_chat_id, status_message_id, report_footer
+            )
+            async for batch in _iter_batches(user_ids, 1000):
+                requested += len(batch)
+                await connection.execute(
+                    """
+                    INSERT INTO broadcast_recipients (job_id, user_id)
+                    SELECT $1, r.user_id FROM unnest($2::bigint[]) AS r(user_id)
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM users u
+                        WHERE u.user_id = r.user_id AND (u.is_blocked OR u.bot_blocked_at IS NOT NULL)
+                    )
+                    ON CONFLICT DO NOTHING;
+                    """,
+                    job_id, batch
+                )
+            record = await connection.fetchrow(
+                """
+                UPDATE broadcast_jobs
+                SET total_recipients = (SELECT COUNT(*) FROM broadcast_recipients WHERE job_id = $1),
+                    status = 'running', lease_owner = $2,
+                    lease_until = clock_timestamp() + make_interval(secs => $3)
+                WHERE job_id = $1 RETURNING *;
+                """,
+                job_id, _BROADCAST_LEASE_OWNER, BROADCAST_JOB_LEASE_SECONDS
+            )
+    job = _format_broadcast_job(record)
+    logger.info(
+        f"Broadcast job #{job_id} created: {job['total_recipients']} recipients "
+        f"({requested - job['total_recipients']} skipped as blocked or unreachable)."
+    )
+    return job
+
+async def get_unfinished_broadcast_jobs() -> list[dict]:
+    """Возвращает задания рассылок, которые не были завершены (например, из-за перезапуска бота)."""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        records = await connection.fetch("SELECT * FROM broadcast_jobs WHERE status = 'running' ORDER BY job_id;")
+    return [_format_broadcast_job(rec) for rec in records]
+
+async def claim_broadcast_job(job_id: int) -> bool:
+    """
+    Захватывает незавершенное задание, если его не обрабатывает другой экземпляр бота
+    (аренда снята, истекла или уже принадлежит этому процессу). Возвращает True, если задание захвачено.
+    """
+    pool = await get_pool()
+    sql = """
+        UPDATE broadcast_jobs SET lease_owner = $2, lease_until = clock_timestamp() + make_interval(secs => $3)
+        WHERE job_id = $1 AND status = 'running'
+          AND (lease_until IS NULL OR lease_until < clock_timestamp() OR lease_owner = $2)
+        RETURNING job_id;
+    """
+    async with pool.acquire() as connection:
+        return await connection.fetchval(sql, job_id, _BROADCAST_LEASE_OWNER, BROADCAST_JOB_LEASE_SECONDS) is not None
+
+async def iter_pending_broadcast_recipients(job_id: int, batch_size: int = 1000) -> AsyncIterator[int]:
+    """Постранично выдает ID пользователей, которым сообщение из задания еще не отправлялось."""
+    pool = await get_pool()
+    sql = """
+        SELECT user_id FROM broadcast_recipients
+        WHERE job_id = $1 AND status = 'pending' AND user_id > $2
+        ORDER BY user_id
+        LIMIT $3;
+    """
+    last_user_id = -(2 ** 63)
+    while True:
+        async with pool.acquire() as connection:
+            records = await connection.fetch(sql, job_id, last_user_id, batch_size)
+        for rec in records:
+            yield rec['user_id']
+        if len(records) < batch_size:
+            return
+        last_user_id = records[-1]['user_id']
+
+async def get_broadcast_job_stats(job_id: int) -> dict[str, int]:
+    """Возвращает количество получателей задания по статусам доставки."""
+    pool = await get_pool()
+    sql = "SELECT status, COUNT(*) AS cnt FROM broadcast_recipients WHERE job_id = $1 GROUP BY status;"
+    async with pool.acquire() as connection:
+        records = await connection.fetch(sql, job_id)
+    return {rec['status']: rec['cnt'] for rec in records}
+
+async def save_broadcast_results(job_id: int, results: list[tuple[int, str, str | None]]) -> bool:
+    """
+    Сохраняет пачку результатов доставки [(user_id, статус, ошибка)] одним запросом
+    и продлевает аренду задания (вызывается периодически, в том числе с пустой пачкой).
+    Получатели со статусом 'dead' помечаются как недоступные для будущих рассылок.
+    Результаты сохраняются в любом случае; возвращает False, если аренда задания
+    больше не принадлежит этому процессу и рассылку нужно остановить.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            lease_held = await connection.fetchval(
+                """
+                UPDATE broadcast_jobs SET lease_until = clock_timestamp() + make_interval(secs => $3)
+                WHERE job_id = $1 AND status = 'running' AND lease_owner = $2
+                RETURNING job_id;
+                """,
+                job_id, _BROADCAST_LEASE_OWNER, BROADCAST_JOB_LEASE_SECONDS
+            ) is not None
+            if not results:
+                return lease_held
+            user_ids, statuses, errors = (list(column) for column in zip(*results))
+            dead_user_ids = [user_id for user_id, status, _ in results if status == 'dead']
+            await connection.execute(
+                """
+                UPDATE broadcast_recipients AS r SET status = v.status, error = v.error
+                FROM unnest($2::bigint[], $3::text[], $4::text[]) AS v(user_id, status, error)
+                WHERE r.job_id = $1 AND r.user_id = v.user_id;
+                """,
+                job_id, user_ids, statuses, errors
+            )
+            if dead_user_ids:
+                await connection.execute(
+                    "UPDATE users SET bot_blocked_at = CURRENT_TIMESTAMP WHERE user_id = ANY($1::bigint[]) AND bot_blocked_at IS NULL;",
+                    dead_user_ids
+                )
+    return lease_held
+
+async def release_broadcast_job(job_id: int) -> None:
+    """
+    Снимает аренду задания, не завершая его (остановка бота или ошибка), чтобы
+    задание сразу мог подхватить следующий запуск или другой экземпляр бота.
+    """
+    pool = await get_pool()
+    sql = """
+        UPDATE broadcast_jobs SET lease_owner = NULL, lease_until = NULL
+        WHERE job_id = $1 AND status = 'running' AND lease_owner = $2;
+    """
+    async with pool.acquire() as connection:
+        await connection.execute(sql, job_id, _BROADCAST_LEASE_OWNER)
+
+async def finish_broadcast_job(job_id: int) -> bool:
+    """
+    Помечает задание рассылки как завершенное. Возвращает False, если аренда задания
+    перешла к другому экземпляру бота (тогда задание завершит он).
+    """
+    pool = await get_pool()
+    sql = """
+        UPDATE broadcast_jobs SET status = 'completed', finished_at = CURRENT_TIMESTAMP, lease_owner = NULL, lease_until = NULL
+        WHERE job_id = $1 AND status = 'running' AND lease_owner = $2
+        RETURNING job_id;
+    """
+    async with pool.acquire() as connection:
+        return await connection.fetchval(sql, job_id, _BROADCAST_LEASE_OWNER) is not None
+
+
+# --- Агрегаты для отчетов ---
+# Статистика читается из таблицы daily_metrics (одна строка на день и срез),
+# поэтому время ответа зависит от числа дней в периоде, а не от числа записей и заказов.
+# Триггеры помечают измененные дни в daily_metrics_dirty; refresh_daily_metrics
+# пересчитывает их перед чтением и периодически по расписанию.
+
+_CANCELLED_BOOKING_STATUSES = ('cancelled_by_user', 'cancelled_by_admin')
+# Выручка с заказов везде (статистика магазина, отчеты, график по дням) - сумма total_price_rub
+# заказов без отмененных; средний чек - выручка, деленная на число таких заказов.
+_CANCELLED_ORDER_STATUSES = ('cancelled',)
+
+async def refresh_daily_metrics() -> int:
+    """Пересчитывает агрегаты daily_metrics для дней, помеченных как устаревшие. Возвращает число дней."""
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            # Пересчет агрегатов выполняется одним процессом
+            await connection.execute("SELECT pg_advisory_xact_lock($1, 0);", _LOCK_NAMESPACE_DAILY_METRICS)
+            records = await connection.fetch("DELETE FROM daily_metrics_dirty RETURNING metric_date;")
+            days = [rec['metric_date'] for rec in records]
+            if not days:
+                return 0
+            await connection.execute("DELETE FROM daily_metrics WHERE metric_date = ANY($1::date[]);", days)
+            await connection.execute(
+                """
+                INSERT INTO daily_metrics (metric_date, kind, service_name, status, promocode, items_count, revenue_rub, discount_rub)
+                SELECT booking_date, 'booking', service_name, status::text, COALESCE(promocode, ''),
+                       COUNT(*), SUM(price_rub), SUM(COALESCE(discount_rub, 0))
+                FROM bookings
+                WHERE booking_date = ANY($1::date[])
+                GROUP BY booking_date, service_name, status, COALESCE(promocode, '')
+                UNION ALL
+                SELECT created_at::date, 'order', '', status::text, COALESCE(promocode, ''),
+                       COUNT(*), SUM(total_price_rub), SUM(COALESCE(discount_rub, 0))
+                FROM orders
+                WHERE created_at >= $2::date AND created_at < $3::date + 1
+                  AND created_at::date = ANY($1::date[])
+                GROUP BY created_at::date, status, COALESCE(promocode, '');
+                """,
+                days, min(days), max(days)
+            )
+    logger.info(f"Daily metrics refreshed for {len(days)} day(s).")
+    return len(days)
+
+def _period_to_days(start_date: datetime | None, end_date: datetime | None) -> tuple[date | None, date | None]:
+    """
+    Переводит период [start_date, end_date) в диапазон дней [первый, последний):
+    день входит в период, если в период попадает его начало (полночь).
+    """
+    def _ceil_day(moment: datetime) -> date:
+        return moment.date() if moment.time() == datetime.min.time() else moment.date() + timedelta(days=1)
+    return (
+        _ceil_day(start_date) if start_date is not None else None,
+        _ceil_day(end_date) if end_date is not None else None,
+    )
+
+def _split_period(start_date: datetime | None, end_date: datetime | None) -> tuple[date | None, date | None, list[tuple[datetime, datetime]]]:
+    """
+    Делит период [start_date, end_date) на целые дни [первый, последний) и неполные
+    крайние отрезки. Заказы за целые дни берутся из daily_metrics, а за крайние отрезки
+    считаются по точному времени создания: иначе отчет в 21:00 захватил бы весь текущий
+    день, а заказы после его отправки не попали бы ни в один отчет.
+    """
+    def _midnight(day: date) -> datetime:
+        return datetime.combine(day, datetime.min.time())
+
+    first_day, _ = _period_to_days(start_date, None)
+    last_day = end_date.date() if end_date is not None else None
+    if first_day is not None and last_day is not None and first_day >= last_day:
+        # В периоде нет ни одного целого дня
+        return first_day, first_day, [(start_date, end_date)]
+
+    edges = []
+    if start_date is not None and start_date < _midnight(first_day):
+        edges.append((start_date, _midnight(first_day)))
+    if end_date is not None and end_date > _midnight(last_day):
+        edges.append((_midnight(last_day), end_date))
+    return first_day, last_day, edges
+
+# Колонки daily_metrics, по которым суммируются показатели, и те же колонки, посчитанные по заказам напрямую
+_METRIC_COLUMNS = "metric_date, service_name, status, promocode, items_count, revenue_rub, discount_rub"
+_ORDER_METRIC_COLUMNS = "created_at::date, '', status::text, COALESCE(promocode, ''), 1, total_price_rub, COALESCE(discount_rub, 0)"
+
+async def _fetch_daily_metrics(kind: str, group_by: str, start_date: datetime | None, end_date: datetime | None) -> list:
+    """
+    Суммирует daily_metrics за период по указанным колонкам. Записи учитываются по дате записи
+    целыми днями; заказы за неполные крайние дни периода - по точному времени создания.
+    """
+    if kind == 'order':
+        first_day, last_day, edges = _split_period(start_date, end_date)
+    else:
+        (first_day, last_day), edges = _period_to_days(start_date, end_date), []
+    day_conditions, params = [], []
+    if first_day is not None:
+        params.append(first_day)
+        day_conditions.append(f"metric_date >= ${len(params)}")
+    if last_day is not None:
+        params.append(last_day)
+        day_conditions.append(f"metric_date < ${len(params)}")
+
+    pool = await get_pool()
+    # Агрегаты пересчитываются фоновой задачей; при чтении - только если в периоде есть устаревшие
+    # дни, чтобы чтения статистики не выстраивались в очередь за блокировкой пересчета
+    dirty_sql = f"SELECT EXISTS (SELECT 1 FROM daily_metrics_dirty WHERE {' AND '.join(day_conditions) or 'TRUE'});"
+    if await pool.fetchval(dirty_sql, *params):
+        await refresh_daily_metrics()
+
+    params.append(kind)
+    conditions = day_conditions + [f"kind = ${len(params)}"]
+    sources = [f"SELECT {_METRIC_COLUMNS} FROM daily_metrics WHERE {' AND '.join(conditions)}"]
+    for edge_start, edge_end in edges:
+        params.extend((edge_start, edge_end))
+        sources.append(
+            f"SELECT {_ORDER_METRIC_COLUMNS} FROM orders "
+            f"WHERE created_at >= ${len(params) - 1}::timestamp AND created_at < ${len(params)}::timestamp"
+        )
+
+    sql = f"""
+        SELECT {group_by}, SUM(items_count)::bigint AS cnt, SUM(revenue_rub)::bigint AS revenue,
+               SUM(discount_rub)::bigint AS discount
+        FROM ({' UNION ALL '.join(sources)}) AS m({_METRIC_COLUMNS})
+        GROUP BY {group_by};
+    """
+    async with pool.acquire() as connection:
+        return await connection.fetch(sql, *params)
+
+async def get_booking_history_stats(start_date: datetime | None = None, end_date: datetime | None = None) -> dict:
+    """
+    Статистика по истории записей за период [start_date, end_date) (или за все время)
+    с учетом всех статусов, включая выполненные и отмененные.
+    Возвращает {'total': int, 'by_status': {статус: кол-во}, 'by_service': {услуга: кол-во}};
+    в популярности услуг отмененные записи не учитываются.
+    """
+    records = await _fetch_daily_metrics('booking', 'status, service_name', start_date, end_date)
+
+    by_status: dict[str, int] = defaultdict(int)
+    by_service: dict[str, int] = defaultdict(int)
+    for rec in records:
+        by_status[rec['status']] += rec['cnt']
+        if rec['status'] not in _CANCELLED_BOOKING_STATUSES:
+            by_service[rec['service_name'] or 'Не указана'] += rec['cnt']
+    return {
+        'total': sum(by_status.values()),
+        'by_status': dict(by_status),
+        'by_service': dict(sorted(by_service.items(), key=lambda item: item[1], reverse=True)),
+    }
+
+async def get_order_metrics(start_date: datetime | None = None, end_date: datetime | None = None) -> dict:
+    """
+    Показатели заказов за период [start_date, end_date) (или за все время):
+    {'orders_count': все заказы, 'revenue_orders_count': заказы без отмененных,
+     'revenue', 'discount': суммы по заказам без отмененных, 'promocodes': {код: кол-во заказов}}.
+    """
+    records = await _fetch_daily_metrics('order', 'status, promocode', start_date, end_date)
+    active = [rec for rec in records if rec['status'] not in _CANCELLED_ORDER_STATUSES]
+    promocodes: dict[str, int] = defaultdict(int)
+    for rec in records:
+        if rec['promocode']:
+            promocodes[rec['promocode']] += rec['cnt']
+    return {
+        'orders_count': sum(rec['cnt'] for rec in records),
+        'revenue_orders_count': sum(rec['cnt'] for rec in active),
+        'revenue': sum(rec['revenue'] for rec in active),
+        'discount': sum(rec['discount'] for rec in active),
+        'promocodes': dict(sorted(promocodes.items(), key=lambda item: item[1], reverse=True)),
+    }
+
+async def get_daily_revenue(start_date: datetime, end_date: datetime) -> dict[date, int]:
+    """Выручка с заказов (без отмененных) по дням периода, включая дни без заказов."""
+    records = await _fetch_daily_metrics('order', 'metric_date, status', start_date, end_date)
+    # Неполные крайние дни тоже показываются, с выручкой только за их часть из периода
+    first_day, last_day = start_date.date(), _period_to_days(None, end_date)[1]
+    revenue = {first_day + timedelta(days=i): 0 for i in range((last_day - first_day).days)}
+    for rec in records:
+        if rec['status'] not in _CANCELLED_ORDER_STATUSES:
+            revenue[rec['metric_date']] = revenue.get(rec['metric_date'], 0) + rec['revenue']
+    return revenue
+
+async def get_booking_time_distribution(start_date: datetime | None = None, end_date: datetime | None = None) -> dict:
+    """
+    Распределение записей (без отмененных) по дням недели и часам:
+    {'by_weekday': {1..7: кол-во}, 'by_hour': {час: кол-во}}. Агрегируется в БД.
+    """
+    first_day, last_day = _period_to_days(start_date, end_date)
+    conditions, params = ["status NOT IN ('cancelled_by_user', 'cancelled_by_admin')"], []
+    if first_day is not None:
+        params.append(first_day)
+        conditions.append(f"booking_date >= ${len(params)}")
+    if last_day is not None:
+        params.append(last_day)
+        conditions.append(f"booking_date < ${len(params)}")
+
+    pool = await get_pool()
+    sql = f"""
+        SELECT EXTRACT(ISODOW FROM booking_date)::int AS weekday,
+               EXTRACT(HOUR FROM booking_time)::int AS hour,
+               COUNT(*) AS cnt
+        FROM bookings
+        WHERE {' AND '.join(conditions)}
+        GROUP BY 1, 2;
+    """
+    async with pool.acquire() as connection:
+        records = await connection.fetch(sql, *params)
+
+    by_weekday: dict[int, int] = defaultdict(int)
+    by_hour: dict[int, int] = defaultdict(int)
+    for rec in records:
+        by_weekday[rec['weekday']] += rec['cnt']
+        by_hour[rec['hour']] += rec['cnt']
+    return {'by_weekday': dict(by_weekday), 'by_hour': dict(by_hour)}
+
+async def get_period_report_stats(start_date: datetime, end_date: datetime, top_n: int = 3) -> dict:
+    """
+    Показатели отчета за период [start_date, end_date): количество записей (с разбивкой
+    по статусам) и заказов, выручка с заказов - из daily_metrics (заказы за неполные крайние
+    дни - по точному времени создания); число клиентов,
+    повторных клиентов и топ-N клиентов - запросом по индексам дат, т.к. требуют данных
+    по отдельным пользователям. Отмененные записи не влияют на клиентские показатели.
+    """
+    bookings = await get_booking_history_stats(start_date, end_date)
+    orders = await get_order_metrics(start_date, end_date)
+    first_day, last_day = _period_to_days(start_date, end_date)
+
+    pool = await get_pool()
+    sql = """
+        WITH per_user AS (
+            SELECT user_id, COUNT(*) AS cnt
+            FROM (
+                SELECT user_id FROM bookings
+                WHERE booking_date >= $1 AND booking_date < $2
+                  AND status NOT IN ('cancelled_by_user', 'cancelled_by_admin')
+                UNION ALL
+                SELECT user_id FROM orders
+                WHERE created_at >= $4::timestamp AND created_at < $5::timestamp
+            ) activity
+            GROUP BY user_id
+        )
+        SELECT
+            (SELECT COUNT(*) FROM per_user) AS customers_count,
+            (SELECT COUNT(*) FROM per_user WHERE cnt > 1) AS repeat_customers_count,
+            (
+                SELECT json_agg(json_build_object(
+                    'user_id', top.user_id, 'count', top.cnt,
+                    'user_full_name', top.full_name, 'user_username', top.username
+                ) ORDER BY top.cnt DESC, top.user_id)
+                FROM (
+                    SELECT pu.user_id, pu.cnt, u.full_name, u.username
+                    FROM per_user pu LEFT JOIN users u ON u.user_id = pu.user_id
+                    ORDER BY pu.cnt DESC, pu.user_id
+                    LIMIT $3
+                ) top
+            ) AS top_clients;
+    """
+    async with pool.acquire() as connection:
+        record = await connection.fetchrow(sql, first_day, last_day, top_n, start_date, end_date)
+
+    return {
+        'bookings_count': bookings['total'],
+        'bookings_by_status': bookings['by_status'],
+        'orders_count': orders['orders_count'],
+        'orders_revenue': orders['revenue'],
+        'orders_revenue_count': orders['revenue_orders_count'],
+        'customers_count': record['customers_count'],
+        'repeat_customers_count': record['repeat_customers_count'],
+        'top_clients': record['top_clients'] or [],
+    }
+
+
+# --- Экспорт ---
+# Выгрузка идет через COPY ... TO STDOUT: строки передаются частями в output
+# и не накапливаются в памяти ни на стороне Python, ни в виде списка записей.
+# Выгрузка за все время может идти дольше обычного таймаута запроса (DB_COMMAND_TIMEOUT).
+EXPORT_TIMEOUT = 600  # seconds
+
+def _date_range_conditions(column: str, start_date: datetime | None, end_date: datetime | None) -> tuple[str, list]:
+    """Возвращает условие WHERE по диапазону дней и параметры для него."""
+    first_day, last_day = _period_to_days(start_date, end_date)
+    conditions, params = [], []
+    if first_day is not None:
+        params.append(first_day)
+        conditions.append(f"{column} >= ${len(params)}::date")
+    if last_day is not None:
+        params.append(last_day)
+        conditions.append(f"{column} < ${len(params)}::date")
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+def _copy_rows_count(status: str) -> int:
+    # COPY возвращает статус вида 'COPY 42'
+    return int(status.split()[-1])
+
+async def export_bookings_csv(
+    output: Callable[[bytes], Awaitable[None]], start_date: datetime | None = None, end_date: datetime | None = None
+) -> int:
+    """Потоково выгружает записи во всех статусах за период (по дате записи) в CSV. Возвращает число строк."""
+    where_clause, params = _date_range_conditions("b.booking_date", start_date, end_date)
+    sql = f"""
+        SELECT b.booking_id AS id, TO_CHAR(b.booking_date, 'DD.MM.YYYY') AS date, TO_CHAR(b.booking_time, 'HH24:MI') AS time,
+               b.status, b.service_name AS service, b.price_rub AS price, b.discount_rub AS discount, b.promocode,
+               b.user_id, u.full_name AS user_full_name, u.username AS user_username, u.phone_number,
+               b.created_at, b.details_json AS details
+        FROM bookings b
+        JOIN users u ON u.user_id = b.user_id
+        {where_clause}
+        ORDER BY b.booking_date, b.booking_time, b.booking_id
+    """
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        status = await connection.copy_from_query(sql, *params, output=output, format='csv', header=True, timeout=EXPORT_TIMEOUT)
+    return _copy_rows_count(status)
+
+async def export_orders_csv(
+    output: Callable[[bytes], Awaitable[None]], start_date: datetime | None = None, end_date: datetime | None = None
+) -> int:
+    """
+    Потоково выгружает заказы за период (по дате создания) в CSV. Состав заказа - JSON {товар: кол-во}.
+    Возвращает число строк.
+    """
+    where_clause, params = _date_range_conditions("o.created_at", start_date, end_date)
+    sql = f"""
+        SELECT o.order_id AS id, o.created_at AS date, o.status,
+               o.user_id, u.full_name AS user_full_name, u.username AS user_username,
+               (SELECT json_object_agg(oi.product_id, oi.quantity) FROM order_items oi WHERE oi.order_id = o.order_id) AS cart,
+               o.items_price_rub AS items_price, o.delivery_cost_rub AS delivery_cost, o.discount_rub AS discount_amount,
+               o.total_price_rub AS total_price, o.promocode, o.shipping_method, o.shipping_address AS address
+        FROM orders o
+        JOIN users u ON u.user_id = o.user_id
+        {where_clause}
+        ORDER BY o.created_at, o.order_id
+    """
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        status = await connection.copy_from_query(sql, *params, output=output, format='csv', header=True, timeout=EXPORT_TIMEOUT)
+    return _copy_rows_count(status)
+
+# Выгрузка в аналитику (Parquet). Колонки и типы должны совпадать со схемами в utils.exports.
+# Строки отбираются по updated_at в полуинтервале [since, until); для order_items -
+# по updated_at заказа (при изменении состава заказа обновляется и сам заказ).
+_ANALYTICS_QUERIES = {
+    "bookings": """
+        SELECT booking_id, user_id, service_name, booking_date, booking_time, status::text AS status,
+               price_rub, discount_rub, promocode, created_at, updated_at
+        FROM bookings
+        WHERE ($1::timestamptz IS NULL OR updated_at >= $1) AND updated_at < $2
+        ORDER BY booking_id
+    """,
+    "orders": """
+        SELECT order_id, user_id, status::text AS status, items_price_rub, delivery_cost_rub, discount_rub,
+               total_price_rub, promocode, shipping_method, created_at, updated_at
+        FROM orders
+        WHERE ($1::timestamptz IS NULL OR updated_at >= $1) AND updated_at < $2
+        ORDER BY order_id
+    """,
+    "order_items": """
+        SELECT oi.item_id, oi.order_id, oi.product_id, oi.quantity, oi.price_per_item_rub, o.updated_at AS order_updated_at
+        FROM order_items oi
+        JOIN orders o ON o.order_id = oi.order_id
+        WHERE ($1::timestamptz IS NULL OR o.updated_at >= $1) AND o.updated_at < $2
+        ORDER BY oi.order_id, oi.item_id
+    """,
+    "users": """
+        SELECT user_id, full_name, username, phone_normalized, first_seen, is_blocked, bot_blocked_at, updated_at
+        FROM users
+        WHERE ($1::timestamptz IS NULL OR updated_at >= $1) AND updated_at < $2
+        ORDER BY user_id
+    """,
+}
+ANALYTICS_DATASETS = tuple(_ANALYTICS_QUERIES)
+
+async def get_export_watermark(dataset: str) -> datetime | None:
+    """Возвращает момент, до которого набор данных уже выгружен, или None, если выгрузок не было."""
+    pool = await get_pool()
+    return await pool.fetchval("SELECT exported_until FROM export_watermarks WHERE dataset = $1;", dataset)
+
+async def set_export_watermark(dataset: str, exported_until: datetime) -> None:
+    """Сохраняет отметку успешной выгрузки набора данных."""
+    pool = await get_pool()
+    sql = """
+        INSERT INTO export_watermarks (dataset, exported_until) VALUES ($1, $2)
+        ON CONFLICT (dataset) DO UPDATE SET exported_until = EXCLUDED.exported_until, updated_at = CURRENT_TIMESTAMP;
+    """
+    await pool.execute(sql, dataset, exported_until)
+
+# Сколько ждать завершения транзакций, время начала которых не видно (сессии других ролей
+# без права pg_read_all_stats), прежде чем отказаться от продвижения отметки выгрузки
+EXPORT_BOUND_WAIT_SECONDS = 10
+
+async def get_export_upper_bound() -> datetime:
+    """
+    Верхняя граница инкрементальной выгрузки: начало самой старой открытой транзакции
+    (или текущее время, если открытых нет). updated_at строки - время начала изменившей ее
+    транзакции, поэтому все строки раньше этой границы уже зафиксированы, а строки еще
+    открытых транзакций, сколько бы они ни длились, попадут в следующую выгрузку.
+
+    Открытые транзакции берутся из pg_locks (каждая держит блокировку своего virtualxid,
+    это видно любой роли), а время их начала - из pg_stat_activity. Для сессий других ролей
+    xact_start скрыт; такие транзакции ждем до EXPORT_BOUND_WAIT_SECONDS, после чего граница
+    не продвигается дальше самой старой отметки выгрузки (строки не теряются, выгрузка будет позже).
+    """
+    pool = await get_pool()
+    sql = """
+        WITH open_transactions AS (
+            SELECT l.virtualxid, a.xact_start
+            FROM pg_locks l
+            LEFT JOIN pg_stat_activity a ON a.pid = l.pid
+            WHERE l.locktype = 'virtualxid' AND l.granted AND l.pid <> pg_backend_pid()
+              AND (a.backend_type IS NULL OR a.backend_type IN ('client backend', 'parallel worker'))
+              AND (a.xact_start IS NULL OR a.datname = current_database())
+        )
+        SELECT LEAST(now(), (SELECT MIN(xact_start) FROM open_transactions)) AS bound,
+               ARRAY(SELECT virtualxid FROM open_transactions WHERE xact_start IS NULL) AS hidden;
+    """
+    still_open_sql = """
+        SELECT ARRAY(
+            SELECT virtualxid FROM pg_locks
+            WHERE locktype = 'virtualxid' AND granted AND virtualxid = ANY($1::text[])
+        );
+    """
+    async with pool.acquire() as connection:
+        record = await connection.fetchrow(sql)
+        bound, hidden = record['bound'], record['hidden']
+        deadline = time.monotonic() + EXPORT_BOUND_WAIT_SECONDS
+        # Транзакции, открытые до bound, начались раньше него; когда они завершатся, граница надежна
+        while hidden and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+            hidden = await connection.fetchval(still_open_sql, hidden)
+        if not hidden:
+            return bound
+        logger.warning(
+            f"Export upper bound: {len(hidden)} transaction(s) with hidden start time are still open "
+            f"(grant pg_read_all_stats to the bot role); the watermark will not advance."
+        )
+        return await connection.fetchval(
+            "SELECT LEAST($1::timestamptz, COALESCE(MIN(exported_until), 'epoch'::timestamptz)) FROM export_watermarks;",
+            bound
+        )
+
+async def iter_analytics_rows(
+    dataset: str, since: datetime | None, until: datetime, batch_size: int = 5000
+) -> AsyncIterator[list[dict]]:
+    """
+    Пачками выдает строки набора данных, измененные в [since, until). Чтение идет
+    серверным курсором, поэтому в памяти держится только одна пачка.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        async with connection.transaction(readonly=True):
+            cursor = await connection.cursor(_ANALYTICS_QUERIES[dataset], since, until, timeout=EXPORT_TIMEOUT)
+            while records := await cursor.fetch(batch_size, timeout=EXPORT_TIMEOUT):
+                yield [dict(rec) for rec in records]
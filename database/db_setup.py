@@ -4,6 +4,9 @@ from .schema import CREATE_TABLES_SQL
 
 logger = logging.getLogger(__name__)
 
+# Создание таблиц, индексов и миграции на большой базе идут дольше обычного таймаута запроса (DB_COMMAND_TIMEOUT).
+SCHEMA_SETUP_TIMEOUT = 600  # seconds
+
 async def init_db():
     """
     Инициализирует базу данных: создает таблицы, если они не существуют.
@@ -12,7 +15,7 @@ async def init_db():
     pool = await get_pool()
     async with pool.acquire() as connection:
         try:
-            await connection.execute(CREATE_TABLES_SQL)
+            await connection.execute(CREATE_TABLES_SQL, timeout=SCHEMA_SETUP_TIMEOUT)
             logger.info("Схема базы данных успешно инициализирована.")
 
             # Дополнительная проверка и обновление ENUM типа для обратной совместимости
@@ -24,7 +27,7 @@ BEGIN
         ALTER TYPE booking_status ADD VALUE 'pending_confirmation' BEFORE 'confirmed';
     END IF;
 END$$;
-            """)
+            """, timeout=SCHEMA_SETUP_TIMEOUT)
         except Exception as e:
             logger.critical(f"Не удалось инициализировать схему базы данных: {e}")
             raise
\ No newline at end of file
@@ -1,7 +1,8 @@
 import logging
 import os
-import json
 from .pool import get_pool
+from .db import notify_products_changed
+from utils.json_files import read_json
 
 logger = logging.getLogger(__name__)
 
@@ -16,10 +17,9 @@ async def force_sync_products_from_json():
     products_path = os.path.join('data', 'products.json')
 
     try:
-        with open(products_path, 'r', encoding='utf-8-sig') as f:
-            products_from_file = json.load(f)
+        products_from_file = await read_json(products_path)
         logger.info(f"Successfully loaded {len(products_from_file)} products from {products_path}")
-    except (FileNotFoundError, json.JSONDecodeError) as e:
+    except (FileNotFoundError, ValueError) as e:
         logger.critical(f"Could not load or parse {products_path}. Aborting sync. Error: {e}")
         return
 
@@ -51,7 +51,10 @@ async def force_sync_products_from_json():
                     """,
                     product.get('id'), product.get('name'), product.get('price'), product.get('category'),
                     product.get('subcategory'), product.get('image_url'), product.get('description'),
-                    json.dumps(product.get('detail_images', []))
+                    product.get('detail_images', [])
                 )
+
+        # Шаг 4: После фиксации транзакции сбрасываем закэшированный каталог во всех репликах
+        await notify_products_changed(connection)
     logger.warning("!!! FINISHED DANGEROUS OPERATION: force_sync_products_from_json !!!")
     logger.info(f"Successfully inserted {len(products_from_file)} products into the database.")
\ No newline at end of file
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+import asyncpg
+from config import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Отдельное соединение для LISTEN/NOTIFY. Оно не берется из пула,
+# так как должно жить все время работы бота и держать подписки на каналы.
+_connection: asyncpg.Connection | None = None
+_reconnect_task: asyncio.Task | None = None
+_stopping = False
+
+# Зарегистрированные обработчики: канал -> (обработчик payload, корутина полной пересинхронизации)
+_channels: dict[str, tuple[Callable[[str], None], Callable[[], Awaitable[None]] | None]] = {}
+
+RECONNECT_DELAY = 5  # seconds
+
+
+def register_channel(
+    channel: str,
+    handler: Callable[[str], None],
+    resync: Callable[[], Awaitable[None]] | None = None
+) -> None:
+    """
+    Регистрирует обработчик уведомлений для канала PostgreSQL.
+    resync вызывается после переподключения, т.к. пока соединения не было,
+    уведомления могли быть потеряны.
+    """
+    _channels[channel] = (handler, resync)
+
+
+async def notify(connection: asyncpg.Connection, channel: str, payload: str) -> None:
+    """Отправляет уведомление в канал через переданное соединение (учитывает текущую транзакцию)."""
+    await connection.execute("SELECT pg_notify($1, $2);", channel, payload)
+
+
+def _dispatch(connection: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+    entry = _channels.get(channel)
+    if not entry:
+        return
+    handler, _ = entry
+    try:
+        handler(payload)
+    except Exception as e:
+        logger.error(f"Ошибка обработки уведомления из канала '{channel}' (payload={payload!r}): {e}")
+
+
+def _on_termination(connection: asyncpg.Connection) -> None:
+    global _connection, _reconnect_task
+    _connection = None
+    if _stopping:
+        return
+    logger.warning("Соединение LISTEN/NOTIFY потеряно. Планируем переподключение.")
+    _reconnect_task = asyncio.get_running_loop().create_task(_reconnect())
+
+
+async def _connect() -> None:
+    global _connection
+    connection = await asyncpg.connect(dsn=DATABASE_URL)
+    for channel in _channels:
+        await connection.add_listener(channel, _dispatch)
+    connection.add_termination_listener(_on_termination)
+    _connection = connection
+    logger.info(f"Подписка на каналы PostgreSQL установлена: {', '.join(_channels) or '-'}")
+
+
+async def _reconnect() -> None:
+    while not _stopping:
+        await asyncio.sleep(RECONNECT_DELAY)
+        try:
+            await _connect()
+        except (OSError, asyncpg.exceptions.PostgresError) as e:
+            logger.warning(f"Не удалось переподключиться для LISTEN/NOTIFY: {e}")
+            continue
+        # Пока соединения не было, часть уведомлений могла потеряться - перечитываем состояние
+        for channel, (_, resync) in _channels.items():
+            if resync is None:
+                continue
+            try:
+                await resync()
+            except Exception as e:
+                logger.error(f"Не удалось пересинхронизировать состояние канала '{channel}': {e}")
+        return
+
+
+async def start_listener() -> None:
+    """Открывает выделенное соединение и подписывается на все зарегистрированные каналы."""
+    global _stopping
+    _stopping = False
+    if _connection is None:
+        await _connect()
+
+
+async def stop_listener() -> None:
+    """Закрывает соединение LISTEN/NOTIFY при остановке приложения."""
+    global _connection, _stopping
+    _stopping = True
+    if _reconnect_task and not _reconnect_task.done():
+        _reconnect_task.cancel()
+    if _connection is not None:
+        await _connection.close()
+        _connection = None
+        logger.info("Соединение LISTEN/NOTIFY закрыто.")
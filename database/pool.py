@@ -1,11 +1,58 @@
+import asyncio
+import json
 import asyncpg
 import logging
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_MAX_INACTIVE_LIFETIME,
+    DB_STATEMENT_CACHE_SIZE, DB_COMMAND_TIMEOUT
+)
+
+# Быстрый кодек JSON. Не обязателен: pip install orjson, без него используется стандартный json.
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
 # Глобальная переменная для хранения пула соединений (Singleton)
 _pool: asyncpg.Pool | None = None
+# Защищает создание пула: без нее две корутины при старте могли создать два пула
+_pool_lock = asyncio.Lock()
+
+
+def _json_dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+def _json_loads(data: bytes):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+# Бинарный формат jsonb - байт версии формата (1), за которым идет текст JSON
+def _jsonb_encode(value) -> bytes:
+    return b'\x01' + _json_dumps(value)
+
+
+def _jsonb_decode(data: bytes):
+    return _json_loads(data[1:])
+
+
+async def _init_connection(connection: asyncpg.Connection) -> None:
+    """
+    Настраивает каждое новое соединение пула один раз при его создании.
+    Значения json и jsonb передаются в бинарном формате и сразу приходят как объекты Python
+    (dict, list, ...); при записи в такие колонки передаются объекты, а не строки JSON.
+    """
+    await connection.set_type_codec(
+        'json', encoder=_json_dumps, decoder=_json_loads, schema='pg_catalog', format='binary'
+    )
+    await connection.set_type_codec(
+        'jsonb', encoder=_jsonb_encode, decoder=_jsonb_decode, schema='pg_catalog', format='binary'
+    )
+
 
 async def get_pool() -> asyncpg.Pool:
     """
@@ -13,19 +60,51 @@ async def get_pool() -> asyncpg.Pool:
     Это гарантирует, что у нас есть только один пул на все приложение.
     """
     global _pool
-    if _pool is None:
-        if not DATABASE_URL:
-            logger.critical("DATABASE_URL не установлена! Невозможно создать пул соединений.")
-            raise ValueError("DATABASE_URL is not set")
-        
-        _pool = await asyncpg.create_pool(dsn=DATABASE_URL)
-        logger.info("Пул соединений с базой данных успешно создан.")
+    if _pool is not None:
+        return _pool
+
+    async with _pool_lock:
+        if _pool is None:
+            if not DATABASE_URL:
+                logger.critical("DATABASE_URL не установлена! Невозможно создать пул соединений.")
+                raise ValueError("DATABASE_URL is not set")
+
+            _pool = await asyncpg.create_pool(
+                dsn=DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                command_timeout=DB_COMMAND_TIMEOUT,
+                init=_init_connection,
+            )
+            logger.info(
+                f"Пул соединений с базой данных успешно создан "
+                f"(min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE}, statement_cache={DB_STATEMENT_CACHE_SIZE})."
+            )
     return _pool
 
+
+def get_pool_stats() -> dict:
+    """Возвращает текущее состояние пула: размер, свободные и занятые соединения."""
+    if _pool is None:
+        return {"initialized": False}
+    size, idle = _pool.get_size(), _pool.get_idle_size()
+    return {
+        "initialized": True,
+        "min_size": _pool.get_min_size(),
+        "max_size": _pool.get_max_size(),
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+    }
+
+
 async def close_pool():
     """Закрывает пул соединений при остановке приложения."""
     global _pool
-    if _pool:
-        await _pool.close()
-        _pool = None
-        logger.info("Пул соединений с базой данных закрыт.")
\ No newline at end of file
+    async with _pool_lock:
+        if _pool:
+            await _pool.close()
+            _pool = None
+            logger.info("Пул соединений с базой данных закрыт.")
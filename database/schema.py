@@ -35,7 +35,28 @@ BEGIN
     IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='users' AND column_name='phone_number') THEN
         ALTER TABLE users ADD COLUMN phone_number TEXT;
     END IF;
+    -- Время, когда рассылка получила от Telegram постоянную ошибку (бот заблокирован, чат удален).
+    -- Такие пользователи пропускаются в следующих рассылках, пока снова не напишут боту.
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='users' AND column_name='bot_blocked_at') THEN
+        ALTER TABLE users ADD COLUMN bot_blocked_at TIMESTAMPTZ;
+    END IF;
+    -- Номер телефона в едином формате 7XXXXXXXXXX (только цифры, 8/+7/без кода страны приводятся к 7).
+    -- Колонка вычисляется самой БД при любом изменении phone_number; при добавлении
+    -- колонки заполняется для всех существующих пользователей.
+    -- Правило нормализации должно совпадать с database.db._normalize_phone.
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='users' AND column_name='phone_normalized') THEN
+        ALTER TABLE users ADD COLUMN phone_normalized TEXT GENERATED ALWAYS AS (
+            CASE
+                WHEN regexp_replace(phone_number, '[^0-9]', '', 'g') ~ '^[78][0-9]{10}$'
+                    THEN '7' || substr(regexp_replace(phone_number, '[^0-9]', '', 'g'), 2)
+                WHEN regexp_replace(phone_number, '[^0-9]', '', 'g') ~ '^9[0-9]{9}$'
+                    THEN '7' || regexp_replace(phone_number, '[^0-9]', '', 'g')
+                ELSE NULLIF(regexp_replace(phone_number, '[^0-9]', '', 'g'), '')
+            END
+        ) STORED;
+    END IF;
 END$$;
+CREATE INDEX IF NOT EXISTS idx_users_phone_normalized ON users(phone_normalized);
 
 -- Таблица для промокодов
 CREATE TABLE IF NOT EXISTS promocodes (
@@ -65,6 +86,8 @@ CREATE TABLE IF NOT EXISTS bookings (
 );
 CREATE INDEX IF NOT EXISTS idx_bookings_user_id ON bookings(user_id);
 CREATE INDEX IF NOT EXISTS idx_bookings_date_time ON bookings(booking_date, booking_time);
+-- Для аналитики по истории записей с отбором по статусу и периоду
+CREATE INDEX IF NOT EXISTS idx_bookings_status_date ON bookings(status, booking_date);
 
 -- Таблица для медиафайлов, привязанных к записям
 CREATE TABLE IF NOT EXISTS booking_media (
@@ -90,6 +113,7 @@ CREATE TABLE IF NOT EXISTS orders (
     created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
 );
 CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id);
+CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
 
 -- Таблица для товаров в заказе (связующая)
 CREATE TABLE IF NOT EXISTS order_items (
@@ -136,4 +160,149 @@ CREATE TABLE IF NOT EXISTS products (
     subcategory TEXT
 );
 CREATE INDEX IF NOT EXISTS idx_products_category_id ON products(category_id);
-"""
\ No newline at end of file
+
+-- Задания рассылок. Позволяют продолжить рассылку после перезапуска бота.
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    job_id SERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    content_json JSONB NOT NULL, -- message_id, from_chat_id, button
+    status TEXT NOT NULL DEFAULT 'running', -- 'preparing' (пишутся получатели), 'running', 'completed'
+    admin_chat_id BIGINT, -- Куда выводить прогресс и итоговый отчет
+    status_message_id BIGINT,
+    report_footer TEXT, -- Дополнительный текст для итогового отчета
+    total_recipients INT NOT NULL DEFAULT 0,
+    lease_until TIMESTAMPTZ, -- До какого времени задание занято обработчиком (защита от двойной отправки)
+    lease_owner TEXT, -- Экземпляр бота, которому принадлежит аренда
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMPTZ
+);
+
+-- Получатели рассылки и статус доставки каждому из них
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    job_id INT NOT NULL REFERENCES broadcast_jobs(job_id) ON DELETE CASCADE,
+    user_id BIGINT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', -- 'pending', 'sent', 'failed', 'dead'
+    error TEXT,
+    PRIMARY KEY (job_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_pending ON broadcast_recipients(job_id, user_id) WHERE status = 'pending';
+
+-- Владелец аренды для баз, созданных до его появления
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='broadcast_jobs' AND column_name='lease_owner') THEN
+        ALTER TABLE broadcast_jobs ADD COLUMN lease_owner TEXT;
+    END IF;
+END$$;
+
+-- Ежедневные агрегаты для статистики и отчетов. Записи учитываются по дате записи,
+-- заказы - по дате создания. Одна строка на (день, тип, услуга, статус, промокод).
+CREATE TABLE IF NOT EXISTS daily_metrics (
+    metric_date DATE NOT NULL,
+    kind TEXT NOT NULL, -- 'booking' или 'order'
+    service_name TEXT NOT NULL DEFAULT '', -- Для заказов пусто
+    status TEXT NOT NULL,
+    promocode TEXT NOT NULL DEFAULT '', -- Пусто, если промокод не применялся
+    items_count INT NOT NULL,
+    revenue_rub BIGINT NOT NULL DEFAULT 0, -- Для записей - цена до скидки, для заказов - итоговая сумма
+    discount_rub BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric_date, kind, service_name, status, promocode)
+);
+
+-- Дни, агрегаты которых устарели. Заполняется триггерами при любом изменении записей и заказов,
+-- пересчитывается в database.db.refresh_daily_metrics.
+-- Триггер обновляет уже существующую отметку (ON CONFLICT DO UPDATE), а не пропускает ее:
+-- так строка блокируется до конца транзакции записи, и DELETE в пересчете дождется ее фиксации,
+-- вместо того чтобы снять отметку и пересчитать день без еще не зафиксированного изменения.
+CREATE TABLE IF NOT EXISTS daily_metrics_dirty (
+    metric_date DATE PRIMARY KEY
+);
+
+CREATE OR REPLACE FUNCTION mark_daily_metrics_dirty() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_TABLE_NAME = 'bookings' THEN
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO daily_metrics_dirty (metric_date) VALUES (NEW.booking_date) ON CONFLICT (metric_date) DO UPDATE SET metric_date = EXCLUDED.metric_date;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO daily_metrics_dirty (metric_date) VALUES (OLD.booking_date) ON CONFLICT (metric_date) DO UPDATE SET metric_date = EXCLUDED.metric_date;
+        END IF;
+    ELSE
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO daily_metrics_dirty (metric_date) VALUES (NEW.created_at::date) ON CONFLICT (metric_date) DO UPDATE SET metric_date = EXCLUDED.metric_date;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO daily_metrics_dirty (metric_date) VALUES (OLD.created_at::date) ON CONFLICT (metric_date) DO UPDATE SET metric_date = EXCLUDED.metric_date;
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$fn$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_bookings_daily_metrics') THEN
+        CREATE TRIGGER trg_bookings_daily_metrics AFTER INSERT OR UPDATE OR DELETE ON bookings
+            FOR EACH ROW EXECUTE FUNCTION mark_daily_metrics_dirty();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_orders_daily_metrics') THEN
+        CREATE TRIGGER trg_orders_daily_metrics AFTER INSERT OR UPDATE OR DELETE ON orders
+            FOR EACH ROW EXECUTE FUNCTION mark_daily_metrics_dirty();
+    END IF;
+END$$;
+
+-- Первичное заполнение: если агрегатов еще нет, помечаем к пересчету все дни с данными
+INSERT INTO daily_metrics_dirty (metric_date)
+SELECT booking_date FROM bookings WHERE NOT EXISTS (SELECT 1 FROM daily_metrics)
+UNION
+SELECT created_at::date FROM orders WHERE NOT EXISTS (SELECT 1 FROM daily_metrics)
+ON CONFLICT DO NOTHING;
+
+-- Время последнего изменения строки - для инкрементальной выгрузки в аналитику.
+-- Существующие строки при добавлении колонки получают текущее время.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='bookings' AND column_name='updated_at') THEN
+        ALTER TABLE bookings ADD COLUMN updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='orders' AND column_name='updated_at') THEN
+        ALTER TABLE orders ADD COLUMN updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='users' AND column_name='updated_at') THEN
+        ALTER TABLE users ADD COLUMN updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP;
+    END IF;
+END$$;
+CREATE INDEX IF NOT EXISTS idx_bookings_updated_at ON bookings(updated_at);
+CREATE INDEX IF NOT EXISTS idx_orders_updated_at ON orders(updated_at);
+CREATE INDEX IF NOT EXISTS idx_users_updated_at ON users(updated_at);
+
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $fn$
+BEGIN
+    NEW.updated_at := CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$fn$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_bookings_touch_updated_at') THEN
+        CREATE TRIGGER trg_bookings_touch_updated_at BEFORE UPDATE ON bookings
+            FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_orders_touch_updated_at') THEN
+        CREATE TRIGGER trg_orders_touch_updated_at BEFORE UPDATE ON orders
+            FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_users_touch_updated_at') THEN
+        CREATE TRIGGER trg_users_touch_updated_at BEFORE UPDATE ON users
+            FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+    END IF;
+END$$;
+
+-- Отметки последней выгрузки в аналитику (Parquet): до какого момента данные уже выгружены
+CREATE TABLE IF NOT EXISTS export_watermarks (
+    dataset TEXT PRIMARY KEY, -- 'bookings', 'orders', 'order_items', 'users'
+    exported_until TIMESTAMPTZ NOT NULL,
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+"""
@@ -13,7 +13,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.types import InputMediaPhoto, InputMediaVideo
 from database.db import (
     get_all_bookings, cancel_booking_in_db, get_blocked_dates, get_booking_by_id, update_booking_status,
-    add_blocked_date, remove_blocked_date, increment_promocode_usage
+    add_blocked_date, remove_blocked_date, redeem_promocode
 )
 from keyboards.admin_inline import (
     get_booking_management_keyboard, get_back_to_menu_keyboard, AdminBookingsPaginator
@@ -72,12 +72,12 @@ async def confirm_booking_by_admin(callback: types.CallbackQuery, bot: Bot):
     await bot.send_message(user_id, user_confirmation_text)
 
     await schedule_reminder(confirmed_booking)
-    if promocode := confirmed_booking.get("promocode"):
-        await increment_promocode_usage(promocode)
 
     admin_who_confirmed = callback.from_user
     admin_name = f"@{admin_who_confirmed.username}" if admin_who_confirmed.username else admin_who_confirmed.full_name
     notification_text = f"✅ Запись #{booking_id} была <b>подтверждена</b> администратором {admin_name}."
+    if (promocode := confirmed_booking.get("promocode")) and not await redeem_promocode(promocode, promo_type="detailing"):
+        notification_text += f"\n⚠️ Промокод '{promocode}' не погашен: истек срок или исчерпан лимит использований."
 
     # Редактируем сообщение для админа, который нажал кнопку
     await callback.message.edit_text(f"{notification_text}\nКлиент уведомлен.")
@@ -6,8 +6,8 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import StateFilter
 
 from keyboards.admin_inline import get_broadcast_options_keyboard, get_back_to_menu_keyboard, get_button_markup
-from utils.broadcast import send_broadcast
-from database.db import get_all_unique_user_ids
+from utils.broadcast import start_broadcast_job
+from database.db import iter_broadcast_audience
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -60,19 +60,13 @@ async def confirm_and_send(callback: CallbackQuery, state: FSMContext, bot: Bot)
     data = await state.get_data()
     await state.clear()
 
-    await callback.message.edit_text("⏳ Начинаю рассылку... Это может занять некоторое время.")
-    
-    # Получаем ID всех пользователей для массовой рассылки
-    user_ids = await get_all_unique_user_ids()
-    successful, failed = await send_broadcast(bot=bot, user_ids=list(user_ids), content=data)
-    
-    await callback.message.answer(
-        f"✅ Рассылка завершена!\n\n"
-        f"📬 Успешно отправлено: {successful}\n"
-        f"❌ Не удалось отправить: {failed}"
-    )
+    status_message = await callback.message.edit_text("⏳ Начинаю рассылку... Прогресс будет обновляться в этом сообщении.")
     await callback.answer()
 
+    # Аудитория читается из БД постранично и сразу пишется в задание рассылки.
+    # Рассылка идет в фоне, обработчик не ждет ее завершения
+    await start_broadcast_job(bot, iter_broadcast_audience(), data, status_message)
+
 
 @router.callback_query(F.data == "broadcast_add_button", BroadcastStates.confirmation)
 async def add_button_start(callback: CallbackQuery, state: FSMContext):
@@ -9,7 +9,7 @@ from aiogram.exceptions import TelegramBadRequest
 from .states import AdminStates
 from database.db import (
     get_all_orders, cancel_order_in_db, update_order_status,
-    get_product_by_id, get_all_promocodes, update_order_cart_and_prices
+    get_product_by_id, get_promocode, update_order_cart_and_prices
 )
 from keyboards.admin_inline import (
     get_order_management_keyboard, get_admin_paginator, AdminOrdersPaginator,
@@ -56,8 +56,7 @@ async def _recalculate_order_totals(order_data: dict) -> dict:
     promocode = order_data.get('promocode')
     discount_percent = 0
     if promocode:
-        promocodes_db = await get_all_promocodes()
-        promo_data = promocodes_db.get(promocode)
+        promo_data = await get_promocode(promocode)
         if promo_data and isinstance(promo_data, dict):
             # В админке для пересчета можно не проверять дату/лимит, т.к. промокод уже был применен
             discount_percent = promo_data.get("discount", 0)
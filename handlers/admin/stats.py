@@ -1,56 +1,40 @@
 import logging
-import io
-import csv
-import json
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
 from collections import Counter
 
 from aiogram import F, Router, Bot, types
 from aiogram.types import CallbackQuery
 
 from .states import AdminStates
-from database.db import get_all_bookings, get_all_orders
-from keyboards.admin_inline import get_stats_menu_keyboard, get_back_to_menu_keyboard
+from database.db import (
+    get_booking_history_stats, get_order_metrics,
+    get_daily_revenue, get_booking_time_distribution, ANALYTICS_DATASETS, set_export_watermark
+)
+from keyboards.admin_inline import (
+    get_stats_menu_keyboard, get_back_to_menu_keyboard, get_export_period_keyboard, AdminExportCallback,
+    get_parquet_export_keyboard
+)
 from keyboards.calendar import create_stats_calendar, StatsCalendarCallback
-from utils.reports import generate_period_report_text
+from utils import charts
+from utils.exports import export_csv_to_file, export_analytics_parquet, is_parquet_available
+from utils.reports import generate_period_report_text, format_status_breakdown
 from aiogram.fsm.context import FSMContext
 
-# Для построения графиков. Не забудьте установить: pip install matplotlib
-try:
-    import matplotlib.pyplot as plt
-except ImportError:
-    plt = None
-
 logger = logging.getLogger(__name__)
 router = Router()
 
+# Сколько последних дней показывать на графике выручки
+REVENUE_CHART_DAYS = 30
+WEEKDAY_NAMES = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
 
-def _generate_bar_chart(data: Counter, title: str, xlabel: str, ylabel: str) -> io.BytesIO | None:
-    """Генерирует bar chart из объекта Counter и возвращает его в виде байтов."""
-    if not data or plt is None:
-        return None
 
+async def _generate_bar_chart(data: Counter, title: str, xlabel: str, ylabel: str) -> bytes | None:
+    """Генерирует bar chart из объекта Counter в отдельном процессе и возвращает PNG."""
+    if not data:
+        return None
     labels, values = zip(*data.most_common())
-
-    plt.style.use('seaborn-v0_8-darkgrid')
-    fig, ax = plt.subplots(figsize=(10, max(6, len(labels) * 0.5)))
-
-    bars = ax.barh(labels, values, color='skyblue')
-    ax.set_title(title, fontsize=16, pad=20)
-    ax.set_xlabel(ylabel, fontsize=12)
-    ax.set_ylabel(xlabel, fontsize=12)
-    ax.invert_yaxis()  # Показать самый популярный элемент сверху
-
-    # Добавляем значения на бары
-    for bar in bars:
-        ax.text(bar.get_width() + (max(values) * 0.01), bar.get_y() + bar.get_height()/2, f'{bar.get_width()}', va='center')
-
-    plt.tight_layout()
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    plt.close(fig)
-    buf.seek(0)
-    return buf
+    return await charts.render_chart("bar", list(labels), list(values), title, xlabel, ylabel)
 
 
 @router.callback_query(F.data == "admin_stats")
@@ -65,19 +49,17 @@ async def show_stats_menu(callback: CallbackQuery):
 
 @router.callback_query(F.data == "admin_stats_bookings")
 async def show_bookings_stats(callback: CallbackQuery):
-    """Показывает статистику по записям."""
-    all_bookings = await get_all_bookings()
+    """Показывает статистику по записям за все время, включая выполненные и отмененные."""
+    history = await get_booking_history_stats()
 
-    if not all_bookings:
+    if not history['total']:
         text = "Пока нет ни одной записи для анализа."
     else:
-        total_bookings = len(all_bookings)
-        service_counts = Counter(b.get('service', 'Не указана') for b in all_bookings)
-
-        text = f"📊 <b>Статистика по записям (всего {total_bookings}):</b>\n\n"
-        text += "<b>Популярность услуг:</b>\n"
-        # Сортируем по популярности
-        for service, count in service_counts.most_common():
+        text = f"📊 <b>Статистика по записям (всего {history['total']}):</b>\n"
+        text += format_status_breakdown(history['by_status'])
+        text += "\n<b>Популярность услуг (без отмененных):</b>\n"
+        # Услуги уже отсортированы по популярности
+        for service, count in history['by_service'].items():
             text += f"  • {service}: {count} раз(а)\n"
 
     await callback.message.edit_text(
@@ -90,20 +72,21 @@ async def show_bookings_stats(callback: CallbackQuery):
 @router.callback_query(F.data == "admin_stats_shop")
 async def show_shop_stats(callback: CallbackQuery):
     """Показывает статистику по магазину."""
-    all_orders = await get_all_orders()
+    metrics = await get_order_metrics()
 
-    if not all_orders:
+    if not metrics['orders_count']:
         text = "Пока нет ни одного заказа для анализа."
     else:
-        total_orders = len(all_orders)
-        total_revenue = sum(o.get('total_price', 0) for o in all_orders)
-        avg_check = total_revenue / total_orders if total_orders > 0 else 0
+        total_orders = metrics['orders_count']
+        total_revenue = metrics['revenue']
+        # Выручка и средний чек - без отмененных заказов
+        avg_check = total_revenue / metrics['revenue_orders_count'] if metrics['revenue_orders_count'] else 0
 
-        promocode_counts = Counter(o.get('promocode') for o in all_orders if o.get('promocode'))
+        promocode_counts = Counter(metrics['promocodes'])
 
         text = f"🛒 <b>Статистика по магазину:</b>\n\n"
         text += f"Всего заказов: <b>{total_orders}</b>\n"
-        text += f"Общая выручка: <b>{total_revenue:.2f} руб.</b>\n"
+        text += f"Общая выручка (без отмененных): <b>{total_revenue:.2f} руб.</b>\n"
         text += f"Средний чек: <b>{avg_check:.2f} руб.</b>\n\n"
 
         if promocode_counts:
@@ -180,18 +163,18 @@ async def select_stats_end_date(callback: CallbackQuery, callback_data: StatsCal
 @router.callback_query(F.data == "admin_chart_bookings")
 async def show_bookings_stats_chart(callback: CallbackQuery, bot: Bot):
     """Отправляет график со статистикой по записям."""
-    if plt is None:
+    if not charts.is_available():
         await callback.answer("Библиотека для построения графиков (matplotlib) не установлена.", show_alert=True)
         return
 
     await callback.answer("⏳ Создаю график...")
-    all_bookings = await get_all_bookings()
-    service_counts = Counter(b.get('service', 'Не указана') for b in all_bookings)
+    history = await get_booking_history_stats()
+    service_counts = Counter(history['by_service'])
 
-    chart_buffer = _generate_bar_chart(service_counts, "Популярность услуг", "Услуга", "Количество записей")
+    chart_png = await _generate_bar_chart(service_counts, "Популярность услуг", "Услуга", "Количество записей")
 
-    if chart_buffer:
-        await bot.send_photo(callback.from_user.id, types.BufferedInputFile(chart_buffer.read(), "bookings_stats.png"), caption="Статистика по популярности услуг.")
+    if chart_png:
+        await bot.send_photo(callback.from_user.id, types.BufferedInputFile(chart_png, "bookings_stats.png"), caption="Статистика по популярности услуг.")
     else:
         await callback.message.answer("Нет данных для построения графика.")
 
@@ -199,57 +182,139 @@ async def show_bookings_stats_chart(callback: CallbackQuery, bot: Bot):
 @router.callback_query(F.data == "admin_chart_shop")
 async def show_shop_stats_chart(callback: CallbackQuery, bot: Bot):
     """Отправляет график со статистикой по промокодам."""
-    if plt is None:
+    if not charts.is_available():
         await callback.answer("Библиотека для построения графиков (matplotlib) не установлена.", show_alert=True)
         return
 
     await callback.answer("⏳ Создаю график...")
-    all_orders = await get_all_orders()
-    promocode_counts = Counter(o.get('promocode') for o in all_orders if o.get('promocode'))
+    metrics = await get_order_metrics()
+    promocode_counts = Counter(metrics['promocodes'])
 
-    chart_buffer = _generate_bar_chart(promocode_counts, "Использование промокодов", "Промокод", "Количество использований")
+    chart_png = await _generate_bar_chart(promocode_counts, "Использование промокодов", "Промокод", "Количество использований")
 
-    if chart_buffer:
-        await bot.send_photo(callback.from_user.id, types.BufferedInputFile(chart_buffer.read(), "promocodes_stats.png"), caption="Статистика по использованию промокодов.")
+    if chart_png:
+        await bot.send_photo(callback.from_user.id, types.BufferedInputFile(chart_png, "promocodes_stats.png"), caption="Статистика по использованию промокодов.")
     else:
         await callback.message.answer("Промокоды еще не использовались.")
 
 
-@router.callback_query(F.data == "admin_export_bookings_csv")
-async def export_bookings_csv(callback: CallbackQuery, bot: Bot):
-    """Экспортирует все записи в CSV файл."""
-    await callback.answer("⏳ Готовлю файл...")
-    all_bookings = await get_all_bookings()
-    if not all_bookings:
-        await callback.message.answer("Нет записей для экспорта.")
+@router.callback_query(F.data == "admin_chart_revenue")
+async def show_revenue_chart(callback: CallbackQuery, bot: Bot):
+    """Отправляет график выручки с заказов по дням за последние REVENUE_CHART_DAYS дней."""
+    if not charts.is_available():
+        await callback.answer("Библиотека для построения графиков (matplotlib) не установлена.", show_alert=True)
+        return
+
+    await callback.answer("⏳ Создаю график...")
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    revenue = await get_daily_revenue(today - timedelta(days=REVENUE_CHART_DAYS - 1), today + timedelta(days=1))
+
+    if not any(revenue.values()):
+        await callback.message.answer(f"Нет заказов за последние {REVENUE_CHART_DAYS} дней.")
+        return
+
+    chart_png = await charts.render_chart(
+        "line", [day.strftime('%d.%m') for day in revenue], list(revenue.values()),
+        f"Выручка с заказов за {REVENUE_CHART_DAYS} дней", "Дата", "Выручка, руб."
+    )
+    await bot.send_photo(callback.from_user.id, types.BufferedInputFile(chart_png, "revenue.png"), caption="Выручка с заказов по дням.")
+
+
+@router.callback_query(F.data == "admin_chart_booking_times")
+async def show_booking_times_chart(callback: CallbackQuery, bot: Bot):
+    """Отправляет график распределения записей по дням недели и часам."""
+    if not charts.is_available():
+        await callback.answer("Библиотека для построения графиков (matplotlib) не установлена.", show_alert=True)
         return
 
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=all_bookings[0].keys())
-    writer.writeheader()
-    writer.writerows(all_bookings)
-    output.seek(0)
+    await callback.answer("⏳ Создаю график...")
+    distribution = await get_booking_time_distribution()
 
-    await bot.send_document(callback.from_user.id, types.BufferedInputFile(output.getvalue().encode('utf-8-sig'), "all_bookings.csv"), caption="Экспорт всех записей.")
+    if not distribution['by_weekday']:
+        await callback.message.answer("Нет данных для построения графика.")
+        return
+
+    hours = sorted(distribution['by_hour'])
+    chart_png = await charts.render_chart(
+        "distribution",
+        WEEKDAY_NAMES, [distribution['by_weekday'].get(day, 0) for day in range(1, 8)],
+        [f"{hour:02d}:00" for hour in hours], [distribution['by_hour'][hour] for hour in hours],
+        "Когда записываются клиенты"
+    )
+    await bot.send_photo(callback.from_user.id, types.BufferedInputFile(chart_png, "booking_times.png"), caption="Распределение записей по дням недели и времени.")
 
 
-@router.callback_query(F.data == "admin_export_orders_csv")
-async def export_orders_csv(callback: CallbackQuery, bot: Bot):
-    """Экспортирует все заказы в CSV файл."""
+@router.callback_query(F.data.in_({"admin_export_bookings_csv", "admin_export_orders_csv"}))
+async def choose_export_period(callback: CallbackQuery):
+    """Предлагает выбрать период и формат для экспорта записей или заказов."""
+    kind = "bookings" if callback.data == "admin_export_bookings_csv" else "orders"
+    title = "записей" if kind == "bookings" else "заказов"
+    await callback.message.edit_text(
+        f"За какой период выгрузить CSV {title}?\n\n<i>.gz - сжатый файл, удобно для больших выгрузок.</i>",
+        reply_markup=get_export_period_keyboard(kind)
+    )
+    await callback.answer()
+
+
+@router.callback_query(AdminExportCallback.filter())
+async def export_csv(callback: CallbackQuery, callback_data: AdminExportCallback, bot: Bot):
+    """Экспортирует записи или заказы за выбранный период в CSV файл."""
     await callback.answer("⏳ Готовлю файл...")
-    all_orders = await get_all_orders()
-    if not all_orders:
-        await callback.message.answer("Нет заказов для экспорта.")
+    start_date = None
+    if callback_data.days:
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start_date = today - timedelta(days=callback_data.days - 1)
+
+    path = await export_csv_to_file(callback_data.kind, start_date=start_date, compress=callback_data.gz)
+    if path is None:
+        await callback.message.answer(
+            "Нет записей для экспорта." if callback_data.kind == "bookings" else "Нет заказов для экспорта."
+        )
+        return
+    try:
+        period_text = f"за {callback_data.days} дн." if callback_data.days else "за все время"
+        filename = f"{callback_data.kind}_{datetime.now().strftime('%Y%m%d')}.csv" + (".gz" if callback_data.gz else "")
+        caption = f"Экспорт {'записей' if callback_data.kind == 'bookings' else 'заказов'} {period_text}."
+        await bot.send_document(callback.from_user.id, types.FSInputFile(path, filename=filename), caption=caption)
+    finally:
+        os.remove(path)
+
+
+@router.callback_query(F.data == "admin_export_parquet")
+async def choose_parquet_export(callback: CallbackQuery):
+    """Предлагает выбрать режим выгрузки для аналитики."""
+    if not is_parquet_available():
+        await callback.answer("Библиотека для выгрузки в Parquet (pyarrow) не установлена.", show_alert=True)
         return
 
-    export_data = [order.copy() for order in all_orders]
-    for order in export_data:
-        order['cart'] = json.dumps(order.get('cart', {}), ensure_ascii=False)
+    await callback.message.edit_text(
+        "Выгрузка записей, заказов, позиций заказов и пользователей в Parquet "
+        "(для pandas/DuckDB, с типизированными датами и суммами).\n\n"
+        "<i>Изменения с прошлой выгрузки - только строки, созданные или измененные после нее.</i>",
+        reply_markup=get_parquet_export_keyboard()
+    )
+    await callback.answer()
 
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=export_data[0].keys())
-    writer.writeheader()
-    writer.writerows(export_data)
-    output.seek(0)
 
-    await bot.send_document(callback.from_user.id, types.BufferedInputFile(output.getvalue().encode('utf-8-sig'), "all_orders.csv"), caption="Экспорт всех заказов.")
\ No newline at end of file
+@router.callback_query(F.data.in_({"admin_export_parquet_incremental", "admin_export_parquet_full"}))
+async def export_parquet(callback: CallbackQuery, bot: Bot):
+    """Отправляет Parquet-файлы и сохраняет отметку выгрузки после успешной отправки."""
+    full = callback.data == "admin_export_parquet_full"
+    await callback.answer("⏳ Готовлю файлы...")
+
+    files, exported_until = await export_analytics_parquet(full=full)
+    try:
+        if not files:
+            await bot.send_message(callback.from_user.id, "С прошлой выгрузки данные не изменились.")
+        for dataset, (path, rows_count) in files.items():
+            filename = f"{dataset}_{exported_until.strftime('%Y%m%d_%H%M')}.parquet"
+            await bot.send_document(
+                callback.from_user.id, types.FSInputFile(path, filename=filename),
+                caption=f"{dataset}: {rows_count} строк."
+            )
+    finally:
+        for path, _ in files.values():
+            os.remove(path)
+
+    for dataset in ANALYTICS_DATASETS:
+        await set_export_watermark(dataset, exported_until)
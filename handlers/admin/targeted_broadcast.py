@@ -8,7 +8,7 @@ from aiogram.filters import StateFilter
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from keyboards.admin_inline import get_back_to_menu_keyboard
-from utils.broadcast import send_broadcast
+from utils.broadcast import start_broadcast_job
 from database.db import get_user_ids_by_phone_numbers
 
 logger = logging.getLogger(__name__)
@@ -54,12 +54,10 @@ async def get_phone_numbers(message: Message, state: FSMContext):
         )
         return
 
+    # Ключи результата - номера в том виде, как их ввели (очищенном)
     found_users_map = await get_user_ids_by_phone_numbers(cleaned_numbers)
-    found_user_ids = list(found_users_map.values())
-
-    # Для отчета нам нужны не найденные номера в том виде, как их ввели (очищенном)
-    found_db_numbers = {re.sub(r'\D', '', p) for p in found_users_map.keys()}
-    not_found_numbers = [p for p in cleaned_numbers if p not in found_db_numbers]
+    found_user_ids = list({user_id for user_ids in found_users_map.values() for user_id in user_ids})
+    not_found_numbers = [p for p in cleaned_numbers if p not in found_users_map]
 
     await state.update_data(
         target_user_ids=found_user_ids,
@@ -106,17 +104,13 @@ async def confirm_and_send_targeted(callback: CallbackQuery, state: FSMContext,
     not_found_numbers = data.get('not_found_numbers', [])
     await state.clear()
 
-    await callback.message.edit_text("⏳ Начинаю адресную рассылку...")
-    successful, failed = await send_broadcast(bot=bot, user_ids=target_user_ids, content=data)
+    status_message = await callback.message.edit_text("⏳ Начинаю адресную рассылку...")
+    await callback.answer()
 
-    report_text = (
-        f"✅ Адресная рассылка завершена!\n\n"
-        f"📬 Успешно отправлено: <b>{successful}</b>\n"
-        f"❌ Не удалось отправить: <b>{failed}</b>\n\n"
-        f"🤷‍♂️ Номера не найдены в базе ({len(not_found_numbers)} шт.)"
+    await start_broadcast_job(
+        bot, target_user_ids, data, status_message, title="Адресная рассылка",
+        report_footer=f"🤷‍♂️ Номера не найдены в базе ({len(not_found_numbers)} шт.)"
     )
-    await callback.message.answer(report_text)
-    await callback.answer()
 
 
 @router.callback_query(F.data == "targeted_broadcast_cancel", StateFilter(TargetedBroadcastStates))
@@ -4,7 +4,7 @@ from aiogram.fsm.state import StatesGroup, State
 import logging
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InputMediaPhoto, InputMediaVideo, User
 from datetime import datetime, date, timedelta
-from collections import Counter, defaultdict
+import calendar
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 
 from keyboards.calendar import create_calendar, CalendarCallback
@@ -16,9 +16,10 @@ from keyboards.booking_keyboards import (
     get_dirt_level_keyboard, get_promocode_keyboard, get_comment_keyboard
 )
 from database.db import (
-    add_booking_to_db, get_all_prices, get_blocked_dates, get_all_promocodes,
-    increment_promocode_usage, get_bookings_for_occupancy, update_booking_status)
-from utils.scheduler import schedule_reminder
+    SlotAlreadyBookedError, add_booking_to_db, get_price_table,
+    get_slot_occupancy_for_date, get_unavailable_days_bitmap, update_booking_status)
+from utils.promocodes import validate_promocode
+from utils.prices import price_key
 from utils.constants import ALL_NAMES, WORKING_HOURS
 from config import ADMIN_IDS, MAX_PARALLEL_BOOKINGS
 
@@ -55,25 +56,8 @@ async def calculate_booking_price(data: dict) -> tuple[int, int, float]:
     Рассчитывает базовую стоимость, сумму скидки и итоговую стоимость.
     Возвращает кортеж (base_price, discount_amount, final_price).
     """
-    prices = await get_all_prices()
-    base_price = 0
-    try:
-        service = data.get('service')
-        price_branch = prices.get(service)
-
-        if isinstance(price_branch, int):  # Для простых услуг
-            base_price = price_branch
-
-        if isinstance(price_branch, dict):
-            car_size = data.get('car_size')
-            price_branch = price_branch.get(car_size)
-
-            if service in ["polishing", "ceramics", "wrapping"]:
-                base_price = price_branch.get(data.get('service_type'), 0)
-            if service == "dry_cleaning":
-                base_price = price_branch.get(data.get('interior_type'), {}).get(data.get('dirt_level'), 0)
-    except (AttributeError, TypeError):
-        base_price = 0  # Возвращаем 0, если что-то пошло не так
+    price_table = await get_price_table()
+    base_price = price_table.index.get(price_key(data), 0)
 
     discount_percent = data.get('discount_percent', 0)
     discount_amount = base_price * discount_percent / 100
@@ -165,44 +149,12 @@ async def car_size_chosen(callback: CallbackQuery, state: FSMContext):
 
 async def get_unavailable_dates_for_month(year: int, month: int) -> list[date]:
     """
-    Возвращает список полностью занятых или заблокированных вручную дат для указанного месяца. (Оптимизированная версия)
+    Возвращает список полностью занятых или заблокированных вручную дат для указанного месяца.
+    Данные берутся из закэшированной битовой карты месяца.
     """
-    # 1. Получаем все данные один раз
-    manually_blocked_raw = await get_blocked_dates()
-    all_bookings = await get_bookings_for_occupancy()
-
-    # 2. Фильтруем заблокированные вручную даты для текущего месяца
-    unavailable_dates = set()
-    for date_str in manually_blocked_raw:
-        try:
-            d = datetime.strptime(date_str, "%d.%m.%Y").date()
-            if d.year == year and d.month == month:
-                unavailable_dates.add(d)
-        except ValueError:
-            continue
-
-    # 3. Группируем записи по датам только для нужного месяца
-    bookings_in_month = defaultdict(list)
-    for booking in all_bookings:
-        date_str = booking.get('date')
-        if not date_str:
-            continue
-        try:
-            booking_date = datetime.strptime(date_str, "%d.%m.%Y").date()
-            if booking_date.year == year and booking_date.month == month:
-                bookings_in_month[booking_date].append(booking.get('time'))
-        except (ValueError, KeyError):
-            continue
-
-    # 4. Определяем полностью занятые дни на основе сгруппированных данных
-    total_slots_per_day = len(WORKING_HOURS)
-    for day, times in bookings_in_month.items():
-        time_slot_counts = Counter(times)
-        # Если количество слотов, достигших лимита, равно общему количеству рабочих слотов
-        if sum(1 for slot in WORKING_HOURS if time_slot_counts.get(slot, 0) >= MAX_PARALLEL_BOOKINGS) >= total_slots_per_day:
-            unavailable_dates.add(day)
-
-    return sorted(list(unavailable_dates))
+    bitmap = await get_unavailable_days_bitmap(year, month)
+    days_in_month = calendar.monthrange(year, month)[1]
+    return [date(year, month, day) for day in range(1, days_in_month + 1) if bitmap & (1 << (day - 1))]
 
 
 async def proceed_to_date_selection(message: Message, state: FSMContext, is_edit: bool = True):
@@ -323,27 +275,10 @@ async def skip_comment(callback: CallbackQuery, state: FSMContext):
 async def process_booking_promocode(message: Message, state: FSMContext):
     """Проверяет промокод и переходит к выбору даты, игнорируя команды."""
     promocode = message.text.upper()
-    promo_data = (await get_all_promocodes()).get(promocode)
+    promo_data, _ = await validate_promocode(promocode, promo_type="detailing")
 
-    # Guard clauses for invalid conditions
-    if not promo_data or promo_data.get("type") != "detailing":
-        await state.update_data(promocode=None, discount_percent=0)
-        await message.answer("❌ Промокод недействителен или не подходит для услуг. Продолжаем без скидки.")
-        await proceed_to_date_selection(message, state, is_edit=False)
-        return
-
-    try:
-        today = datetime.now().date()
-        start_date = datetime.strptime(promo_data.get("start_date"), "%Y-%m-%d").date()
-        end_date = datetime.strptime(promo_data.get("end_date"), "%Y-%m-%d").date()
-
-        if not (start_date <= today <= end_date):
-            raise ValueError("Promocode is expired")
-
-        usage_limit = promo_data.get("usage_limit")
-        if usage_limit is not None and promo_data.get("times_used", 0) >= usage_limit:
-            raise ValueError("Usage limit reached")
-    except (ValueError, KeyError, TypeError):
+    # Guard clause: промокод не найден, не для услуг, истек или исчерпан
+    if not promo_data:
         await state.update_data(promocode=None, discount_percent=0)
         await message.answer("❌ Промокод недействителен или не подходит для услуг. Продолжаем без скидки.")
         await proceed_to_date_selection(message, state, is_edit=False)
@@ -374,10 +309,7 @@ async def get_time_slots_occupancy(selected_date: date) -> dict[str, int]:
         return {slot: MAX_PARALLEL_BOOKINGS for slot in WORKING_HOURS}
 
     logger.debug(f"get_time_slots_occupancy: Checking for date: {selected_date}")
-    selected_date_str = selected_date.strftime("%d.%m.%Y")
-    all_bookings = await get_bookings_for_occupancy()
-    bookings_on_date = [b for b in all_bookings if b.get('date') == selected_date_str]
-    time_slot_counts = Counter(b.get('time') for b in bookings_on_date)
+    time_slot_counts = await get_slot_occupancy_for_date(selected_date)
     logger.debug(f"get_time_slots_occupancy: Found occupancy: {time_slot_counts}")
     return time_slot_counts
 
@@ -515,30 +447,6 @@ async def _send_admin_pending_notification(bot: Bot, user: User, new_booking: di
         except Exception as e:
             logger.error(f"Не удалось отправить уведомление о новой заявке администратору {admin_id}: {e}")
 
-async def _finalize_booking_flow(callback: CallbackQuery, state: FSMContext, new_booking: dict, summary_text: str):
-    """Завершает процесс бронирования: отправляет подтверждение, планирует напоминание, инкрементирует промокод."""
-    user_confirmation_text = (
-        "✅ <b>Запись успешна!</b>\n\n"
-        "Мы ждем вас в назначенное время.\n\n"
-        "<b>Детали вашей записи:</b>\n"
-        f"{summary_text}\n\n"
-        f"<b>Дата и время:</b> {new_booking.get('date')} в {new_booking.get('time')}\n\n"
-        "📍 <b>Наш адрес:</b>\n"
-        "Ставрополь, улица Старомарьевское шоссе 12 корпус 2\n\n"
-        "📞 <b>Связаться с нами:</b>\n"
-        "Администратор: <a href='tg://user?id=1973423865'>Написать в Telegram</a>\n\n"
-        "🗺️ <b>Мы на карте:</b>\n"
-        "<a href='https://2gis.ru/stavropol/geo/70030076147466365/42.012416,45.051523'>Открыть в 2ГИС</a>"
-    )
-    await callback.message.edit_text(user_confirmation_text, disable_web_page_preview=True)
-
-    await schedule_reminder(new_booking)
-    if new_booking.get("promocode"):
-        await increment_promocode_usage(new_booking.get("promocode"))
-
-    await state.clear()
-    await callback.answer()
-
 def get_contact_keyboard() -> ReplyKeyboardMarkup:
     """Создает клавиатуру для запроса номера телефона."""
     builder = ReplyKeyboardBuilder()
@@ -558,7 +466,16 @@ async def finalize_booking_and_notify(message: Message, state: FSMContext, bot:
     base_price, discount_amount, final_price = await calculate_booking_price(user_data)
 
     # 2. Сохранение в БД
-    new_booking = await _save_booking_to_db(message.from_user, user_data, final_price, discount_amount)
+    try:
+        new_booking = await _save_booking_to_db(message.from_user, user_data, final_price, discount_amount)
+    except SlotAlreadyBookedError:
+        # Слот успели занять другие клиенты, пока пользователь делился контактом
+        await message.answer(
+            f"Извините, время <b>{user_data.get('time')}</b> на {user_data.get('date')} только что заняли. "
+            "Пожалуйста, выберите другую дату или время."
+        )
+        await proceed_to_date_selection(message, state, is_edit=False)
+        return
 
     # 3. Формируем сводку для уведомлений
     summary_text = await get_booking_summary(user_data)
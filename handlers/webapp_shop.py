@@ -1,5 +1,4 @@
 import json
-from datetime import datetime
 import logging
 from aiogram import F, Router, Bot
 from aiogram.types import Message
@@ -8,7 +7,8 @@ from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import CallbackQuery, User
 
 from config import ADMIN_IDS, DELIVERY_COST
-from database.db import add_order_to_db, get_all_products, get_all_promocodes, increment_promocode_usage, get_product_by_id
+from database.db import add_order_to_db, get_all_products, get_product_by_id, PromocodeRedemptionError
+from utils.promocodes import validate_promocode
 from keyboards.inline import get_shipping_keyboard
 from keyboards.admin_inline import get_new_order_admin_keyboard
 
@@ -37,10 +37,9 @@ async def handle_webapp_data(message: Message, state: FSMContext):
             await message.answer("Ваша корзина пуста.")
             return
 
-        # Загружаем все товары и промокоды один раз
+        # Загружаем все товары один раз
         all_products_list = await get_all_products()
         all_products_dict = {p['id']: p for p in all_products_list}
-        promocodes_db = await get_all_promocodes()
 
         items_price = 0
         for item_id, quantity in cart.items():
@@ -49,25 +48,13 @@ async def handle_webapp_data(message: Message, state: FSMContext):
         
         promocode = data.get('promocode')
         discount_percent = 0
-        promo_data = promocodes_db.get(promocode) if promocode else None
-
-        if promo_data:
-            today = datetime.now().date()
-            try:
-                start_date = datetime.strptime(promo_data.get("start_date"), "%Y-%m-%d").date()
-                end_date = datetime.strptime(promo_data.get("end_date"), "%Y-%m-%d").date()
-                
-                # Проверяем все условия для валидности промокода
-                is_active = start_date <= today <= end_date
-                usage_limit = promo_data.get("usage_limit")
-                is_limit_ok = (usage_limit is None) or (promo_data.get("times_used", 0) < usage_limit)
-
-                if is_active and is_limit_ok:
-                    discount_percent = promo_data.get("discount", 0)
-                else:
-                    logger.warning(f"User {message.from_user.id} tried to use an invalid/expired/limit-reached promocode {promocode}.")
-            except (ValueError, KeyError, TypeError):
-                logger.warning(f"Promocode {promocode} has invalid data format, ignoring.")
+
+        if promocode:
+            promo_data, reason = await validate_promocode(promocode)
+            if promo_data:
+                discount_percent = promo_data.get("discount", 0)
+            elif reason != "not_found":
+                logger.warning(f"User {message.from_user.id} tried to use an invalid promocode {promocode}: {reason}.")
 
         # Сохраняем данные заказа в FSM и запрашиваем способ доставки
         await state.update_data(
@@ -140,6 +127,20 @@ async def _notify_admins_of_new_order(bot: Bot, user: User, order: dict, all_pro
         except Exception as e:
             logger.error(f"Failed to send notification to admin {admin_id}: {e}")
 
+def _build_order_details(user_data: dict, cart: dict, promocode: str | None) -> dict:
+    """Формирует данные заказа для сохранения в БД."""
+    discount_amount = (user_data.get('items_price', 0) * user_data.get('discount_percent', 0)) / 100
+    order_details = {
+        "cart": cart, "items_price": user_data.get('items_price', 0),
+        "promocode": promocode, "discount_amount": discount_amount,
+        "delivery_cost": user_data.get('delivery_cost', 0),
+        "total_price": user_data.get('items_price', 0) - discount_amount + user_data.get('delivery_cost', 0),
+        "shipping_method": user_data.get('shipping_method', 'Не указан')
+    }
+    if address := user_data.get('address'):
+        order_details["address"] = address
+    return order_details
+
 async def _finalize_order(message: Message, user: User, state: FSMContext, bot: Bot, is_callback: bool = False):
     """Внутренняя функция для завершения заказа, сохранения и отправки уведомлений."""
     # Загружаем все товары один раз, чтобы избежать многократных вызовов в цикле
@@ -149,28 +150,31 @@ async def _finalize_order(message: Message, user: User, state: FSMContext, bot:
     user_data = await state.get_data()
     cart = user_data.get('cart', {})
     promocode = user_data.get('promocode')
-    discount_amount = (user_data.get('items_price', 0) * user_data.get('discount_percent', 0)) / 100
 
-    # Сохраняем заказ в "базу данных"
-    order_details = {
-        "cart": cart, "items_price": user_data.get('items_price', 0), 
-        "promocode": promocode, "discount_amount": discount_amount, 
-        "delivery_cost": user_data.get('delivery_cost', 0),
-        "total_price": user_data.get('items_price', 0) - discount_amount + user_data.get('delivery_cost', 0), 
-        "shipping_method": user_data.get('shipping_method', 'Не указан')
-    }
-    if address := user_data.get('address'):
-        order_details["address"] = address
-    new_order = await add_order_to_db(
-        user_id=user.id,
-        user_full_name=user.full_name,
-        user_username=user.username,
-        order_details=order_details
-    )
-
-    # Инкрементируем счетчик использования промокода, если он был
-    if promocode and discount_amount > 0:
-        await increment_promocode_usage(promocode)
+    if not user_data.get('discount_percent', 0):
+        promocode = None
+
+    try:
+        # Промокод погашается в одной транзакции с сохранением заказа
+        new_order = await add_order_to_db(
+            user_id=user.id,
+            user_full_name=user.full_name,
+            user_username=user.username,
+            order_details=_build_order_details(user_data, cart, promocode)
+        )
+    except PromocodeRedemptionError:
+        # С момента проверки лимит промокода мог быть исчерпан другими покупателями -
+        # тогда оформляем заказ без скидки
+        logger.warning(f"Promocode {promocode} of user {user.id} is no longer valid at checkout, discount removed.")
+        await message.answer(f"⚠️ Промокод '{promocode}' больше недействителен, заказ оформлен без скидки.")
+        await state.update_data(promocode=None, discount_percent=0)
+        user_data = await state.get_data()
+        new_order = await add_order_to_db(
+            user_id=user.id,
+            user_full_name=user.full_name,
+            user_username=user.username,
+            order_details=_build_order_details(user_data, cart, None)
+        )
 
     response_text = _build_user_confirmation_text(user_data, all_products_dict)
     # Отправляем подтверждение пользователю
@@ -35,6 +35,12 @@ class AdminEditOrder(CallbackData, prefix="admin_edit_order"):
     item_id: str | None = None # ID товара для удаления
 
 
+class AdminExportCallback(CallbackData, prefix="admin_export"):
+    kind: str  # 'bookings' или 'orders'
+    days: int  # 0 - за все время
+    gz: bool = False
+
+
 class AdminEditClient(CallbackData, prefix="admin_edit_client"):
     action: str # 'select', 'edit_name'
     user_id: int
@@ -160,14 +166,38 @@ def get_stats_menu_keyboard() -> InlineKeyboardMarkup:
         InlineKeyboardButton(text="📊 График по услугам", callback_data="admin_chart_bookings"),
         InlineKeyboardButton(text="📊 График по промокодам", callback_data="admin_chart_shop")
     )
+    builder.row(
+        InlineKeyboardButton(text="📉 Выручка по дням", callback_data="admin_chart_revenue"),
+        InlineKeyboardButton(text="🕒 Дни и часы записей", callback_data="admin_chart_booking_times")
+    )
     builder.row(
         InlineKeyboardButton(text="📄 Экспорт записей (CSV)", callback_data="admin_export_bookings_csv"),
         InlineKeyboardButton(text="📄 Экспорт заказов (CSV)", callback_data="admin_export_orders_csv")
     )
+    builder.row(InlineKeyboardButton(text="🧮 Выгрузка для аналитики (Parquet)", callback_data="admin_export_parquet"))
     builder.row(InlineKeyboardButton(text="📅 Статистика за период", callback_data="admin_stats_custom_period"))
     builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_back_to_main"))
     return builder.as_markup()
 
+def get_export_period_keyboard(kind: str) -> InlineKeyboardMarkup:
+    """Клавиатура выбора периода (и сжатия) для экспорта записей или заказов."""
+    builder = InlineKeyboardBuilder()
+    for days, label in ((7, "7 дней"), (30, "30 дней"), (365, "Год"), (0, "Все время")):
+        builder.row(
+            InlineKeyboardButton(text=f"📄 {label}", callback_data=AdminExportCallback(kind=kind, days=days).pack()),
+            InlineKeyboardButton(text=f"🗜 {label} (.gz)", callback_data=AdminExportCallback(kind=kind, days=days, gz=True).pack())
+        )
+    builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_stats"))
+    return builder.as_markup()
+
+def get_parquet_export_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура выбора режима выгрузки в Parquet: только изменения или все данные."""
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="🔄 Изменения с прошлой выгрузки", callback_data="admin_export_parquet_incremental"))
+    builder.row(InlineKeyboardButton(text="📦 Все данные", callback_data="admin_export_parquet_full"))
+    builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_stats"))
+    return builder.as_markup()
+
 def get_order_management_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура управления заказами."""
     builder = InlineKeyboardBuilder()
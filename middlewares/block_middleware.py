@@ -5,7 +5,7 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 
 from config import ADMIN_IDS
-from database.db import get_blocked_users
+from database.db import is_user_blocked
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +22,7 @@ class BlockMiddleware(BaseMiddleware):
             return await handler(event, data)
 
         # Проверяем, заблокирован ли пользователь
-        if user.id in await get_blocked_users():
+        if await is_user_blocked(user.id):
             logger.warning(f"Ignoring update from blocked user {user.id}")
             return  # Игнорируем обновление, не передавая его дальше
 
@@ -0,0 +1,26 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Тесты запускаются из корня репозитория: python -m pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Тесты с реальной БД пропускаются, если не задана DATABASE_URL
+requires_db = pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="DATABASE_URL is not set")
+
+
+def run_with_db(coro_func):
+    """Выполняет корутину с инициализированной схемой БД и закрывает пул после нее."""
+    from database.db_setup import init_db
+    from database.pool import close_pool
+
+    async def _run():
+        await init_db()
+        try:
+            return await coro_func()
+        finally:
+            await close_pool()
+
+    return asyncio.run(_run())
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+# bot.py подключает все обработчики, поэтому нужны все зависимости бота
+for module in ("aiogram", "aiohttp_cors", "asyncpg", "dotenv"):
+    pytest.importorskip(module)
+
+from aiohttp.test_utils import make_mocked_request
+
+from bot import _is_not_modified, _select_encoding
+
+ETAG = '"v42"'
+VARIANTS = {'identity': b'{}', 'gzip': b'gz', 'br': b'br'}
+LAST_MODIFIED = datetime(2026, 10, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def _request(**headers: str):
+    return make_mocked_request('GET', '/api/products', headers=headers)
+
+
+def _http_date(moment: datetime) -> str:
+    return format_datetime(moment, usegmt=True)
+
+
+def test_no_conditional_headers_is_modified():
+    assert not _is_not_modified(_request(), [ETAG], LAST_MODIFIED)
+
+
+@pytest.mark.parametrize("if_none_match", [ETAG, f'W/{ETAG}', f'"other", {ETAG}', '*'])
+def test_matching_if_none_match_is_not_modified(if_none_match):
+    assert _is_not_modified(_request(**{'If-None-Match': if_none_match}), [ETAG], LAST_MODIFIED)
+
+
+def test_any_variant_etag_matches():
+    assert _is_not_modified(_request(**{'If-None-Match': '"v42-gzip"'}), [ETAG, '"v42-gzip"'], LAST_MODIFIED)
+
+
+def test_stale_if_none_match_is_modified():
+    assert not _is_not_modified(_request(**{'If-None-Match': '"v41"'}), [ETAG], LAST_MODIFIED)
+
+
+def test_if_none_match_takes_priority_over_if_modified_since():
+    request = _request(**{
+        'If-None-Match': '"v41"',
+        'If-Modified-Since': _http_date(LAST_MODIFIED + timedelta(days=1)),
+    })
+    assert not _is_not_modified(request, [ETAG], LAST_MODIFIED)
+
+
+def test_if_modified_since_not_older_than_last_modified_is_not_modified():
+    for moment in (LAST_MODIFIED, LAST_MODIFIED + timedelta(hours=1)):
+        assert _is_not_modified(_request(**{'If-Modified-Since': _http_date(moment)}), [ETAG], LAST_MODIFIED)
+
+
+def test_if_modified_since_older_than_last_modified_is_modified():
+    request = _request(**{'If-Modified-Since': _http_date(LAST_MODIFIED - timedelta(seconds=1))})
+    assert not _is_not_modified(request, [ETAG], LAST_MODIFIED)
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ('gzip, deflate, br', 'br'),
+    ('gzip', 'gzip'),
+    ('br;q=0, gzip', 'gzip'),
+    ('gzip;q=0, br;q=0', 'identity'),
+    ('*', 'br'),
+    ('*, br;q=0', 'gzip'),
+    ('GZIP', 'gzip'),
+    ('br;q=abc, gzip', 'gzip'),
+    ('', 'identity'),
+])
+def test_select_encoding(accept_encoding, expected):
+    assert _select_encoding(_request(**{'Accept-Encoding': accept_encoding}), VARIANTS) == expected
+
+
+def test_select_encoding_without_header_is_identity():
+    assert _select_encoding(_request(), VARIANTS) == 'identity'
+
+
+def test_select_encoding_skips_unavailable_variants():
+    variants = {'identity': b'{}', 'gzip': b'gz'}
+    assert _select_encoding(_request(**{'Accept-Encoding': 'br, gzip'}), variants) == 'gzip'
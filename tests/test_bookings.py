@@ -0,0 +1,87 @@
+import asyncio
+import random
+from datetime import date, time
+
+import pytest
+
+from conftest import requires_db, run_with_db
+
+pytest.importorskip("asyncpg")
+
+PARALLEL_BOOKINGS = 300
+# Отрицательные ID не пересекаются с реальными пользователями Telegram
+TEST_USER_ID_BASE = -9_000_000
+
+
+@requires_db
+def test_parallel_bookings_do_not_exceed_slot_capacity():
+    """Сотни одновременных записей на один слот сохраняют ровно MAX_PARALLEL_BOOKINGS записей."""
+    from config import MAX_PARALLEL_BOOKINGS
+    from database.db import SlotAlreadyBookedError, add_booking_to_db
+    from database.pool import get_pool
+
+    # Слот в далеком будущем, чтобы не задеть реальные записи
+    slot_date = date(2090 + random.randint(0, 9), random.randint(1, 12), random.randint(1, 28))
+    booking_data = {
+        'service': 'washing', 'date': slot_date.strftime('%d.%m.%Y'), 'time': '10:00', 'price': 1500,
+    }
+    user_ids = [TEST_USER_ID_BASE - i for i in range(PARALLEL_BOOKINGS)]
+
+    async def _book(user_id: int) -> bool:
+        try:
+            await add_booking_to_db(user_id, "Load Test", None, dict(booking_data))
+            return True
+        except SlotAlreadyBookedError:
+            return False
+
+    async def _scenario():
+        pool = await get_pool()
+        try:
+            results = await asyncio.gather(*(_book(user_id) for user_id in user_ids))
+            stored = await pool.fetchval(
+                "SELECT COUNT(*) FROM bookings WHERE booking_date = $1 AND booking_time = '10:00';", slot_date
+            )
+        finally:
+            await pool.execute("DELETE FROM users WHERE user_id = ANY($1::bigint[]);", user_ids)
+        return results, stored
+
+    results, stored = run_with_db(_scenario)
+
+    assert stored == MAX_PARALLEL_BOOKINGS
+    assert sum(results) == stored
+
+
+@requires_db
+def test_slot_lock_does_not_serialize_other_slots():
+    """Пока блокировка одного слота удерживается, запись на другой слот проходит сразу, а на этот же - ждет."""
+    from database.db import _LOCK_NAMESPACE_BOOKING_SLOT, _slot_lock_key, add_booking_to_db
+    from database.pool import get_pool
+
+    slot_date = date(2090 + random.randint(0, 9), random.randint(1, 12), random.randint(1, 28))
+    other_slot_user_id, same_slot_user_id = TEST_USER_ID_BASE - PARALLEL_BOOKINGS, TEST_USER_ID_BASE - PARALLEL_BOOKINGS - 1
+
+    def _booking(slot_time: str) -> dict:
+        return {'service': 'washing', 'date': slot_date.strftime('%d.%m.%Y'), 'time': slot_time, 'price': 1500}
+
+    async def _scenario():
+        pool = await get_pool()
+        try:
+            async with pool.acquire() as holder:
+                async with holder.transaction():
+                    await holder.execute(
+                        "SELECT pg_advisory_xact_lock($1, $2);", _LOCK_NAMESPACE_BOOKING_SLOT, _slot_lock_key(slot_date, time(10, 0))
+                    )
+                    # Другой слот того же дня не ждет чужую блокировку
+                    await asyncio.wait_for(add_booking_to_db(other_slot_user_id, "Lock Test", None, _booking('11:00')), timeout=5)
+                    # Запись на заблокированный слот ждет, пока блокировка не будет снята
+                    same_slot = asyncio.create_task(add_booking_to_db(same_slot_user_id, "Lock Test", None, _booking('10:00')))
+                    done, _ = await asyncio.wait({same_slot}, timeout=1)
+                    same_slot_waited = not done
+            await asyncio.wait_for(same_slot, timeout=5)
+        finally:
+            await pool.execute(
+                "DELETE FROM users WHERE user_id = ANY($1::bigint[]);", [other_slot_user_id, same_slot_user_id]
+            )
+        return same_slot_waited
+
+    assert run_with_db(_scenario)
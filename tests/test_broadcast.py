@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import pytest
+
+# utils.broadcast отправляет сообщения через aiogram и хранит задания в БД
+for module in ("aiogram", "asyncpg", "dotenv"):
+    pytest.importorskip(module)
+
+from utils.broadcast import TokenBucket
+
+
+def _elapsed(coro_func) -> float:
+    async def _run():
+        started = time.monotonic()
+        await coro_func()
+        return time.monotonic() - started
+    return asyncio.run(_run())
+
+
+def test_full_bucket_allows_burst_of_capacity():
+    bucket = TokenBucket(rate=1, capacity=5)
+
+    async def _acquire_burst():
+        for _ in range(5):
+            await bucket.acquire()
+
+    assert _elapsed(_acquire_burst) < 0.5
+
+
+def test_acquire_is_paced_at_rate():
+    bucket = TokenBucket(rate=50)  # capacity = rate
+
+    async def _acquire_many():
+        # 50 токенов есть сразу, еще 10 пополняются за 10 / 50 = 0.2 с
+        for _ in range(60):
+            await bucket.acquire()
+
+    assert _elapsed(_acquire_many) >= 0.18
+
+
+def test_concurrent_acquirers_share_the_limit():
+    bucket = TokenBucket(rate=50, capacity=1)
+
+    async def _acquire_concurrently():
+        await asyncio.gather(*(bucket.acquire() for _ in range(11)))
+
+    # Первый токен есть сразу, остальные 10 - по одному раз в 1/50 с
+    assert _elapsed(_acquire_concurrently) >= 0.18
+
+
+def test_pause_blocks_all_acquirers_and_drains_tokens():
+    bucket = TokenBucket(rate=1000, capacity=1000)
+
+    async def _acquire_after_pause():
+        bucket.pause(0.3)
+        await asyncio.gather(*(bucket.acquire() for _ in range(3)))
+
+    assert _elapsed(_acquire_after_pause) >= 0.28
+
+
+def test_pause_does_not_shorten_longer_pause():
+    bucket = TokenBucket(rate=1000)
+
+    async def _acquire_after_pauses():
+        bucket.pause(0.3)
+        bucket.pause(0.05)
+        await bucket.acquire()
+
+    assert _elapsed(_acquire_after_pauses) >= 0.28
@@ -0,0 +1,44 @@
+import base64
+import json
+
+import pytest
+
+# utils.catalog читает настройки и товары через config и database.db
+for module in ("asyncpg", "dotenv"):
+    pytest.importorskip(module)
+
+from utils.catalog import _decode_cursor, _encode_cursor
+
+
+def _raw_cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+@pytest.mark.parametrize("key", [
+    ("Шампуни", "Активная пена", "p-1"),
+    ("", "", ""),
+    ("Sub/with+chars", "Name \"quoted\"", "id=?&"),
+])
+def test_cursor_round_trip(key):
+    cursor = _encode_cursor(key)
+    assert _decode_cursor(cursor) == key
+
+
+def test_cursor_is_url_safe():
+    cursor = _encode_cursor(("Полироли?", "Воск/спрей+", "id"))
+    assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64 at all!",
+    base64.urlsafe_b64encode(b"not json").decode('ascii'),
+    _raw_cursor([1]),
+    _raw_cursor(["a", "b"]),
+    _raw_cursor(["a", "b", 3]),
+    _raw_cursor(["a", "b", "c", "d"]),
+    _raw_cursor({"sub": "a", "name": "b", "id": "c"}),
+    _raw_cursor(None),
+])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        _decode_cursor(cursor)
@@ -0,0 +1,30 @@
+import pytest
+
+# database.db подключает пул asyncpg и настройки из config
+for module in ("asyncpg", "dotenv"):
+    pytest.importorskip(module)
+
+from database.db import _normalize_phone
+
+
+@pytest.mark.parametrize("phone", [
+    "+7 (912) 345-67-89",
+    "89123456789",
+    "79123456789",
+    "8-912-345-67-89",
+    "9123456789",
+    " +7 912 345 67 89 ",
+])
+def test_russian_formats_normalize_to_same_number(phone):
+    assert _normalize_phone(phone) == "79123456789"
+
+
+def test_other_numbers_keep_their_digits():
+    # Не российский формат: только убираются разделители
+    assert _normalize_phone("+375 (29) 123-45-67") == "375291234567"
+    assert _normalize_phone("4951234567") == "4951234567"
+
+
+@pytest.mark.parametrize("phone", [None, "", "---", "нет телефона"])
+def test_numbers_without_digits_are_none(phone):
+    assert _normalize_phone(phone) is None
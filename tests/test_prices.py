@@ -0,0 +1,51 @@
+import itertools
+import json
+import os
+
+from utils.constants import SERVICE_PRICE_OPTIONS
+from utils.prices import compile_price_index, price_key
+
+PRICES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "prices.json")
+
+
+def _load_prices() -> dict:
+    with open(PRICES_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_prices_file_has_no_missing_price_keys():
+    index, missing = compile_price_index(_load_prices())
+    assert missing == []
+    expected = sum(
+        len(list(itertools.product(*(values for _, values in options))))
+        for options in SERVICE_PRICE_OPTIONS.values()
+    )
+    assert len(index) == expected
+
+
+def test_price_key_matches_index_keys():
+    index, _ = compile_price_index(_load_prices())
+    for key in index:
+        service, *values = key
+        data = {'service': service, **{field: value for (field, _), value in zip(SERVICE_PRICE_OPTIONS[service], values)}}
+        assert price_key(data) == key
+
+
+def test_flat_price_applies_to_all_variants():
+    options = SERVICE_PRICE_OPTIONS["wrapping"]
+    index, missing = compile_price_index({"wrapping": 50000})
+    wrapping_keys = [key for key in index if key[0] == "wrapping"]
+    assert len(wrapping_keys) == len(list(itertools.product(*(values for _, values in options))))
+    assert all(index[key] == 50000 for key in wrapping_keys)
+    assert not any(item.startswith("wrapping/") for item in missing)
+
+
+def test_missing_and_invalid_prices_are_reported():
+    prices = _load_prices()
+    prices.pop("washing")
+    size = next(iter(prices["polishing"]))
+    service_type = next(iter(prices["polishing"][size]))
+    prices["polishing"][size][service_type] = "1000"  # Строка вместо числа
+    _, missing = compile_price_index(prices)
+    assert "washing" in missing
+    assert f"polishing/{size}/{service_type}" in missing
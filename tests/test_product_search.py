@@ -0,0 +1,60 @@
+from utils.product_search import ProductSearchIndex, tokenize
+
+PRODUCTS = [
+    {"id": "p1", "name": "Шампунь для бесконтактной мойки", "description": "Активная пена"},
+    {"id": "p2", "name": "Полироль для пластика", "description": "Матовый эффект, подходит для салона"},
+    {"id": "p3", "name": "Воск жидкий", "description": "Защита кузова после шампуня"},
+    {"id": "p4", "name": "Микрофибра", "description": "Салфетка для полировки<br>Плотность 400"},
+    {"id": "p5", "name": "Ёлочка ароматизатор", "description": None},
+]
+
+
+def _index() -> ProductSearchIndex:
+    return ProductSearchIndex(PRODUCTS)
+
+
+def test_tokenize_normalizes_case_yo_and_markup():
+    assert tokenize("Ёлочка<br>ПЕНА") == ["елочка", "пена"]
+    assert tokenize(None) == []
+
+
+def test_exact_match_skips_fuzzy_candidates():
+    # "шампуня" в описании p3 отличается одной буквой, но при точном совпадении опечатки не ищутся
+    assert _index().search("шампунь") == ["p1"]
+
+
+def test_prefix_match_while_typing():
+    assert _index().search("поли") == ["p2", "p4"]
+    assert _index().search("микро") == ["p4"]
+
+
+def test_single_letter_is_not_used_as_prefix():
+    assert _index().search("м") == []
+
+
+def test_typo_is_tolerated():
+    assert _index().search("полироь") == ["p2"]
+    assert _index().search("микрофибар") == ["p4"]
+
+
+def test_short_tokens_are_not_fuzzy_matched():
+    # Для токенов короче MIN_FUZZY_LENGTH опечатки не ищутся
+    assert _index().search("вск") == []
+
+
+def test_products_matching_all_words_come_first():
+    assert _index().search("для салона")[0] == "p2"
+
+
+def test_name_match_ranks_above_description_match():
+    # "пена" есть только в описании p1, "воск" - в названии p3
+    assert _index().search("воск пена") == ["p3", "p1"]
+
+
+def test_yo_is_equivalent_to_e():
+    assert _index().search("елочка") == ["p5"]
+
+
+def test_empty_query_and_limit():
+    assert _index().search("  ") == []
+    assert len(_index().search("для", limit=2)) == 2
@@ -0,0 +1,42 @@
+import asyncio
+import uuid
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import requires_db, run_with_db
+
+pytest.importorskip("asyncpg")
+
+USAGE_LIMIT = 5
+PARALLEL_REDEMPTIONS = 50
+
+
+@requires_db
+def test_parallel_redemptions_do_not_exceed_usage_limit():
+    """Одновременные погашения промокода с лимитом дают ровно usage_limit успехов."""
+    from database.db import redeem_promocode
+    from database.pool import get_pool
+
+    code = f"TEST{uuid.uuid4().hex[:8].upper()}"
+
+    async def _scenario():
+        pool = await get_pool()
+        await pool.execute(
+            """
+            INSERT INTO promocodes (code, promo_type, discount_percent, start_date, end_date, usage_limit)
+            VALUES ($1, 'shop', 10, $2, $3, $4);
+            """,
+            code, date.today() - timedelta(days=1), date.today() + timedelta(days=1), USAGE_LIMIT
+        )
+        try:
+            results = await asyncio.gather(*(redeem_promocode(code) for _ in range(PARALLEL_REDEMPTIONS)))
+            times_used = await pool.fetchval("SELECT times_used FROM promocodes WHERE code = $1;", code)
+        finally:
+            await pool.execute("DELETE FROM promocodes WHERE code = $1;", code)
+        return results, times_used
+
+    results, times_used = run_with_db(_scenario)
+
+    assert sum(result is not None for result in results) == USAGE_LIMIT
+    assert times_used == USAGE_LIMIT
@@ -1,57 +1,328 @@
 import asyncio
 import logging
-from typing import Dict, Any
+import time
+from typing import Dict, Any, AsyncIterable, Awaitable, Callable, Iterable
 
 from aiogram import Bot
-from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter, TelegramAPIError
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter, TelegramAPIError
+from aiogram.types import Message
 
-from database.db import get_all_unique_user_ids
+from config import BROADCAST_RATE_LIMIT, BROADCAST_CONCURRENCY
+from database.db import (
+    create_broadcast_job, claim_broadcast_job, get_unfinished_broadcast_jobs, iter_pending_broadcast_recipients,
+    get_broadcast_job_stats, save_broadcast_results, finish_broadcast_job, release_broadcast_job
+)
 from keyboards.admin_inline import get_button_markup
 
 logger = logging.getLogger(__name__)
 
+MAX_RETRIES = 3  # Сколько раз повторяем отправку одному пользователю после RetryAfter
+PROGRESS_INTERVAL = 3  # seconds, как часто обновлять прогресс и сохранять результаты
+RESULTS_BATCH_SIZE = 100  # Сколько результатов доставки копить перед записью в БД
+RESUME_INTERVAL_MINUTES = 5  # Как часто проверять, нет ли брошенных рассылок
 
-async def send_broadcast(bot: Bot, user_ids: list[int], content: Dict[str, Any]) -> tuple[int, int]:
+# Запущенные фоновые рассылки: job_id -> задача. Храним ссылки, чтобы задачи не собрал сборщик мусора.
+_running_jobs: dict[int, asyncio.Task] = {}
+
+
+class BroadcastLeaseLostError(Exception):
+    """Аренда задания рассылки перешла к другому экземпляру бота - отправку нужно прекратить."""
+    pass
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты отправки: пополняется со скоростью rate токенов в секунду,
+    вмещает не больше capacity. Общий для всех отправителей одной рассылки.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        """Ждет, пока можно будет отправить одно сообщение."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает выдачу токенов всем отправителям (ответ Telegram RetryAfter)."""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated_at = now + seconds
+
+
+async def send_broadcast(
+    bot: Bot,
+    user_ids: Iterable[int] | AsyncIterable[int],
+    content: Dict[str, Any],
+    on_result: Callable[[int, str, str | None], Awaitable[None]] | None = None
+) -> tuple[int, int]:
     """
     Выполняет рассылку сообщения указанным пользователям.
+    Отправка идет несколькими параллельными отправителями с общим ограничением частоты.
 
     :param bot: Экземпляр aiogram.Bot.
-    :param user_ids: Список ID пользователей для рассылки.
+    :param user_ids: ID пользователей для рассылки: список или асинхронный генератор
+        (читается по мере отправки, в памяти держится только небольшая очередь).
     :param content: Словарь, описывающий сообщение (message_id, from_chat_id, button).
+    :param on_result: Необязательный колбэк (user_id, статус, ошибка), вызывается после каждой отправки.
+        Статус: 'sent', 'failed' или 'dead' (чат недоступен навсегда).
     :return: Кортеж (успешно отправлено, не удалось отправить).
     """
-    if not user_ids:
-        logger.info("Рассылка: нет пользователей для отправки.")
-        return 0, 0
-        
-    logger.info(f"Начинается рассылка для {len(user_ids)} пользователей.")
+    logger.info("Начинается рассылка.")
 
-    successful_sends = 0
-    failed_sends = 0
+    counters = {"successful": 0, "failed": 0}
     reply_markup = get_button_markup(content.get("button"))
+    bucket = TokenBucket(BROADCAST_RATE_LIMIT)
+    queue: asyncio.Queue[int | None] = asyncio.Queue(maxsize=BROADCAST_CONCURRENCY * 4)
+
+    async def _producer() -> None:
+        if isinstance(user_ids, AsyncIterable):
+            async for user_id in user_ids:
+                await queue.put(user_id)
+        else:
+            for user_id in user_ids:
+                await queue.put(user_id)
+        # По одному маркеру завершения на каждого отправителя
+        for _ in range(BROADCAST_CONCURRENCY):
+            await queue.put(None)
+
+    async def _send_one(user_id: int) -> tuple[str, str | None]:
+        for attempt in range(1, MAX_RETRIES + 1):
+            await bucket.acquire()
+            try:
+                await bot.copy_message(
+                    chat_id=user_id,
+                    from_chat_id=content['from_chat_id'],
+                    message_id=content['message_id'],
+                    reply_markup=reply_markup
+                )
+                logger.debug(f"Рассылка: сообщение успешно отправлено пользователю {user_id}")
+                return "sent", None
+            except TelegramRetryAfter as e:
+                # Лимит общий для бота - останавливаем всех отправителей и повторяем этому же пользователю
+                logger.warning(f"Рассылка: превышен лимит. Пауза на {e.retry_after} секунд (попытка {attempt}/{MAX_RETRIES}).")
+                bucket.pause(e.retry_after)
+            except TelegramForbiddenError as e:
+                logger.warning(f"Рассылка: пользователь {user_id} заблокировал бота.")
+                return "dead", str(e)
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e).lower():
+                    logger.warning(f"Рассылка: чат пользователя {user_id} не найден.")
+                    return "dead", str(e)
+                logger.error(f"Рассылка: ошибка при отправке пользователю {user_id}: {e}")
+                return "failed", str(e)
+            except (TelegramAPIError, Exception) as e:
+                logger.error(f"Рассылка: ошибка при отправке пользователю {user_id}: {e}")
+                return "failed", str(e)
+        logger.error(f"Рассылка: не удалось отправить пользователю {user_id} после {MAX_RETRIES} попыток.")
+        return "failed", "retry limit exceeded"
+
+    async def _worker() -> None:
+        while (user_id := await queue.get()) is not None:
+            status, error = await _send_one(user_id)
+            counters["successful" if status == "sent" else "failed"] += 1
+            if on_result:
+                await on_result(user_id, status, error)
+
+    # Ошибка в производителе (например, БД) или в on_result останавливает всю рассылку:
+    # остальные задачи отменяются, а не остаются висеть на пустой очереди или слать в фоне
+    tasks = [asyncio.create_task(_producer())]
+    tasks += [asyncio.create_task(_worker()) for _ in range(BROADCAST_CONCURRENCY)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    logger.info(f"Рассылка завершена. Успешно: {counters['successful']}, Ошибки: {counters['failed']}")
+    return counters["successful"], counters["failed"]
+
+
+def _format_progress(title: str, total: int, successful: int, failed: int) -> str:
+    return (
+        f"⏳ {title}...\n\n"
+        f"Обработано: {successful + failed} из {total}\n"
+        f"📬 Успешно: {successful}\n"
+        f"❌ Ошибки: {failed}"
+    )
+
+
+async def _run_job(bot: Bot, job: dict) -> None:
+    """
+    Выполняет задание рассылки: отправляет сообщение получателям со статусом 'pending'
+    и пачками сохраняет результаты в БД. После перезапуска продолжает с того же места.
+    """
+    job_id, title = job["job_id"], job["title"]
+    stats = await get_broadcast_job_stats(job_id)
+    progress = {
+        "successful": stats.get("sent", 0),
+        "failed": stats.get("failed", 0) + stats.get("dead", 0),
+    }
+    results: list[tuple[int, str, str | None]] = []
+    flush_lock = asyncio.Lock()
+    lease = {"lost": False}
+    logger.info(
+        f"Рассылка #{job_id}: отправлено {sum(stats.values()) - stats.get('pending', 0)} "
+        f"из {job['total_recipients']}, продолжаем."
+    )
 
-    for user_id in user_ids:
+    async def _flush() -> None:
+        async with flush_lock:
+            batch = results[:]
+            results.clear()
+            try:
+                if not await save_broadcast_results(job_id, batch):
+                    lease["lost"] = True
+            except Exception as e:
+                # Не теряем результаты: сохраним их со следующей пачкой
+                logger.error(f"Рассылка #{job_id}: не удалось сохранить результаты: {e}")
+                results[:0] = batch
+
+    async def _on_result(user_id: int, status: str, error: str | None) -> None:
+        results.append((user_id, status, error))
+        progress["successful" if status == "sent" else "failed"] += 1
+        if len(results) >= RESULTS_BATCH_SIZE:
+            await _flush()
+        # Ошибка из колбэка останавливает всех отправителей send_broadcast
+        if lease["lost"]:
+            raise BroadcastLeaseLostError(f"Рассылка #{job_id}: аренда задания перешла к другому экземпляру бота")
+
+    async def _report_progress() -> None:
+        last_text = None
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            # Периодическое сохранение заодно продлевает аренду задания
+            await _flush()
+            if not job.get("admin_chat_id") or not job.get("status_message_id"):
+                continue
+            text = _format_progress(title, job["total_recipients"], progress["successful"], progress["failed"])
+            if text == last_text:
+                continue
+            try:
+                await bot.edit_message_text(text, chat_id=job["admin_chat_id"], message_id=job["status_message_id"])
+                last_text = text
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                logger.debug(f"Рассылка #{job_id}: не удалось обновить прогресс: {e}")
+
+    reporter = asyncio.create_task(_report_progress())
+    try:
+        await send_broadcast(bot, iter_pending_broadcast_recipients(job_id), job["content"], on_result=_on_result)
+    finally:
+        reporter.cancel()
+        await _flush()
+
+    if lease["lost"] or not await finish_broadcast_job(job_id):
+        raise BroadcastLeaseLostError(f"Рассылка #{job_id}: аренда задания перешла к другому экземпляру бота")
+    stats = await get_broadcast_job_stats(job_id)
+    report_text = (
+        f"✅ {title} завершена!\n\n"
+        f"📬 Успешно отправлено: {stats.get('sent', 0)}\n"
+        f"❌ Не удалось отправить: {stats.get('failed', 0) + stats.get('dead', 0)}"
+    )
+    if stats.get("dead"):
+        report_text += f"\n🚫 Из них заблокировали бота: {stats['dead']}"
+    if job.get("report_footer"):
+        report_text += f"\n\n{job['report_footer']}"
+    if job.get("admin_chat_id"):
+        await bot.send_message(job["admin_chat_id"], report_text)
+
+
+async def _release_job(job_id: int) -> None:
+    try:
+        await release_broadcast_job(job_id)
+    except Exception as e:
+        logger.error(f"Рассылка #{job_id}: не удалось снять аренду задания: {e}")
+
+
+def _spawn_job(bot: Bot, job: dict) -> asyncio.Task:
+    job_id = job["job_id"]
+
+    async def _run() -> None:
         try:
-            await bot.copy_message(
-                chat_id=user_id,
-                from_chat_id=content['from_chat_id'],
-                message_id=content['message_id'],
-                reply_markup=reply_markup
-            )
-            successful_sends += 1
-            logger.debug(f"Рассылка: сообщение успешно отправлено пользователю {user_id}")
-            await asyncio.sleep(0.05)  # Защита от превышения лимитов Telegram (20-30 msg/sec)
-        except TelegramRetryAfter as e:
-            logger.warning(f"Рассылка: превышен лимит. Пауза на {e.retry_after} секунд.")
-            await asyncio.sleep(e.retry_after)
-            # Повторяем попытку для того же пользователя (простая реализация)
+            await _run_job(bot, job)
+        except asyncio.CancelledError:
+            logger.info(f"Рассылка #{job_id} остановлена, будет продолжена после перезапуска.")
+            await _release_job(job_id)
+            raise
+        except BroadcastLeaseLostError as e:
+            # Задание продолжает новый владелец аренды, снимать ее не нужно
+            logger.warning(f"{e}, останавливаемся.")
+        except Exception as e:
+            logger.exception(f"Рассылка #{job_id} прервана ошибкой: {e}")
+            await _release_job(job_id)
+
+    task = asyncio.create_task(_run())
+    _running_jobs[job_id] = task
+    task.add_done_callback(lambda _: _running_jobs.pop(job_id, None))
+    return task
+
+
+async def start_broadcast_job(
+    bot: Bot,
+    user_ids: Iterable[int] | AsyncIterable[int],
+    content: Dict[str, Any],
+    status_message: Message,
+    title: str = "Рассылка",
+    report_footer: str | None = None
+) -> dict:
+    """
+    Сохраняет рассылку как задание в БД и запускает ее в фоне, сразу возвращая управление.
+    Прогресс выводится в status_message, итоговый отчет отправляется в тот же чат.
+    """
+    job = await create_broadcast_job(
+        title, content, user_ids,
+        admin_chat_id=status_message.chat.id,
+        status_message_id=status_message.message_id,
+        report_footer=report_footer
+    )
+    _spawn_job(bot, job)
+    return job
+
+
+async def resume_broadcast_jobs(bot: Bot) -> None:
+    """
+    Продолжает незавершенные рассылки, которые сейчас никто не выполняет: прерванные
+    перезапуском, ошибкой или упавшим экземпляром бота. Вызывается при старте и по расписанию.
+    """
+    for job in await get_unfinished_broadcast_jobs():
+        if job["job_id"] in _running_jobs:
             continue
-        except TelegramForbiddenError:
-            logger.warning(f"Рассылка: пользователь {user_id} заблокировал бота.")
-            failed_sends += 1
-        except (TelegramAPIError, Exception) as e:
-            logger.error(f"Рассылка: ошибка при отправке пользователю {user_id}: {e}")
-            failed_sends += 1
-
-    logger.info(f"Рассылка завершена. Успешно: {successful_sends}, Ошибки: {failed_sends}")
-    return successful_sends, failed_sends
\ No newline at end of file
+        if not await claim_broadcast_job(job["job_id"]):
+            logger.info(f"Рассылка #{job['job_id']} выполняется другим экземпляром бота, пропускаем.")
+            continue
+        logger.info(f"Возобновляем прерванную рассылку #{job['job_id']} ({job['title']}).")
+        _spawn_job(bot, job)
+
+
+async def stop_broadcast_jobs() -> None:
+    """
+    Останавливает фоновые рассылки при выключении бота, сохранив накопленные результаты
+    и сняв аренду заданий, чтобы следующий запуск сразу их продолжил.
+    """
+    tasks = list(_running_jobs.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,251 @@
+import asyncio
+import base64
+import bisect
+import gzip
+import hashlib
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from config import SHOP_CATEGORIES
+from database.db import get_all_products, get_products_version
+from utils.product_search import ProductSearchIndex
+
+# Brotli необязателен: без него отдаем gzip. Установка: pip install brotli
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Поля товара, которые можно запросить через fields=, и поля по умолчанию для списков.
+# Описание и детальные фото в списках не нужны - они загружаются только в карточке товара.
+PRODUCT_FIELDS = ("id", "name", "price", "imageUrl", "subcategory", "category", "description", "detailImages")
+LIST_FIELDS = ("id", "name", "price", "imageUrl", "subcategory")
+MAX_PAGE_SIZE = 100
+
+# Готовый к отдаче каталог: версия товаров, JSON в байтах, ETag и время сборки.
+# Пересобирается только при изменении версии каталога (см. database.db.get_products_version).
+_catalog_cache: dict | None = None
+_catalog_lock = asyncio.Lock()
+
+
+def _transform_product_for_frontend(product: dict) -> dict:
+    """
+    Преобразует ключи объекта продукта в формат,
+    более удобный для JavaScript (camelCase и короткие имена),
+    а также заменяет HTML-теги переноса на символы новой строки.
+    """
+    new_product = product.copy()
+    if 'image_url' in new_product:
+        new_product['imageUrl'] = new_product.pop('image_url') # Стандартный camelCase для JS
+    if 'detail_images' in new_product:
+        new_product['detailImages'] = new_product.pop('detail_images')
+
+    if 'description' in new_product and isinstance(new_product['description'], str):
+        # Заменяем HTML-сущность <br> и сам тег на символ переноса строки \n,
+        # который с большей вероятностью будет правильно обработан CSS на фронтенде.
+        new_product['description'] = new_product['description'].replace('&lt;br&gt;', '\n').replace('<br>', '\n')
+
+    return new_product
+
+
+def build_catalog_tree(all_products: list[dict]) -> list[dict]:
+    """
+    Группирует товары по категориям и подкатегориям в формат, который ожидает фронтенд:
+    [ { "name": "ИмяКатегории", "subcategories": [ { "name": "ИмяПодкатегории", "products": [...] } ] } ]
+    """
+    categories = defaultdict(lambda: defaultdict(list))
+
+    for product in all_products:
+        category_name = (product.get("category") or "Без категории").strip() or "Без категории"
+        subcategory_name = (product.get("subcategory") or "Основное").strip() or "Основное"
+        categories[category_name][subcategory_name].append(_transform_product_for_frontend(product))
+
+    # Добавляем пустые категории из конфига, если их еще нет в каталоге
+    for category_name in SHOP_CATEGORIES:
+        if category_name not in categories:
+            categories[category_name] = defaultdict(list)
+
+    return [
+        {
+            "name": cat_name,
+            "subcategories": [
+                {"name": sub_name, "products": products}
+                for sub_name, products in sorted(subcategories.items())
+            ]
+        }
+        for cat_name, subcategories in sorted(categories.items()) # Сортируем для стабильного порядка
+    ]
+
+
+def build_catalog_skeleton(tree: list[dict]) -> list[dict]:
+    """Возвращает структуру категорий и подкатегорий с количеством товаров, без самих товаров."""
+    return [
+        {
+            "name": category["name"],
+            "productCount": sum(len(sub["products"]) for sub in category["subcategories"]),
+            "subcategories": [
+                {"name": sub["name"], "productCount": len(sub["products"])}
+                for sub in category["subcategories"]
+            ]
+        }
+        for category in tree
+    ]
+
+
+def _build_category_index(tree: list[dict]) -> dict[str, dict]:
+    """
+    Строит для каждой категории плоский список товаров, отсортированный по ключу
+    (подкатегория, название, id). По этому ключу работает курсорная пагинация.
+    """
+    index = {}
+    for category in tree:
+        entries = sorted(
+            ((sub["name"], product["name"], product["id"]), {**product, "subcategory": sub["name"]})
+            for sub in category["subcategories"]
+            for product in sub["products"]
+        )
+        index[category["name"]] = {
+            "keys": [key for key, _ in entries],
+            "products": [product for _, product in entries],
+        }
+    return index
+
+
+def _encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    """Разбирает курсор обратно в ключ (подкатегория, название, id); иначе бросает ValueError."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    # Ключ другой формы (например, [1]) нельзя сравнивать с ключами каталога в bisect
+    if not isinstance(key, list) or len(key) != 3 or not all(isinstance(part, str) for part in key):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return tuple(key)
+
+
+def parse_fields(fields_param: str | None) -> tuple[str, ...]:
+    """Разбирает параметр fields=; неизвестные поля отбрасываются. id возвращается всегда."""
+    if not fields_param:
+        return LIST_FIELDS
+    requested = [field.strip() for field in fields_param.split(',')]
+    return ("id", *(field for field in PRODUCT_FIELDS if field in requested and field != "id"))
+
+
+def get_category_page(
+    catalog: dict, category: str, cursor: str | None = None, limit: int = 20,
+    fields: tuple[str, ...] = LIST_FIELDS, subcategory: str | None = None
+) -> dict:
+    """
+    Возвращает страницу товаров категории: {"items": [...], "nextCursor": str | None}.
+    Бросает KeyError для неизвестной категории и ValueError для некорректного курсора.
+    """
+    category_index = catalog["category_index"][category]
+    keys, products = category_index["keys"], category_index["products"]
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if cursor:
+        start = bisect.bisect_right(keys, _decode_cursor(cursor))
+    elif subcategory:
+        start = bisect.bisect_left(keys, (subcategory,))
+    else:
+        start = 0
+
+    items = []
+    position = start
+    while position < len(products) and len(items) < limit:
+        product = products[position]
+        if subcategory and product["subcategory"] != subcategory:
+            break
+        items.append({field: product.get(field) for field in fields})
+        position += 1
+
+    has_more = position < len(products) and (not subcategory or products[position]["subcategory"] == subcategory)
+    return {
+        "items": items,
+        "nextCursor": _encode_cursor(keys[position - 1]) if has_more and items else None,
+    }
+
+
+def search_products(catalog: dict, query: str, limit: int = 20, fields: tuple[str, ...] = LIST_FIELDS) -> list[dict]:
+    """Ищет товары по названию и описанию в индексе текущей версии каталога."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    products_by_id = catalog["products_by_id"]
+    return [
+        {field: products_by_id[product_id].get(field) for field in fields}
+        for product_id in catalog["search_index"].search(query, limit=limit)
+    ]
+
+
+def compress_variants(body: bytes) -> dict[str, bytes]:
+    """Возвращает тело ответа в исходном виде и в сжатых вариантах {кодировка: байты}."""
+    variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=11)
+    return variants
+
+
+async def _build_catalog(version: int) -> dict:
+    """Загружает товары из БД и сериализует каталог в байты."""
+    all_products = await get_all_products()
+    if not all_products:
+        logger.warning("Products table is empty or could not be read. Returning empty catalog.")
+
+    tree = build_catalog_tree(all_products)
+    body = json.dumps(tree, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    skeleton_body = json.dumps(build_catalog_skeleton(tree), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    # Сжимаем один раз на версию каталога, вне event loop
+    variants = await asyncio.to_thread(compress_variants, body)
+    skeleton_variants = await asyncio.to_thread(compress_variants, skeleton_body)
+    category_index = _build_category_index(tree)
+    products_by_id = {
+        product["id"]: product for entry in category_index.values() for product in entry["products"]
+    }
+    logger.info(
+        f"Catalog v{version} built: {len(all_products)} products, {len(tree)} categories, "
+        + ", ".join(f"{encoding}={len(data)}" for encoding, data in variants.items()) + " bytes."
+    )
+    return {
+        "version": version,
+        "tree": tree,
+        "body": body,
+        "variants": variants,
+        # Сильный ETag по содержимому - одинаков во всех репликах для одного каталога.
+        # Для сжатых вариантов к нему добавляется суффикс кодировки.
+        "etag": f'"{hashlib.sha1(body).hexdigest()}"',
+        "skeleton": {
+            "variants": skeleton_variants,
+            "etag": f'"{hashlib.sha1(skeleton_body).hexdigest()}"',
+        },
+        "category_index": category_index,
+        "products_by_id": products_by_id,
+        "search_index": ProductSearchIndex(list(products_by_id.values())),
+        # HTTP-даты имеют точность до секунды
+        "last_modified": datetime.now(timezone.utc).replace(microsecond=0),
+    }
+
+
+async def get_catalog() -> dict:
+    """Возвращает закэшированный каталог, пересобирая его при изменении товаров."""
+    global _catalog_cache
+    version = get_products_version()
+    if _catalog_cache is not None and _catalog_cache["version"] == version:
+        return _catalog_cache
+
+    async with _catalog_lock:
+        # Пока ждали блокировку, каталог мог собрать другой запрос
+        version = get_products_version()
+        if _catalog_cache is None or _catalog_cache["version"] != version:
+            new_catalog = await _build_catalog(version)
+            # Если содержимое не изменилось, сохраняем прежнюю дату, чтобы не сбивать кэши клиентов
+            if _catalog_cache is not None and _catalog_cache["etag"] == new_catalog["etag"]:
+                new_catalog["last_modified"] = _catalog_cache["last_modified"]
+            _catalog_cache = new_catalog
+        return _catalog_cache
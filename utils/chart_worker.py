@@ -0,0 +1,87 @@
+import io
+
+# Точка входа процесса отрисовки графиков (см. utils.charts). Модуль не зависит от бота и БД:
+# matplotlib загружается один раз инициализатором процесса, а не при каждом графике.
+plt = None
+
+
+def init_worker() -> None:
+    """Инициализатор процесса пула: загружает matplotlib с бэкендом без GUI и задает стиль."""
+    global plt
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as pyplot
+    pyplot.style.use('seaborn-v0_8-darkgrid')
+    plt = pyplot
+
+
+def _figure_to_png(fig) -> bytes:
+    buf = io.BytesIO()
+    fig.tight_layout()
+    fig.savefig(buf, format='png')
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def _render_bar_chart(labels: list[str], values: list[int], title: str, xlabel: str, ylabel: str) -> bytes:
+    """Горизонтальная столбчатая диаграмма (самый популярный элемент сверху)."""
+    fig, ax = plt.subplots(figsize=(10, max(6, len(labels) * 0.5)))
+
+    bars = ax.barh(labels, values, color='skyblue')
+    ax.set_title(title, fontsize=16, pad=20)
+    ax.set_xlabel(ylabel, fontsize=12)
+    ax.set_ylabel(xlabel, fontsize=12)
+    ax.invert_yaxis()
+
+    # Добавляем значения на бары
+    for bar in bars:
+        ax.text(bar.get_width() + (max(values) * 0.01), bar.get_y() + bar.get_height()/2, f'{bar.get_width()}', va='center')
+
+    return _figure_to_png(fig)
+
+
+def _render_line_chart(labels: list[str], values: list[float], title: str, xlabel: str, ylabel: str) -> bytes:
+    """Линейный график временного ряда."""
+    fig, ax = plt.subplots(figsize=(12, 6))
+
+    ax.plot(labels, values, marker='o', color='steelblue')
+    ax.fill_between(labels, values, alpha=0.15, color='steelblue')
+    ax.set_title(title, fontsize=16, pad=20)
+    ax.set_xlabel(xlabel, fontsize=12)
+    ax.set_ylabel(ylabel, fontsize=12)
+    # Подписываем не больше ~15 дат, чтобы они не налезали друг на друга
+    step = max(1, len(labels) // 15)
+    ax.set_xticks(range(0, len(labels), step))
+    ax.set_xticklabels(labels[::step], rotation=45, ha='right')
+
+    return _figure_to_png(fig)
+
+
+def _render_distribution_chart(
+    weekday_labels: list[str], weekday_values: list[int], hour_labels: list[str], hour_values: list[int], title: str
+) -> bytes:
+    """Две столбчатые диаграммы: распределение по дням недели и по часам."""
+    fig, (ax_weekday, ax_hour) = plt.subplots(2, 1, figsize=(12, 9))
+    fig.suptitle(title, fontsize=16)
+
+    ax_weekday.bar(weekday_labels, weekday_values, color='skyblue')
+    ax_weekday.set_title("По дням недели", fontsize=13)
+    ax_weekday.set_ylabel("Количество записей", fontsize=11)
+
+    ax_hour.bar(hour_labels, hour_values, color='lightcoral')
+    ax_hour.set_title("По времени записи", fontsize=13)
+    ax_hour.set_ylabel("Количество записей", fontsize=11)
+
+    return _figure_to_png(fig)
+
+
+_RENDERERS = {
+    "bar": _render_bar_chart,
+    "line": _render_line_chart,
+    "distribution": _render_distribution_chart,
+}
+
+
+def render(kind: str, *args) -> bytes:
+    """Рисует график указанного типа и возвращает PNG."""
+    return _RENDERERS[kind](*args)
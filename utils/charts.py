@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import importlib.util
+import json
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import chart_worker
+
+logger = logging.getLogger(__name__)
+
+CHART_CACHE_SIZE = 32
+
+# Графики рисуются в отдельном процессе, чтобы matplotlib не блокировал event loop
+# (и не держал GIL). Пул создается при первом запросе графика. Процесс запускается через spawn
+# и при старте заново импортирует главный модуль (bot.py, без запуска main) - это разовая цена
+# на время жизни пула. Сам matplotlib загружается только в нем, инициализатором chart_worker.
+_executor: ProcessPoolExecutor | None = None
+# Кэш готовых PNG: отпечаток данных -> байты. Одинаковые данные не рисуются повторно.
+_chart_cache: OrderedDict[str, bytes] = OrderedDict()
+_matplotlib_installed = importlib.util.find_spec("matplotlib") is not None
+
+
+def is_available() -> bool:
+    """Проверяет, установлена ли библиотека для построения графиков (pip install matplotlib)."""
+    return _matplotlib_installed
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: дочерний процесс не наследует состояние event loop, пулов соединений и потоков
+        _executor = ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn"), initializer=chart_worker.init_worker
+        )
+    return _executor
+
+
+async def render_chart(kind: str, *args) -> bytes | None:
+    """
+    Рисует график в пуле процессов и возвращает PNG. Результат кэшируется по отпечатку
+    типа графика и данных. Возвращает None, если matplotlib не установлен.
+    """
+    if not is_available():
+        return None
+
+    fingerprint = hashlib.sha1(json.dumps([kind, args], ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+    if fingerprint in _chart_cache:
+        _chart_cache.move_to_end(fingerprint)
+        return _chart_cache[fingerprint]
+
+    loop = asyncio.get_running_loop()
+    png = await loop.run_in_executor(_get_executor(), chart_worker.render, kind, *args)
+
+    _chart_cache[fingerprint] = png
+    if len(_chart_cache) > CHART_CACHE_SIZE:
+        _chart_cache.popitem(last=False)
+    logger.debug(f"Chart '{kind}' rendered ({len(png)} bytes), cache size {len(_chart_cache)}.")
+    return png
+
+
+def shutdown_chart_executor() -> None:
+    """Останавливает пул процессов для графиков при выключении бота."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -45,4 +45,14 @@ WORKING_HOURS = [
     "08:00", "09:00", "10:00", "11:00", "12:00", "13:00",
     "14:00", "15:00", "16:00", "17:00", "18:00"
     # Последняя запись на 18:00, так как работа до 19:00
-]
\ No newline at end of file
+]
+# Параметры, от которых зависит цена услуги, в порядке вложенности в прайс-листе (data/prices.json).
+# Для каждого параметра - ключ в данных записи и все допустимые значения.
+SERVICE_PRICE_OPTIONS = {
+    "polishing": (("car_size", CAR_SIZES), ("service_type", POLISHING_TYPES)),
+    "ceramics": (("car_size", CAR_SIZES), ("service_type", CERAMICS_TYPES)),
+    "wrapping": (("car_size", CAR_SIZES), ("service_type", WRAPPING_TYPES)),
+    "dry_cleaning": (("car_size", CAR_SIZES), ("interior_type", INTERIOR_TYPES), ("dirt_level", DIRT_LEVELS)),
+    "washing": (),
+    "glass_polishing": (),
+}
@@ -0,0 +1,180 @@
+import asyncio
+import codecs
+import contextlib
+import gzip
+import logging
+import os
+import tempfile
+from datetime import datetime
+
+from database.db import (
+    export_bookings_csv, export_orders_csv, ANALYTICS_DATASETS, get_export_watermark, get_export_upper_bound,
+    iter_analytics_rows
+)
+
+# Для выгрузки в Parquet. Не забудьте установить: pip install pyarrow
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+_CSV_EXPORTERS = {
+    "bookings": export_bookings_csv,
+    "orders": export_orders_csv,
+}
+
+
+async def export_csv_to_file(
+    kind: str, start_date: datetime | None = None, end_date: datetime | None = None, compress: bool = False
+) -> str | None:
+    """
+    Выгружает записи ('bookings') или заказы ('orders') за период во временный CSV-файл
+    (с BOM, чтобы Excel правильно определил кодировку), при compress=True - сжатый gzip.
+    Данные пишутся на диск по мере получения из БД. Возвращает путь к файлу
+    или None, если за период нет данных; удалить файл после отправки должен вызывающий код.
+    """
+    exporter = _CSV_EXPORTERS[kind]
+    fd, path = tempfile.mkstemp(prefix=f"{kind}_", suffix=".csv.gz" if compress else ".csv")
+    raw_file = os.fdopen(fd, "wb")
+    stream = gzip.GzipFile(fileobj=raw_file, mode="wb") if compress else raw_file
+
+    async def _write(chunk: bytes) -> None:
+        # Запись и сжатие - в потоке, чтобы не блокировать event loop
+        await asyncio.to_thread(stream.write, chunk)
+
+    try:
+        stream.write(codecs.BOM_UTF8)
+        rows_count = await exporter(_write, start_date, end_date)
+    except BaseException:
+        stream.close()
+        raw_file.close()
+        os.remove(path)
+        raise
+    await asyncio.to_thread(stream.close)
+    raw_file.close()
+    if not rows_count:
+        os.remove(path)
+        logger.info(f"No {kind} to export for the period.")
+        return None
+    logger.info(f"Exported {rows_count} {kind} to {path} ({os.path.getsize(path)} bytes, gzip={compress}).")
+    return path
+
+
+# Явные схемы наборов данных для аналитики: даты и время - настоящими типами, суммы - целыми рублями.
+# Порядок и имена колонок совпадают с запросами database.db._ANALYTICS_QUERIES.
+if pa is not None:
+    _TIMESTAMP = pa.timestamp("us", tz="UTC")
+    ANALYTICS_SCHEMAS = {
+        "bookings": pa.schema([
+            pa.field("booking_id", pa.int32(), nullable=False),
+            pa.field("user_id", pa.int64(), nullable=False),
+            pa.field("service_name", pa.string(), nullable=False),
+            pa.field("booking_date", pa.date32(), nullable=False),
+            pa.field("booking_time", pa.time64("us"), nullable=False),
+            pa.field("status", pa.string()),
+            pa.field("price_rub", pa.int32(), nullable=False),
+            pa.field("discount_rub", pa.int32()),
+            pa.field("promocode", pa.string()),
+            pa.field("created_at", _TIMESTAMP),
+            pa.field("updated_at", _TIMESTAMP, nullable=False),
+        ]),
+        "orders": pa.schema([
+            pa.field("order_id", pa.int32(), nullable=False),
+            pa.field("user_id", pa.int64(), nullable=False),
+            pa.field("status", pa.string()),
+            pa.field("items_price_rub", pa.int32(), nullable=False),
+            pa.field("delivery_cost_rub", pa.int32()),
+            pa.field("discount_rub", pa.int32()),
+            pa.field("total_price_rub", pa.int32(), nullable=False),
+            pa.field("promocode", pa.string()),
+            pa.field("shipping_method", pa.string()),
+            pa.field("created_at", _TIMESTAMP),
+            pa.field("updated_at", _TIMESTAMP, nullable=False),
+        ]),
+        "order_items": pa.schema([
+            pa.field("item_id", pa.int32(), nullable=False),
+            pa.field("order_id", pa.int32(), nullable=False),
+            pa.field("product_id", pa.string(), nullable=False),
+            pa.field("quantity", pa.int32(), nullable=False),
+            pa.field("price_per_item_rub", pa.int32(), nullable=False),
+            pa.field("order_updated_at", _TIMESTAMP, nullable=False),
+        ]),
+        "users": pa.schema([
+            pa.field("user_id", pa.int64(), nullable=False),
+            pa.field("full_name", pa.string(), nullable=False),
+            pa.field("username", pa.string()),
+            pa.field("phone_normalized", pa.string()),
+            pa.field("first_seen", _TIMESTAMP),
+            pa.field("is_blocked", pa.bool_()),
+            pa.field("bot_blocked_at", _TIMESTAMP),
+            pa.field("updated_at", _TIMESTAMP, nullable=False),
+        ]),
+    }
+else:
+    ANALYTICS_SCHEMAS = {}
+
+
+def is_parquet_available() -> bool:
+    """Проверяет, установлена ли библиотека для выгрузки в Parquet."""
+    return pa is not None
+
+
+def _write_parquet_batch(writer, schema, rows: list[dict]) -> None:
+    writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+
+
+async def _export_dataset_parquet(dataset: str, since: datetime | None, until: datetime) -> tuple[str, int]:
+    """Выгружает строки набора, измененные в [since, until), во временный Parquet-файл. Возвращает путь и число строк."""
+    schema = ANALYTICS_SCHEMAS[dataset].with_metadata({
+        "dataset": dataset,
+        "since": since.isoformat() if since else "",
+        "until": until.isoformat(),
+    })
+    fd, path = tempfile.mkstemp(prefix=f"{dataset}_", suffix=".parquet")
+    os.close(fd)
+    writer = pq.ParquetWriter(path, schema, compression="zstd")
+    rows_count = 0
+    try:
+        # aclosing: при ошибке записи курсор, транзакция и соединение освобождаются сразу
+        async with contextlib.aclosing(iter_analytics_rows(dataset, since, until)) as batches:
+            async for rows in batches:
+                # Сборка колонок и сжатие - в потоке, чтобы не блокировать event loop
+                await asyncio.to_thread(_write_parquet_batch, writer, schema, rows)
+                rows_count += len(rows)
+    except BaseException:
+        writer.close()
+        os.remove(path)
+        raise
+    await asyncio.to_thread(writer.close)
+    return path, rows_count
+
+
+async def export_analytics_parquet(full: bool = False) -> tuple[dict[str, tuple[str, int]], datetime]:
+    """
+    Выгружает записи, заказы, позиции заказов и пользователей в Parquet-файлы для аналитики.
+    По умолчанию - только строки, измененные после последней отметки выгрузки (export_watermarks),
+    при full=True - все данные. Возвращает {набор: (путь, число строк)} для непустых наборов
+    и новую отметку. Сохранить отметку (set_export_watermark) и удалить файлы должен вызывающий код.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed")
+
+    until = await get_export_upper_bound()
+    files: dict[str, tuple[str, int]] = {}
+    try:
+        for dataset in ANALYTICS_DATASETS:
+            since = None if full else await get_export_watermark(dataset)
+            path, rows_count = await _export_dataset_parquet(dataset, since, until)
+            if rows_count:
+                files[dataset] = (path, rows_count)
+            else:
+                os.remove(path)
+    except BaseException:
+        for path, _ in files.values():
+            os.remove(path)
+        raise
+    logger.info(f"Analytics export (full={full}) up to {until}: " + ", ".join(f"{d}={n}" for d, (_, n) in files.items()))
+    return files, until
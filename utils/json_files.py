@@ -0,0 +1,106 @@
+import asyncio
+import codecs
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+# Быстрый кодек JSON. Не обязателен: pip install orjson, без него используется стандартный json.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+JSON_IO_WORKERS = 2
+
+# Чтение, разбор, сериализация и запись файлов выполняются в отдельных потоках,
+# чтобы большой файл не останавливал обработку обновлений event loop'ом.
+_executor: ThreadPoolExecutor | None = None
+# После остановки новые операции не принимаются, иначе они создали бы пул, который никто не остановит
+_shut_down = False
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _shut_down:
+        raise RuntimeError("JSON file I/O executor has been shut down")
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=JSON_IO_WORKERS, thread_name_prefix="json-io")
+    return _executor
+
+
+def _decode(raw: bytes) -> Any:
+    if raw.startswith(codecs.BOM_UTF8):
+        raw = raw[len(codecs.BOM_UTF8):]
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode('utf-8'))
+
+
+def _encode(data: Any) -> bytes:
+    # Формат файла не зависит от установленного кодека: отступ 2 пробела (orjson умеет только его),
+    # нестроковые ключи словарей приводятся к строкам, как в стандартном json
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def _read_file(file_path: str) -> Any:
+    with open(file_path, 'rb') as f:
+        return _decode(f.read())
+
+
+def _write_file_atomic(file_path: str, data: Any) -> None:
+    """
+    Записывает данные во временный файл в той же папке, сбрасывает его на диск (fsync)
+    и атомарно заменяет им исходный файл. При сбое на диске остается либо старая, либо новая версия.
+    """
+    directory = os.path.dirname(file_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    payload = _encode(data)
+    temp_fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(temp_fd, 'wb') as temp_f:
+            temp_f.write(payload)
+            temp_f.flush()
+            os.fsync(temp_f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    # Сохраняем на диск и саму запись о переименовании (на Windows каталог открыть нельзя)
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+async def read_json(file_path: str) -> Any:
+    """
+    Читает и разбирает JSON файл в пуле потоков (BOM в начале файла допускается).
+    Ошибки FileNotFoundError и ValueError (некорректный JSON) передаются вызывающему коду.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _read_file, file_path)
+
+
+async def write_json(file_path: str, data: Any) -> None:
+    """Сериализует данные и атомарно записывает их в JSON файл с fsync, в пуле потоков."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_get_executor(), _write_file_atomic, file_path, data)
+
+
+def shutdown_json_executor() -> None:
+    """Останавливает пул потоков файлового ввода-вывода при выключении бота."""
+    global _executor, _shut_down
+    _shut_down = True
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
@@ -0,0 +1,39 @@
+import itertools
+from typing import Any, Mapping
+
+from utils.constants import SERVICE_PRICE_OPTIONS
+
+
+def price_key(data: Mapping[str, Any]) -> tuple:
+    """Ключ цены для данных записи: (услуга, значения параметров услуги по порядку)."""
+    service = data.get('service')
+    return (service, *(data.get(field) for field, _ in SERVICE_PRICE_OPTIONS.get(service, ())))
+
+
+def _lookup(node: Any, path: tuple[str, ...]) -> int | None:
+    for value in path:
+        # Число на верхнем уровне - единая цена для всех вариантов ниже (например, "wrapping": 50000)
+        if not isinstance(node, Mapping):
+            break
+        node = node.get(value)
+    if isinstance(node, int) and not isinstance(node, bool):
+        return node
+    return None
+
+
+def compile_price_index(prices: Mapping[str, Any]) -> tuple[dict[tuple, int], list[str]]:
+    """
+    Разворачивает вложенный прайс-лист в плоскую таблицу {ключ цены: цена} для всех
+    допустимых сочетаний параметров из SERVICE_PRICE_OPTIONS.
+    Возвращает таблицу и список сочетаний без цены (в виде 'услуга/параметр/...').
+    """
+    index: dict[tuple, int] = {}
+    missing: list[str] = []
+    for service, options in SERVICE_PRICE_OPTIONS.items():
+        for path in itertools.product(*(values for _, values in options)):
+            price = _lookup(prices.get(service), path)
+            if price is None:
+                missing.append("/".join((service, *path)))
+            else:
+                index[(service, *path)] = price
+    return index, missing
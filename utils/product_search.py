@@ -0,0 +1,141 @@
+import bisect
+import re
+from collections import defaultdict
+
+# Веса полей: совпадение в названии важнее совпадения в описании
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Веса типов совпадения токена запроса с токеном из индекса
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.8
+FUZZY_MATCH = 0.5
+
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 4
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Разбивает текст на нормализованные токены (регистр и 'ё' не учитываются)."""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(_normalize(text).replace("<br>", " ").replace("&lt;br&gt;", " "))
+
+
+def _trigrams(token: str) -> set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _max_typos(token: str) -> int:
+    return 1 if len(token) <= 6 else 2
+
+
+def _within_distance(a: str, b: str, max_distance: int) -> bool:
+    """Проверяет, что расстояние Левенштейна между строками не больше max_distance."""
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+class ProductSearchIndex:
+    """
+    Инвертированный индекс по названиям и описаниям товаров.
+    Строится один раз на версию каталога; поиск поддерживает префиксы
+    (поиск по мере ввода) и опечатки (через триграммы и расстояние Левенштейна).
+    """
+
+    def __init__(self, products: list[dict]):
+        self._postings: dict[str, dict[str, float]] = defaultdict(dict)
+        self._trigram_index: dict[str, set[str]] = defaultdict(set)
+        self._order: dict[str, int] = {}
+
+        for position, product in enumerate(products):
+            product_id = product["id"]
+            self._order[product_id] = position
+            for field, weight in (("name", NAME_WEIGHT), ("description", DESCRIPTION_WEIGHT)):
+                for token in tokenize(product.get(field)):
+                    postings = self._postings[token]
+                    postings[product_id] = max(postings.get(product_id, 0), weight)
+
+        self._vocabulary = sorted(self._postings)
+        for token in self._vocabulary:
+            for trigram in _trigrams(token):
+                self._trigram_index[trigram].add(token)
+
+    def _prefix_tokens(self, prefix: str) -> list[str]:
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + "\uffff")
+        return self._vocabulary[start:end]
+
+    def _fuzzy_tokens(self, token: str) -> list[str]:
+        query_trigrams = _trigrams(token)
+        candidate_hits: dict[str, int] = defaultdict(int)
+        for trigram in query_trigrams:
+            for candidate in self._trigram_index.get(trigram, ()):
+                candidate_hits[candidate] += 1
+
+        max_distance = _max_typos(token)
+        # Отсекаем кандидатов, у которых слишком мало общих триграмм, до дорогой проверки
+        min_hits = max(1, len(query_trigrams) - 3 * max_distance)
+        return [
+            candidate for candidate, hits in candidate_hits.items()
+            if hits >= min_hits and _within_distance(token, candidate, max_distance)
+        ]
+
+    def _match_token(self, token: str) -> dict[str, float]:
+        """Возвращает {product_id: score} для одного токена запроса."""
+        scores: dict[str, float] = {}
+
+        def _add(tokens: list[str], match_weight: float) -> None:
+            for matched in tokens:
+                for product_id, field_weight in self._postings[matched].items():
+                    scores[product_id] = max(scores.get(product_id, 0), match_weight * field_weight)
+
+        if token in self._postings:
+            _add([token], EXACT_MATCH)
+        if len(token) >= MIN_PREFIX_LENGTH:
+            _add([t for t in self._prefix_tokens(token) if t != token], PREFIX_MATCH)
+        if len(token) >= MIN_FUZZY_LENGTH and not scores:
+            _add(self._fuzzy_tokens(token), FUZZY_MATCH)
+        return scores
+
+    def search(self, query: str, limit: int = 20) -> list[str]:
+        """
+        Возвращает ID товаров, отсортированные по релевантности.
+        Сначала идут товары, совпавшие со всеми словами запроса, затем по сумме весов.
+        """
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return []
+
+        matched_tokens: dict[str, int] = defaultdict(int)
+        total_scores: dict[str, float] = defaultdict(float)
+        for token in query_tokens:
+            for product_id, score in self._match_token(token).items():
+                matched_tokens[product_id] += 1
+                total_scores[product_id] += score
+
+        ranked = sorted(
+            total_scores,
+            key=lambda product_id: (-matched_tokens[product_id], -total_scores[product_id], self._order[product_id])
+        )
+        return ranked[:limit]
@@ -0,0 +1,37 @@
+import logging
+from datetime import datetime
+
+from database.db import get_promocode
+
+logger = logging.getLogger(__name__)
+
+
+async def validate_promocode(code: str | None, promo_type: str | None = None) -> tuple[dict | None, str | None]:
+    """
+    Проверяет промокод: существование, тип, срок действия и лимит использований.
+    Возвращает кортеж (данные промокода, None) для валидного промокода
+    или (None, причина) - 'not_found', 'wrong_type', 'expired', 'limit_reached', 'invalid_format'.
+    """
+    promo_data = await get_promocode(code) if code else None
+    if not promo_data:
+        return None, "not_found"
+
+    if promo_type is not None and promo_data.get("type") != promo_type:
+        return None, "wrong_type"
+
+    try:
+        today = datetime.now().date()
+        start_date = datetime.strptime(promo_data.get("start_date"), "%Y-%m-%d").date()
+        end_date = datetime.strptime(promo_data.get("end_date"), "%Y-%m-%d").date()
+
+        if not (start_date <= today <= end_date):
+            return None, "expired"
+
+        usage_limit = promo_data.get("usage_limit")
+        if usage_limit is not None and promo_data.get("times_used", 0) >= usage_limit:
+            return None, "limit_reached"
+    except (ValueError, KeyError, TypeError):
+        logger.warning(f"Promocode {code} has invalid data format: {promo_data}")
+        return None, "invalid_format"
+
+    return promo_data, None
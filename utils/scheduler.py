@@ -5,7 +5,7 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.jobstores.base import JobLookupError
 
 from config import REMINDER_HOURS_BEFORE, ADMIN_IDS, DAILY_REPORT_TIME, WEEKLY_REPORT_DAY_OF_WEEK, WEEKLY_REPORT_TIME
-from database.db import get_all_bookings
+from database.db import get_all_bookings, refresh_daily_metrics
 from utils.bot_instance import bot_instance
 from utils.reports import generate_period_report_text
 
@@ -96,6 +96,8 @@ def schedule_reports():
         weekly_hour, weekly_minute = map(int, WEEKLY_REPORT_TIME.split(':'))
         scheduler.add_job(send_report, 'cron', day_of_week='*', hour=daily_hour, minute=daily_minute, args=[1], id="daily_report")
         scheduler.add_job(send_report, 'cron', day_of_week=WEEKLY_REPORT_DAY_OF_WEEK, hour=weekly_hour, minute=weekly_minute, args=[7], id="weekly_report")
+        # Основной пересчет агрегатов статистики; при чтении они пересчитываются, только если период затронут изменениями
+        scheduler.add_job(refresh_daily_metrics, 'interval', minutes=10, id="refresh_daily_metrics", replace_existing=True)
         logger.info(f"Scheduled daily reports for {DAILY_REPORT_TIME} and weekly for {WEEKLY_REPORT_DAY_OF_WEEK} at {WEEKLY_REPORT_TIME}.")
     except Exception as e:
         logger.error(f"Failed to schedule reports: {e}")
\ No newline at end of file
@@ -12,20 +12,24 @@ document.addEventListener('DOMContentLoaded', () => {
     const closeModalBtn = document.querySelector('.close-btn');
     const prevBtn = document.querySelector('.prev-btn');
     const nextBtn = document.querySelector('.next-btn');
-    let allCategoriesData = []; // Хранилище всех данных каталога
+    let allCategoriesData = []; // Структура каталога: категории и подкатегории с количеством товаров
 
-    let allProducts = {}; // Хранилище всех товаров по ID для быстрого доступа
+    let allProducts = {}; // Хранилище всех загруженных товаров по ID для быстрого доступа
     let currentGalleryImages = [];
     let currentImageIndex = 0;
     let cart = {}; // Наша корзина { productId: quantity }
 
-    // --- 1. Загрузка товаров с сервера ---
+    // Используем ПОЛНЫЙ АБСОЛЮТНЫЙ путь к вашему серверу на Render.
+    const apiBaseUrl = 'https://btdetailing.onrender.com/api';
+    const PAGE_SIZE = 20;
+
+    // --- 1. Загрузка структуры каталога с сервера ---
     async function fetchProducts() {
-        // Используем ПОЛНЫЙ АБСОЛЮТНЫЙ путь к вашему серверу на Render.
-        const apiUrl = 'https://btdetailing.onrender.com/api/products'; 
-        
+        // Для первой отрисовки нужна только структура разделов, без самих товаров
+        const apiUrl = `${apiBaseUrl}/catalog/categories`;
+
         // Лог для отладки, чтобы видеть, куда идет запрос
-        console.log(`Fetching products from: ${apiUrl}`);
+        console.log(`Fetching catalog structure from: ${apiUrl}`);
 
         // Показываем индикатор загрузки
         catalogContainer.innerHTML = '<div class="loader"></div>';
@@ -36,16 +40,6 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(`Ошибка сети: ${response.status}`);
             }
             allCategoriesData = await response.json();
-
-            // Сохраняем все товары в allProducts для быстрого доступа (для корзины и поиска)
-            // Более надежная проверка, которая не упадет, даже если данные некорректны
-            (allCategoriesData || []).forEach(cat => {
-                (cat?.subcategories || []).forEach(subcat => {
-                    (subcat?.products || []).forEach(prod => {
-                        allProducts[prod.id] = prod;
-                    })
-                });
-            });
             renderCategoryMenu(); // Рендерим меню категорий вместо всего каталога
         } catch (error) {
             catalogContainer.innerHTML = `<div class="error-message">Не удалось загрузить товары. Попробуйте позже.</div>`;
@@ -53,6 +47,33 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Загружает одну страницу товаров категории (без описаний и детальных фото)
+    async function fetchCategoryPage(categoryName, cursor) {
+        const params = new URLSearchParams({ category: categoryName, limit: PAGE_SIZE });
+        if (cursor) params.set('cursor', cursor);
+        const response = await fetch(`${apiBaseUrl}/catalog/products?${params}`);
+        if (!response.ok) {
+            throw new Error(`Ошибка сети: ${response.status}`);
+        }
+        const page = await response.json();
+        (page?.items || []).forEach(prod => {
+            allProducts[prod.id] = { ...(allProducts[prod.id] || {}), ...prod };
+        });
+        return page;
+    }
+
+    // Загружает полную карточку товара (описание и детальные фото), если ее еще нет
+    async function fetchProductDetails(productId) {
+        const product = allProducts[productId];
+        if (product && product.detailImages !== undefined) return product;
+        const response = await fetch(`${apiBaseUrl}/catalog/products/${encodeURIComponent(productId)}`);
+        if (!response.ok) {
+            throw new Error(`Ошибка сети: ${response.status}`);
+        }
+        allProducts[productId] = { ...(product || {}), ...(await response.json()) };
+        return allProducts[productId];
+    }
+
     // --- 2. Отрисовка меню категорий ---
     function renderCategoryMenu() {
         catalogContainer.innerHTML = '';
@@ -81,7 +102,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- 3. Отрисовка товаров для выбранной категории ---
-    function renderProductsForCategory(categoryName) {
+    async function renderProductsForCategory(categoryName) {
         catalogContainer.innerHTML = '';
         const selectedCategory = allCategoriesData.find(cat => cat.name === categoryName);
 
@@ -104,35 +125,61 @@ document.addEventListener('DOMContentLoaded', () => {
         categoryTitle.className = 'category-title';
         categoryTitle.textContent = selectedCategory.name;
         categoryElement.appendChild(categoryTitle);
+        catalogContainer.appendChild(categoryElement);
 
-        const subcategories = selectedCategory.subcategories || [];
-        if (subcategories.length === 0 || subcategories.every(s => !s?.products?.length)) {
+        if (!selectedCategory.productCount) {
             const noProducts = document.createElement('p');
             noProducts.className = 'info-message';
             noProducts.textContent = 'В этом разделе пока нет товаров.';
             categoryElement.appendChild(noProducts);
-        } else {
-            subcategories.forEach(subcategory => {
-                const products = subcategory?.products || [];
-                if (products.length === 0) return;
-
-                const subcategoryTitle = document.createElement('h3');
-                subcategoryTitle.className = 'subcategory-title';
-                subcategoryTitle.textContent = subcategory.name;
-                categoryElement.appendChild(subcategoryTitle);
-
-                const productsGrid = document.createElement('div');
-                productsGrid.className = 'products-grid';
+            return;
+        }
 
-                products.forEach(product => {
-                    const productCard = createProductCard(product);
-                    productsGrid.appendChild(productCard);
+        // Товары приходят отсортированными по подкатегориям, поэтому новая
+        // подкатегория начинается, когда меняется поле subcategory.
+        let currentSubcategory = null;
+        let productsGrid = null;
+        const loadMoreButton = document.createElement('button');
+        loadMoreButton.className = 'back-to-menu-btn';
+        loadMoreButton.textContent = 'Показать еще';
+
+        async function loadPage(cursor) {
+            loadMoreButton.remove();
+            const loader = document.createElement('div');
+            loader.className = 'loader';
+            categoryElement.appendChild(loader);
+            try {
+                const page = await fetchCategoryPage(categoryName, cursor);
+                loader.remove();
+                (page.items || []).forEach(product => {
+                    if (product.subcategory !== currentSubcategory || !productsGrid) {
+                        currentSubcategory = product.subcategory;
+                        const subcategoryTitle = document.createElement('h3');
+                        subcategoryTitle.className = 'subcategory-title';
+                        subcategoryTitle.textContent = currentSubcategory;
+                        categoryElement.appendChild(subcategoryTitle);
+
+                        productsGrid = document.createElement('div');
+                        productsGrid.className = 'products-grid';
+                        categoryElement.appendChild(productsGrid);
+                    }
+                    productsGrid.appendChild(createProductCard(allProducts[product.id]));
                 });
-                categoryElement.appendChild(productsGrid);
-            });
+                if (page.nextCursor) {
+                    loadMoreButton.onclick = () => loadPage(page.nextCursor);
+                    categoryElement.appendChild(loadMoreButton);
+                }
+            } catch (error) {
+                loader.remove();
+                const errorMessage = document.createElement('div');
+                errorMessage.className = 'error-message';
+                errorMessage.textContent = 'Не удалось загрузить товары. Попробуйте позже.';
+                categoryElement.appendChild(errorMessage);
+                console.error("Ошибка при загрузке товаров:", error);
+            }
         }
 
-        catalogContainer.appendChild(categoryElement);
+        await loadPage(null);
     }
 
     // --- 4. Создание карточки товара ---
@@ -182,8 +229,14 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- 5. Логика галереи ---
-    function openGallery(productId) {
-        const product = allProducts[productId];
+    async function openGallery(productId) {
+        let product;
+        try {
+            product = await fetchProductDetails(productId);
+        } catch (error) {
+            console.error("Ошибка при загрузке карточки товара:", error);
+            product = allProducts[productId];
+        }
         if (!product) return;
 
         // Собираем все фото: главное + детальные
@@ -246,33 +299,69 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     // --- 7. Логика поиска ---
+    // Поиск выполняется на сервере по индексу всего каталога, поэтому не требует загрузки всех товаров
+    let searchTimer = null;
+    let searchRequestId = 0;
+
+    async function fetchSearchResults(query) {
+        const params = new URLSearchParams({ q: query, limit: PAGE_SIZE });
+        const response = await fetch(`${apiBaseUrl}/products/search?${params}`);
+        if (!response.ok) {
+            throw new Error(`Ошибка сети: ${response.status}`);
+        }
+        const result = await response.json();
+        (result?.items || []).forEach(prod => {
+            allProducts[prod.id] = { ...(allProducts[prod.id] || {}), ...prod };
+        });
+        return (result?.items || []).map(prod => allProducts[prod.id]);
+    }
+
     function performSearch(query) {
-        query = query.toLowerCase().trim();
+        query = query.trim();
+        clearTimeout(searchTimer);
 
         if (!query) {
             // Если запрос пустой, показываем основной каталог и прячем результаты поиска
+            searchRequestId++;
             searchResultsContainer.style.display = 'none';
             catalogContainer.style.display = 'block';
             return;
         }
 
+        // Небольшая задержка, чтобы не отправлять запрос на каждое нажатие клавиши
+        searchTimer = setTimeout(() => runSearch(query), 250);
+    }
+
+    async function runSearch(query) {
+        const requestId = ++searchRequestId;
+
         // Показываем результаты поиска и прячем основной каталог
         catalogContainer.style.display = 'none';
         searchResultsContainer.style.display = 'block';
-        searchResultsContainer.innerHTML = ''; // Очищаем предыдущие результаты
 
-        const results = Object.values(allProducts).filter(product => {
-            const nameMatch = product.name.toLowerCase().includes(query);
-            const descriptionMatch = product.description ? product.description.toLowerCase().includes(query) : false;
-            return nameMatch || descriptionMatch;
-        });
+        let results;
+        try {
+            results = await fetchSearchResults(query);
+        } catch (error) {
+            console.error("Ошибка при поиске товаров:", error);
+            results = null;
+        }
+        // Пока ждали ответ, пользователь мог изменить запрос
+        if (requestId !== searchRequestId) return;
+
+        searchResultsContainer.innerHTML = ''; // Очищаем предыдущие результаты
 
         const resultsTitle = document.createElement('h2');
         resultsTitle.className = 'category-title';
         resultsTitle.textContent = `Результаты поиска: "${query}"`;
         searchResultsContainer.appendChild(resultsTitle);
 
-        if (results.length === 0) {
+        if (results === null) {
+            const errorMessage = document.createElement('div');
+            errorMessage.className = 'error-message';
+            errorMessage.textContent = 'Не удалось выполнить поиск. Попробуйте позже.';
+            searchResultsContainer.appendChild(errorMessage);
+        } else if (results.length === 0) {
             const noResults = document.createElement('p');
             noResults.className = 'info-message';
             noResults.textContent = 'Ничего не найдено.';